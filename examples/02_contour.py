@@ -5,14 +5,10 @@ and make a contourf plots.
 Author: James E. T. Smith <james.smith9113@gmail.com>
 Date: 3/29/2020
 """
-import time
 import matplotlib.pyplot as plt
-import numpy as np
-import pandas as pd
 import matplotlib.colors as colors  # For log color scale
-from pyopenms import MSExperiment, MzXMLFile
 
-from msanalysis.data_extraction import read_mzXML
+from msanalysis.data_extraction import align_run
 from msanalysis.plotting import add_custom_ticks
 from msanalysis.plotting.contour import contourf
 from msanalysis.sample_data import get_mzXML_sample_path, get_csv_sample_path
@@ -31,32 +27,19 @@ mzXML_file = get_mzXML_sample_path()
 
 
 #
-# Read CSV Data from LabView
+# Read in mzXML and interpolate the LabView channels (e.g. temperature) onto the
+# timestamps of the scans
 #
-cols = ["time", "b", "temp", "d", "e", "f", "g", "h"]
-df = pd.read_csv(labview_file, names=cols)
-df["time"] -= df["time"][0]
-last_lv_time = np.array(df["time"])[-1]
-
-#
-# Read in mzXML
-#
-data = read_mzXML(mzXML_file)
-mz, intensities, times = data["mz"], data["intensities"], data["times"]
 # Only go as far as LabView data (which we are assuming is always shut off after the mass spec)
-subset = np.where(times <= last_lv_time)[0]
-times = times[subset]
-intensities = intensities[subset]
-
-#
-# Use timestamps from mzXML and Labview to interpolate temperature for each scan
-#
-temp_interp = np.interp(times, df["time"], df["temp"])
+# and only decode the MZ range that is plotted
+mz_lb, mz_ub = (130, 180)
+data = align_run(mzXML_file, labview_file, mz_range=(mz_lb, mz_ub))
+mz, intensities, times = data["mz"], data["intensities"], data["times"]
+temp_interp = data["labview"]["temp"].to_numpy()
 
 #
 # Select a subset of MZ range and plot intensities as a contour plot
 #
-mz_lb, mz_ub = (130, 180)
 keep_ith_scan = 1
 X, Y, Z = contourf(mz, intensities, mz_lb, mz_ub, keep_ith_scan=keep_ith_scan)
 print(X.shape, Y.shape, Z.shape)
@@ -6,12 +6,10 @@ Author: James E. T. Smith <james.smith9113@gmail.com>
 Date: 1/16/2020
 Updated: 4/15/2020
 """
-import numpy as np
 import matplotlib.pyplot as plt
 import seaborn as sns
-import pandas as pd
 
-from msanalysis.data_extraction import read_mzXML
+from msanalysis.data_extraction import align_run
 from msanalysis.data_processing import get_relative_abundance
 from msanalysis.sample_data import get_mzXML_sample_path, get_csv_sample_path
 
@@ -28,32 +26,19 @@ mzXML_file = get_mzXML_sample_path()
 # mzXML_file = "20200612_2735.mzXML"
 
 #
-# Read CSV Data from LabView
+# Read in mzXML and interpolate the LabView channels (e.g. temperature) onto the
+# timestamps of the scans
 #
-cols = ["time", "b", "temp", "d", "e", "f", "g", "h"]
-df = pd.read_csv(labview_file, names=cols)
-df["time"] -= df["time"][0]
-last_lv_time = np.array(df["time"])[-1]
-
-#
-# Read in mzXML
-#
-data = read_mzXML(mzXML_file)
-mz, intensities, times = data["mz"], data["intensities"], data["times"]
 # Only go as far as LabView data (which we are assuming is always shut off after the mass spec)
-subset = np.where(times <= last_lv_time)[0]
-times = times[subset]
-intensities = intensities[subset]
-
-#
-# Use timestamps from mzXML and Labview to interpolate temperature for each scan
-#
-temp_interp = np.interp(times, df["time"], df["temp"])
+# and only decode the MZ range around the species of interest
+mzs = [137, 157, 172]
+data = align_run(mzXML_file, labview_file, mz_range=(136, 173))
+mz, intensities, times = data["mz"], data["intensities"], data["times"]
+temp_interp = data["labview"]["temp"].to_numpy()
 
 #
 # Get abundances
 #
-mzs = [137, 157, 172]
 abun = get_relative_abundance(mz, intensities, mzs)
 
 #
@@ -1,2 +1,16 @@
 from .utils import read_mzXML
 from .utils import read_exported_txt
+from .lazy import ExportedTxtDataset
+from .mzxml import iter_mzXML_spectra
+from .mzxml import MzXMLDataset
+from .ragged import RaggedScans
+from .mzml import MzMLDataset
+from .mzml import read_mzML
+from .streaming import iter_scans
+from .store import write_store
+from .store import read_store
+from .runs import load_runs
+from .runs import read_labview
+from .runs import align_run
+from .summed_area import SummedAreaTable
+from .summed_area import get_summed_area
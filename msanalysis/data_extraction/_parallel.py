@@ -0,0 +1,96 @@
+"""
+Filling the rows of an output matrix from a pool of worker processes.
+"""
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+def _open_output(output: tuple) -> tuple:
+    # Attach to the output, either ("shm", name, shape, dtype) or ("npy", filename)
+    if output[0] == "npy":
+        return np.load(output[1], mmap_mode="r+"), None
+    _, name, shape, dtype = output
+    shm = shared_memory.SharedMemory(name=name)
+    return np.ndarray(shape, dtype=dtype, buffer=shm.buf), shm
+
+
+def _fill_rows_worker(function, output: tuple, rows: tuple, args: tuple):
+    # Runs in a worker process and writes its rows straight into the shared output
+    out, shm = _open_output(output)
+    try:
+        result = function(*args, out=out[rows[0] : rows[1]])
+        if shm is None:
+            out.flush()
+    finally:
+        # The array must be gone before the shared memory is closed
+        del out
+        if shm is not None:
+            shm.close()
+    return result
+
+
+def fill_rows(
+    function, make_args, shape: tuple, dtype, n_workers: int, out_filename: str = None
+) -> tuple:
+    """Fill a (n_rows, n_columns) array with a pool of `n_workers` processes.
+
+    The rows are split into a few contiguous ranges per worker, so the load stays
+    balanced, and `function(*make_args(lo, hi), out=rows)` writes the rows [lo, hi)
+    straight into the output. The output is a block of shared memory, returned as is so
+    it's never copied, or the .npy file `out_filename` if it's given, so nothing is
+    ever written next to the input files.
+
+    Returns
+    -------
+    (np.ndarray, list)
+        The output (memory-mapped read-only if `out_filename` is given) and the return
+        values of `function` for the ranges of rows in order.
+    """
+    n_rows = shape[0]
+    bounds = np.unique(
+        np.linspace(0, n_rows, min(4 * n_workers, n_rows) + 1, dtype=int)
+    )
+    dtype = np.dtype(dtype)
+
+    shm = None
+    if out_filename is None:
+        nbytes = int(np.prod(shape)) * dtype.itemsize
+        shm = shared_memory.SharedMemory(create=True, size=max(nbytes, 1))
+        output = ("shm", shm.name, shape, dtype)
+    else:
+        out = np.lib.format.open_memmap(
+            out_filename, mode="w+", dtype=dtype, shape=shape
+        )
+        del out
+        output = ("npy", out_filename)
+
+    try:
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            futures = [
+                pool.submit(
+                    _fill_rows_worker,
+                    function,
+                    output,
+                    (int(lo), int(hi)),
+                    make_args(int(lo), int(hi)),
+                )
+                for lo, hi in zip(bounds[:-1], bounds[1:])
+            ]
+            results = [future.result() for future in futures]
+    except BaseException:
+        if shm is not None:
+            shm.close()
+            shm.unlink()
+        raise
+    if shm is None:
+        return np.load(out_filename, mmap_mode="r"), results
+
+    # Drop the name of the block right away, it stays mapped until the array (and every
+    # view of it) is freed
+    shm.unlink()
+    out = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    weakref.finalize(out, shm.close)
+    return out, results
@@ -0,0 +1,25 @@
+"""
+Selecting scans and m/z windows of sorted axes.
+"""
+import numpy as np
+
+
+def range_slice(values: np.ndarray, value_range: tuple) -> slice:
+    # The slice of the sorted values with value_range[0] <= values <= value_range[1]
+    if value_range is None:
+        return slice(None)
+    return slice(
+        int(np.searchsorted(values, value_range[0], side="left")),
+        int(np.searchsorted(values, value_range[1], side="right")),
+    )
+
+
+def select_scans(times: np.ndarray, scans=None, rt_range: tuple = None) -> np.ndarray:
+    # The indices of the scans selected by scans and with times within rt_range
+    selected = np.arange(times.size)
+    if scans is not None:
+        selected = selected[scans].reshape(-1)
+    if rt_range is not None:
+        times = times[selected]
+        selected = selected[(times >= rt_range[0]) & (times <= rt_range[1])]
+    return selected
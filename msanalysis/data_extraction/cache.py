@@ -0,0 +1,259 @@
+"""
+Binary caches of parsed data stored as raw .npy files, so large datasets can be
+memory-mapped instead of being read into memory.
+"""
+import hashlib
+import io
+import json
+import os
+import shutil
+
+import numpy as np
+
+_MANIFEST = "manifest.json"
+_HASH_BYTES = 1024**2  # bytes hashed at each end of the source file
+
+
+def get_cache_dir(filename: str) -> str:
+    """Return the cache directory for a data file, e.g. the data parsed from
+    /path/to/file.txt is cached in /path/to/file_cache/.
+    """
+    return os.path.splitext(filename)[0] + "_cache"
+
+
+def get_fingerprint_cache_dir(filename: str, cache_dir: str) -> str:
+    """Return the cache directory for a data file in a shared `cache_dir`, keyed by the
+    fingerprint of the file (see `fast_hash`), e.g. /path/to/file.mzXML is cached in
+    cache_dir/file_<fingerprint>/. A file copied or moved under the same name keeps
+    its cache, while an edited one gets a new directory.
+    """
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    return os.path.join(cache_dir, f"{stem}_{fast_hash(filename)[:16]}")
+
+
+def get_cache_path(cache_dir: str, name: str) -> str:
+    """Return the path of the .npy file holding the array `name` in `cache_dir`."""
+    return os.path.join(cache_dir, name + ".npy")
+
+
+def has_cache(cache_dir: str, names: list) -> bool:
+    """Check that all the arrays in `names` are stored in `cache_dir`."""
+    return all(os.path.exists(get_cache_path(cache_dir, name)) for name in names)
+
+
+def save_cache(cache_dir: str, **arrays):
+    """Save each keyword array as a .npy file in `cache_dir`.
+
+    Parameters
+    ----------
+    cache_dir : str
+        The cache directory, it's created if it doesn't exist yet.
+    **arrays : np.ndarray
+        The arrays to save, e.g. `save_cache(cache_dir, mz=mz)` creates `mz.npy`.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    for name, array in arrays.items():
+        np.save(get_cache_path(cache_dir, name), array)
+
+
+def load_cache(cache_dir: str, names: list, mmap_mode: str = "r") -> dict:
+    """Open the arrays in `names` from `cache_dir`.
+
+    Opening a memory-mapped array is O(1), only the pages that are actually indexed
+    (e.g. a range of scans or an m/z window) are read from disk.
+
+    Parameters
+    ----------
+    cache_dir : str
+        The cache directory.
+    names : list
+        The names of the arrays to open.
+    mmap_mode : str, optional
+        Passed on to `np.load`, by default "r" (read-only memory map). Use `None` to
+        read the arrays into memory.
+
+    Returns
+    -------
+    dict
+        The arrays keyed by name.
+    """
+    return {
+        name: np.load(get_cache_path(cache_dir, name), mmap_mode=mmap_mode)
+        for name in names
+    }
+
+
+def clear_cache(cache_dir: str):
+    """Remove `cache_dir` and everything in it."""
+    if os.path.isdir(cache_dir):
+        shutil.rmtree(cache_dir)
+
+
+def fast_hash(filename: str, n_bytes: int = _HASH_BYTES) -> str:
+    """Hash the size plus the first and last `n_bytes` of a file. This is cheap even for
+    very large files and catches re-exported data whose size happens to match.
+    """
+    size = os.path.getsize(filename)
+    h = hashlib.sha1(str(size).encode())
+    with open(filename, "rb") as f:
+        h.update(f.read(n_bytes))
+        f.seek(max(size - n_bytes, 0))
+        h.update(f.read(n_bytes))
+    return h.hexdigest()
+
+
+def head_hash(filename: str, n_bytes: int) -> str:
+    """Hash the first `n_bytes` of a file, which stay the same while data is appended."""
+    with open(filename, "rb") as f:
+        return hashlib.sha1(f.read(n_bytes)).hexdigest()
+
+
+def write_manifest(cache_dir: str, source: str, parser_version: int, params: dict):
+    """Record what a cache was built from in `cache_dir/manifest.json`.
+
+    The manifest should be written after all the arrays so an interrupted build never
+    looks valid.
+
+    Parameters
+    ----------
+    cache_dir : str
+        The cache directory.
+    source : str
+        The path of the file the cache was built from.
+    parser_version : int
+        The version of the parser that built the cache.
+    params : dict
+        The (JSON serializable) parameters used to parse the source file.
+    """
+    stat = os.stat(source)
+    head_bytes = min(stat.st_size, _HASH_BYTES)
+    manifest = {
+        "source_size": stat.st_size,
+        "source_mtime_ns": stat.st_mtime_ns,
+        "source_hash": fast_hash(source),
+        "head_bytes": head_bytes,
+        "head_hash": head_hash(source, head_bytes),
+        "parser_version": parser_version,
+        "params": params,
+    }
+    with open(os.path.join(cache_dir, _MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+
+def read_manifest(cache_dir: str) -> dict:
+    """Return the manifest of `cache_dir` or `None` if there isn't a readable one."""
+    try:
+        with open(os.path.join(cache_dir, _MANIFEST), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def is_cache_valid(
+    cache_dir: str, source: str, parser_version: int, params: dict, names: list
+) -> bool:
+    """Check whether the cache in `cache_dir` can be reused for `source`.
+
+    The cache is valid if all the arrays in `names` exist and the manifest matches the
+    parser version, the parse parameters and the size of `source`. If the modification
+    time of `source` changed, its fast hash is compared as well so a file that was only
+    touched doesn't trigger a rebuild.
+    """
+    manifest = read_manifest(cache_dir)
+    if manifest is None or not has_cache(cache_dir, names):
+        return False
+
+    # Round trip through JSON so e.g. tuples compare equal to the stored lists
+    params = json.loads(json.dumps(params))
+    if manifest.get("parser_version") != parser_version:
+        return False
+    if manifest.get("params") != params:
+        return False
+
+    stat = os.stat(source)
+    if manifest.get("source_size") != stat.st_size:
+        return False
+    if manifest.get("source_mtime_ns") == stat.st_mtime_ns:
+        return True
+    return manifest.get("source_hash") == fast_hash(source)
+
+
+def is_cache_appendable(
+    cache_dir: str, source: str, parser_version: int, names: list
+) -> bool:
+    """Check whether `source` only grew since the cache in `cache_dir` was built, so the
+    cache can be extended with the new data instead of being rebuilt.
+
+    This is the case if all the arrays in `names` exist, the manifest matches the parser
+    version, `source` is at least as large as it was and its first bytes are unchanged.
+    """
+    manifest = read_manifest(cache_dir)
+    if manifest is None or not has_cache(cache_dir, names):
+        return False
+    if manifest.get("parser_version") != parser_version:
+        return False
+    if "head_hash" not in manifest:
+        return False
+    if os.path.getsize(source) < manifest.get("source_size", 0):
+        return False
+    return manifest["head_hash"] == head_hash(source, manifest["head_bytes"])
+
+
+def append_rows(path: str, rows: np.ndarray, start: int = None):
+    """Write `rows` into the 2D .npy file at `path` from row `start` on, growing it in
+    place. Only the new rows and the header are written, so the cost doesn't depend on
+    the size of the existing array.
+
+    Parameters
+    ----------
+    path : str
+        The path of a C-ordered 2D .npy file.
+    rows : np.ndarray
+        The (n_rows, n_columns) rows to write, with the dtype of the file.
+    start : int, optional
+        The first row to write, rows from `start` on are replaced. By default the rows
+        are appended after the last one.
+
+    Raises
+    ------
+    ValueError
+        If `rows` don't match the shape or type of the array in the file.
+    """
+    with open(path, "r+b") as f:
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        data_start = f.tell()
+        if fortran_order or len(shape) != 2:
+            raise ValueError(f"Can only append rows to C-ordered 2D arrays, in {path}")
+        if rows.dtype != dtype or rows.shape[1:] != shape[1:]:
+            raise ValueError(f"The rows don't match the shape or type of {path}")
+
+        # Plain ints, NumPy 2 writes NumPy integers in the header as np.int64(n), which
+        # np.load can't read back
+        start = int(shape[0] if start is None else min(start, shape[0]))
+        header = {
+            "descr": np.lib.format.dtype_to_descr(dtype),
+            "fortran_order": False,
+            "shape": (start + int(rows.shape[0]), int(shape[1])),
+        }
+        buffer = io.BytesIO()
+        if version == (1, 0):
+            np.lib.format.write_array_header_1_0(buffer, header)
+        else:
+            np.lib.format.write_array_header_2_0(buffer, header)
+        if len(buffer.getvalue()) != data_start:
+            # NumPy pads the header so the shape can grow, but not in every version
+            array = np.load(path)[:start]
+            np.save(path, np.concatenate((array, rows)))
+            return
+
+        # Write the data before the header, so if this is interrupted the file still
+        # holds a valid array of the old shape
+        f.seek(data_start + start * shape[1] * dtype.itemsize)
+        f.write(np.ascontiguousarray(rows).tobytes())
+        f.truncate()
+        f.seek(0)
+        f.write(buffer.getvalue())
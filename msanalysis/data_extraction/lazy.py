@@ -0,0 +1,108 @@
+"""
+Lazy, random-access readers that only parse the scans that are actually requested.
+"""
+import numpy as np
+
+from .utils import _CHUNK_SIZE, _parse_range, load_txt_index
+
+
+class ExportedTxtDataset:
+    """Lazy view of a text file exported by the merlin software.
+
+    Opening the dataset only loads the scan index (byte offsets per scan), which is
+    built in one pass the first time and persisted next to the file (see
+    `load_txt_index`). Indexing the dataset then seeks to the requested scans and parses
+    only those, so a few scans out of a multi-GB export are available in seconds.
+
+    Parameters
+    ----------
+    filename : str
+        The path to the txt datafile.
+    chunk_size : int, optional
+        The number of bytes to read at once while building the index or parsing
+        a long range of scans, by default 64 MB.
+    dtype : np.dtype, optional
+        The floating point type of the parsed intensities, by default np.float64.
+
+    Raises
+    ------
+    AssertionError
+        If the scans don't all have the same number of points, e.g. the last one is
+        incomplete.
+
+    Examples
+    --------
+    >>> from msanalysis.data_extraction import ExportedTxtDataset
+    >>> from msanalysis.sample_data import get_txt_sample_path
+    >>> dataset = ExportedTxtDataset(get_txt_sample_path())
+    >>> dataset.shape
+    (2, 26947)
+    >>> dataset[1:].shape
+    (1, 26947)
+    >>> window = (dataset.mz > 60) & (dataset.mz < 280)
+    >>> dataset[:, window].shape
+    (2, 5939)
+    """
+
+    def __init__(
+        self, filename: str, chunk_size: int = _CHUNK_SIZE, dtype=np.float64
+    ):
+        self.filename = filename
+        self.chunk_size = chunk_size
+        self.dtype = np.dtype(dtype)
+
+        index = load_txt_index(filename, chunk_size)
+        self.mz = index["mz"]
+        self.offsets = index["offsets"]
+        self.n_points = index["n_points"]
+        # Like read_exported_txt, so a partial scan is caught here and not when read
+        if self.n_points.size == 0 or (self.n_points != self.n_points[0]).any():
+            raise AssertionError(f"Incomplete scans were found please check {filename}")
+
+    @property
+    def shape(self) -> tuple:
+        return (self.n_points.size, self.mz.size)
+
+    def __len__(self) -> int:
+        return self.n_points.size
+
+    def __getitem__(self, key) -> np.ndarray:
+        """Parse the scans selected by `key`, where `key` is any NumPy index of the scan
+        axis (int, slice, integer or boolean array) optionally followed by an index of the
+        m/z axis, e.g. `dataset[100:200, window]`.
+        """
+        mz_key = slice(None)
+        if isinstance(key, tuple):
+            key, mz_key = key
+
+        scans = np.arange(len(self))[key]
+        if scans.ndim == 0:
+            return self.read_scans(scans[np.newaxis])[0][mz_key]
+        return self.read_scans(scans)[:, mz_key]
+
+    def read_scans(self, scans: np.ndarray) -> np.ndarray:
+        """Parse the scans with indices `scans` into a (len(scans), scan_size) array.
+
+        Consecutive scans are read with one seek, so contiguous ranges are as fast to
+        parse as the corresponding part of the full file.
+        """
+        scans = np.asarray(scans, dtype=np.int64)
+        out = np.empty((scans.size, self.mz.size), dtype=self.dtype)
+        mz = np.empty(self.mz.size)
+
+        # Split the requested scans into runs of consecutive scans
+        breaks = np.flatnonzero(np.diff(scans) != 1) + 1
+        starts = np.concatenate(([0], breaks))
+        stops = np.concatenate((breaks, [scans.size]))
+        for start, stop in zip(starts, stops):
+            if start == stop:
+                continue
+            _parse_range(
+                self.filename,
+                int(self.offsets[scans[start]]),
+                int(self.offsets[scans[stop - 1] + 1]),
+                mz,
+                out[start:stop],
+                self.chunk_size,
+            )
+        return out
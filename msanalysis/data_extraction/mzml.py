@@ -0,0 +1,114 @@
+"""
+Lazy access to indexed mzML files through the on-disk experiment of pyopenms, so only
+the spectra that are actually requested are loaded.
+"""
+import numpy as np
+from pyopenms import OnDiscMSExperiment
+
+
+class MzMLDataset:
+    """Lazy, matrix-like view of the spectra in an indexed mzML file.
+
+    Opening the dataset only reads the index and the spectrum metadata (for the
+    retention times) with pyopenms' `OnDiscMSExperiment`. Indexing or iterating over the
+    dataset then loads the requested spectra one at a time, so the memory use doesn't
+    depend on the number of spectra in the file.
+
+    Parameters
+    ----------
+    filename : str
+        The path to the indexed mzML file.
+    dtype : np.dtype, optional
+        The floating point type of the intensities, by default np.float64.
+
+    Raises
+    ------
+    ValueError
+        If the file isn't an indexed mzML file.
+
+    Examples
+    --------
+    >>> from msanalysis.data_extraction import read_mzML
+    >>> dataset = read_mzML("run.mzML")
+    >>> dataset.shape
+    (20, 8046)
+    >>> dataset[5:10].shape
+    (5, 8046)
+    >>> for intensities in dataset:
+    ...     pass
+    """
+
+    def __init__(self, filename: str, dtype=np.float64):
+        self.filename = filename
+        self.dtype = np.dtype(dtype)
+
+        self._experiment = OnDiscMSExperiment()
+        if not self._experiment.openFile(filename):
+            raise ValueError(f"{filename} isn't an indexed mzML file")
+        meta = self._experiment.getMetaData()
+        self.times = np.array(
+            [meta.getSpectrum(i).getRT() for i in range(meta.getNrSpectra())]
+        )
+        self.mz = np.zeros(0)
+        if len(self) > 0:
+            self.mz = np.array(self._experiment.getSpectrum(0).get_peaks()[0])
+
+    @property
+    def shape(self) -> tuple:
+        return (self.times.size, self.mz.size)
+
+    def __len__(self) -> int:
+        return self.times.size
+
+    def __iter__(self):
+        """Iterate over the intensities of the spectra, loading one at a time."""
+        for i in range(len(self)):
+            yield self._read_spectrum(i)
+
+    def __getitem__(self, key) -> np.ndarray:
+        """Load the spectra selected by `key`, where `key` is any NumPy index of the scan
+        axis (int, slice, integer or boolean array) optionally followed by an index of the
+        m/z axis, e.g. `dataset[100:200, window]`.
+        """
+        mz_key = slice(None)
+        if isinstance(key, tuple):
+            key, mz_key = key
+
+        scans = np.arange(len(self))[key]
+        if scans.ndim == 0:
+            return self._read_spectrum(int(scans))[mz_key]
+        out = np.empty((scans.size, self.mz[mz_key].size), dtype=self.dtype)
+        for row, i in enumerate(scans):
+            out[row] = self._read_spectrum(int(i))[mz_key]
+        return out
+
+    def _read_spectrum(self, i: int) -> np.ndarray:
+        intensities = self._experiment.getSpectrum(i).get_peaks()[1]
+        if intensities.size == 0:
+            print(f"Scan {i} (0-based indexing) is empty.")
+            raise ValueError(f"One (or more) empty scans in {self.filename}, exiting!!")
+        if intensities.size != self.mz.size:
+            raise ValueError(
+                f"Scan {i} in {self.filename} doesn't match the m/z of scan 0"
+            )
+        return intensities.astype(self.dtype, copy=False)
+
+
+def read_mzML(filename: str, dtype=np.float64) -> MzMLDataset:
+    """Open an indexed mzML file lazily (see `MzMLDataset`).
+
+    Parameters
+    ----------
+    filename : str
+        The path to the indexed mzML file.
+    dtype : np.dtype, optional
+        The floating point type of the intensities, by default np.float64.
+
+    Returns
+    -------
+    MzMLDataset
+        A matrix-like object of shape (n_scans, scan_size) that loads the spectra when
+        they're indexed or iterated over, with the m/z values in `dataset.mz` and the
+        scan times in seconds in `dataset.times`.
+    """
+    return MzMLDataset(filename, dtype)
@@ -0,0 +1,486 @@
+"""
+Native decoding of mzXML files with incremental XML parsing, so scans can be streamed
+without loading the whole experiment into memory.
+"""
+import base64
+import os
+import re
+import zlib
+import xml.etree.ElementTree as ET
+
+import numpy as np
+
+from ._parallel import fill_rows
+from ._ranges import range_slice, select_scans
+from .ragged import RaggedScans
+
+_READ_SIZE = 1024**2  # bytes
+_WHITESPACE = (b"\n", b"\r", b" ", b"\t")
+_SCAN_TAG = re.compile(rb"<scan[\s>]")
+_INDEX_OFFSET = re.compile(rb"<indexOffset>\s*(\d+)\s*</indexOffset>")
+_SCAN_INDEX = re.compile(rb"<index\s+name\s*=\s*\"scan\"\s*>(.*?)</index>", re.S)
+_OFFSET = re.compile(rb"<offset[^>]*>\s*(\d+)\s*</offset>")
+_DURATION = re.compile(
+    r"^P(?:T(?:(?P<h>[\d.]+)H)?(?:(?P<m>[\d.]+)M)?(?:(?P<s>[\d.]+)S)?)?$"
+)
+
+
+def _local_name(tag: str) -> str:
+    # Strip the XML namespace, e.g. "{http://sashimi...}scan" -> "scan"
+    return tag.rsplit("}", 1)[-1]
+
+
+def parse_retention_time(value: str) -> float:
+    """Convert an mzXML retention time (an xs:duration such as "PT47.5S") to seconds."""
+    match = _DURATION.match(value.strip())
+    if match is None:
+        return float(value)
+    h, m, s = (float(match.group(k) or 0) for k in ("h", "m", "s"))
+    return 3600 * h + 60 * m + s
+
+
+def _peaks_dtype(peaks: ET.Element) -> np.dtype:
+    precision = peaks.get("precision", "32")
+    byte_order = ">" if peaks.get("byteOrder", "network") == "network" else "<"
+    return np.dtype(byte_order + ("f8" if precision == "64" else "f4"))
+
+
+def _peaks_array(peaks: ET.Element, text=None) -> np.ndarray:
+    # The interleaved (m/z, intensity) pairs of a <peaks> element (or of its base64 text
+    # if given), viewed in the byte order and precision of the file without any copy
+    data = base64.b64decode(peaks.text or "" if text is None else text)
+    if peaks.get("compressionType", "none") == "zlib" and data:
+        data = zlib.decompress(data)
+    return np.frombuffer(data, dtype=_peaks_dtype(peaks))
+
+
+def _peaks_window(peaks: ET.Element, text: bytes, columns: slice) -> tuple:
+    # The (n, 2) (m/z, intensity) pairs in the columns of a scan, decoded from the base64
+    # text of its <peaks>, and the number of pairs in the whole scan. Every 4 base64
+    # characters hold 3 bytes, so uncompressed peaks are only decoded in the window.
+    dtype = _peaks_dtype(peaks)
+    pair_size = 2 * dtype.itemsize
+    compressed = peaks.get("compressionType", "none") == "zlib"
+    if compressed or any(c in text for c in _WHITESPACE):
+        pairs = _peaks_array(peaks, text)
+        return pairs[: pairs.size // 2 * 2].reshape(-1, 2)[columns], pairs.size // 2
+
+    n_pairs = (len(text) // 4 * 3 - text[-2:].count(b"=")) // pair_size
+    start, stop, step = columns.indices(n_pairs)
+    if step < 0:
+        return _peaks_array(peaks, text).reshape(-1, 2)[columns], n_pairs
+    b0, b1 = (start * pair_size, max(start, stop) * pair_size)
+    data = base64.b64decode(text[b0 // 3 * 4 : -(-b1 // 3) * 4])
+    window = np.frombuffer(
+        data, dtype=dtype, count=(b1 - b0) // dtype.itemsize, offset=b0 % 3
+    )
+    return window.reshape(-1, 2)[::step], n_pairs
+
+
+def _find_peaks(scan: ET.Element) -> ET.Element:
+    for child in scan:
+        if _local_name(child.tag) == "peaks":
+            return child
+    return None
+
+
+def decode_peaks(peaks: ET.Element) -> tuple:
+    """Decode the base64 (and optionally zlib compressed) data of a `<peaks>` element.
+
+    Parameters
+    ----------
+    peaks : ET.Element
+        The `<peaks>` element of an mzXML scan.
+
+    Returns
+    -------
+    (np.ndarray, np.ndarray)
+        The m/z values and the intensities of the scan as float64 arrays.
+    """
+    pairs = _peaks_array(peaks).astype(np.float64)
+    return pairs[0::2], pairs[1::2]
+
+
+def _iterparse(filename: str):
+    # Like ET.iterparse, but feeds the parser larger blocks since the base64 peaks make
+    # the text of every scan long
+    parser = ET.XMLPullParser(events=("start", "end"))
+    with open(filename, "rb") as f:
+        while True:
+            data = f.read(_READ_SIZE)
+            if not data:
+                break
+            parser.feed(data)
+            yield from parser.read_events()
+    parser.close()
+    yield from parser.read_events()
+
+
+def _iter_scan_elements(filename: str):
+    # Yield every <scan> element once it's completely parsed, along with the scan count
+    # announced by <msRun> (or None). The finished scans are dropped from the tree.
+    ms_run = None
+    scan_count = None
+    depth = 0
+    for event, elem in _iterparse(filename):
+        tag = _local_name(elem.tag)
+        if event == "start":
+            if tag == "msRun":
+                ms_run = elem
+                if elem.get("scanCount"):
+                    scan_count = int(elem.get("scanCount"))
+            elif tag == "scan":
+                depth += 1
+            continue
+        if tag != "scan":
+            continue
+
+        depth -= 1
+        yield elem, scan_count
+
+        # Drop the finished scans so the tree never grows
+        if depth == 0 and ms_run is not None:
+            ms_run.clear()
+
+
+def iter_mzXML_spectra(filename: str):
+    """Iterate over the scans of an mzXML file one at a time.
+
+    The file is parsed incrementally and every scan is discarded once it's yielded, so
+    the memory use doesn't depend on the size of the file.
+
+    Parameters
+    ----------
+    filename : str
+        The path to the mzXML file.
+
+    Yields
+    ------
+    dict
+        Where scan["num"] is the scan number, scan["ms_level"] the MS level,
+        scan["time"] the retention time in seconds, and scan["mz"] and
+        scan["intensity"] the decoded peaks.
+    """
+    for elem, _ in _iter_scan_elements(filename):
+        peaks = _find_peaks(elem)
+        mz, intensity = (np.zeros(0), np.zeros(0))
+        if peaks is not None:
+            mz, intensity = decode_peaks(peaks)
+        yield {
+            "num": int(elem.get("num", 0)),
+            "ms_level": int(elem.get("msLevel", 1)),
+            "time": parse_retention_time(elem.get("retentionTime", "PT0S")),
+            "mz": mz,
+            "intensity": intensity,
+        }
+
+
+def read_mzXML_native(filename: str, dtype=np.float64) -> dict:
+    """Read all the scans in an mzXML file without pyopenms.
+
+    The file is parsed incrementally and the peaks of every scan are decoded straight
+    into a row of the preallocated intensity matrix (sized from the scan count of the
+    run), so the peak memory is the size of the output plus one scan. See `read_mzXML`
+    for the parameters and the returned data.
+    """
+    mz, intensities = (None, None)
+    times = []
+    for i, (elem, scan_count) in enumerate(_iter_scan_elements(filename)):
+        peaks = _find_peaks(elem)
+        pairs = _peaks_array(peaks) if peaks is not None else np.zeros(0)
+        if pairs.size == 0:
+            print(f"Scan {i} (0-based indexing) is empty.")
+            raise ValueError(f"One (or more) empty scans in {filename}, exiting!!")
+
+        if mz is None:
+            mz = pairs[0::2].astype(np.float64)
+            intensities = np.empty((scan_count or 1, mz.size), dtype=dtype)
+        if pairs.size != 2 * mz.size:
+            raise ValueError(f"Scan {i} in {filename} doesn't match the m/z of scan 0")
+        if i == intensities.shape[0]:
+            # The run announced fewer scans than it holds
+            grown = np.empty((2 * i, mz.size), dtype=dtype)
+            grown[:i] = intensities
+            intensities = grown
+
+        intensities[i] = pairs[1::2]
+        times.append(parse_retention_time(elem.get("retentionTime", "PT0S")))
+
+    if mz is None:
+        raise ValueError(f"No scans found in {filename}")
+    return {
+        "mz": mz,
+        "intensities": intensities[: len(times)],
+        "times": np.array(times),
+    }
+
+
+def _offsets_from_index(f, size: int) -> np.ndarray:
+    # The scan offsets listed in the <index> of the file, or None if it doesn't have a
+    # (valid) one
+    f.seek(max(size - 4096, 0))
+    match = _INDEX_OFFSET.search(f.read())
+    if match is None or int(match.group(1)) >= size:
+        return None
+    f.seek(int(match.group(1)))
+    match = _SCAN_INDEX.search(f.read())
+    if match is None:
+        return None
+    offsets = np.array(
+        [int(m) for m in _OFFSET.findall(match.group(1))], dtype=np.int64
+    )
+    if offsets.size == 0 or offsets.max() >= size:
+        return None
+
+    # Check a few of the offsets, a file edited after it was indexed is re-indexed
+    for offset in offsets[[0, offsets.size // 2, -1]]:
+        f.seek(offset)
+        if _SCAN_TAG.match(f.read(6)) is None:
+            return None
+    return np.sort(offsets)
+
+
+def index_mzXML(filename: str, chunk_size: int = 64 * 1024**2) -> np.ndarray:
+    """Return the byte offsets of the `<scan>` elements of an mzXML file, in file order.
+
+    The offsets are read from the `<index>` at the end of the file, so this is
+    independent of its size. Files without a valid index are scanned once (in chunks of
+    `chunk_size` bytes) for the scan tags instead.
+    """
+    size = os.path.getsize(filename)
+    with open(filename, "rb") as f:
+        offsets = _offsets_from_index(f, size)
+        if offsets is not None:
+            return offsets
+
+        f.seek(0)
+        offsets = []
+        base = 0
+        tail = b""
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            block = tail + chunk
+            offsets.extend(base + m.start() for m in _SCAN_TAG.finditer(block))
+            # A tag cut at the end of the block is found in the next one
+            tail = block[-5:]
+            base += len(block) - len(tail)
+    return np.array(offsets, dtype=np.int64)
+
+
+def _read_until(f, data: bytes, token: bytes, start: int) -> tuple:
+    # Extend data (read from f) until it contains token after start. Returns the data
+    # and the position of token, or -1 if the file ends first.
+    pos = data.find(token, start)
+    while pos < 0:
+        more = f.read(max(len(data), 4096))
+        if not more:
+            return data, -1
+        data += more
+        pos = data.find(token, max(len(data) - len(more) - len(token), start))
+    return data, pos
+
+
+def _start_tag(tag: bytes) -> ET.Element:
+    # Parse a start tag on its own, e.g. b'<scan num="1">'
+    return ET.fromstring(tag.rstrip(b">").rstrip(b"/") + b"/>")
+
+
+def _read_scan_at(f, offset: int, peaks: bool = True) -> tuple:
+    # Read the <scan> element that starts at offset: its start tag and, if peaks, the
+    # start tag and the base64 text of its own <peaks> (the schema puts them before any
+    # nested scans). The text isn't run through the XML parser.
+    f.seek(offset)
+    data, end = _read_until(f, f.read(4096), b">", 0)
+    scan = _start_tag(data[: end + 1])
+    if not peaks:
+        return scan, None, None
+
+    data, start = _read_until(f, data, b"<peaks", end)
+    data, end = _read_until(f, data, b">", max(start, 0))
+    if start < 0 or end < 0:
+        raise ValueError(f"No peaks found for the scan at byte {offset}")
+    peaks = _start_tag(data[start : end + 1])
+    if data[end - 1 : end] == b"/":
+        return scan, peaks, b""
+    data, stop = _read_until(f, data, b"</peaks>", end)
+    if stop < 0:
+        raise ValueError(f"No peaks found for the scan at byte {offset}")
+    return scan, peaks, data[end + 1 : stop]
+
+
+def _decode_scans(
+    filename: str,
+    offsets: np.ndarray,
+    scans: np.ndarray,
+    columns: slice,
+    n_mz: int,
+    out: np.ndarray,
+):
+    # Decode the m/z columns of the scans with indices scans into the rows of out
+    with open(filename, "rb") as f:
+        for row, i in enumerate(scans):
+            _, peaks, text = _read_scan_at(f, int(offsets[i]))
+            pairs, n_pairs = _peaks_window(peaks, text, columns)
+            if n_pairs == 0:
+                print(f"Scan {i} (0-based indexing) is empty.")
+                raise ValueError(f"One (or more) empty scans in {filename}, exiting!!")
+            if n_pairs != n_mz:
+                raise ValueError(
+                    f"Scan {i} in {filename} doesn't match the m/z of scan 0"
+                )
+            out[row] = pairs[:, 1]
+
+
+class MzXMLDataset:
+    """Random access to the scans of an mzXML file.
+
+    Opening the dataset reads the scan offsets from the `<index>` of the file (see
+    `index_mzXML`) and the start tag of every scan for the retention times. Indexing the
+    dataset then seeks to the requested scans and decodes only those, so reading a few
+    scans or a retention time window doesn't depend on the size of the file.
+
+    Parameters
+    ----------
+    filename : str
+        The path to the mzXML file.
+    dtype : np.dtype, optional
+        The floating point type of the decoded intensities, by default np.float64.
+
+    Examples
+    --------
+    >>> from msanalysis.data_extraction import MzXMLDataset
+    >>> from msanalysis.sample_data import get_mzXML_sample_path
+    >>> dataset = MzXMLDataset(get_mzXML_sample_path())
+    >>> dataset[5:10].shape
+    (5, 8046)
+    >>> dataset.select(rt_range=(10, 20))
+    array([4, 5, 6, 7, 8])
+    """
+
+    def __init__(self, filename: str, dtype=np.float64):
+        self.filename = filename
+        self.dtype = np.dtype(dtype)
+        self.offsets = index_mzXML(filename)
+
+        with open(filename, "rb") as f:
+            scans = [
+                _read_scan_at(f, offset, peaks=False)[0] for offset in self.offsets
+            ]
+            pairs = np.zeros((0, 2))
+            if scans:
+                _, peaks, text = _read_scan_at(f, self.offsets[0])
+                pairs, _ = _peaks_window(peaks, text, slice(None))
+        self.times = np.array(
+            [parse_retention_time(s.get("retentionTime", "PT0S")) for s in scans]
+        )
+        self.mz = pairs[:, 0].astype(np.float64)
+
+    @property
+    def shape(self) -> tuple:
+        return (self.offsets.size, self.mz.size)
+
+    def __len__(self) -> int:
+        return self.offsets.size
+
+    def __getitem__(self, key) -> np.ndarray:
+        """Decode the scans selected by `key`, where `key` is any NumPy index of the scan
+        axis (int, slice, integer or boolean array) optionally followed by an index of the
+        m/z axis, e.g. `dataset[100:200, window]`.
+        """
+        mz_key = slice(None)
+        if isinstance(key, tuple):
+            key, mz_key = key
+
+        scans = np.arange(len(self))[key]
+        if scans.ndim == 0:
+            return self.read_scans(scans[np.newaxis])[0][mz_key]
+        return self.read_scans(scans)[:, mz_key]
+
+    def select(self, scans=None, rt_range: tuple = None) -> np.ndarray:
+        """Return the (0-based) indices of the scans selected by `scans` (any NumPy index
+        of the scan axis) and with `rt_range[0] <= times <= rt_range[1]`.
+        """
+        return select_scans(self.times, scans, rt_range)
+
+    def columns(self, mz_range: tuple = None) -> slice:
+        """Return the slice of the m/z axis with `mz_range[0] <= mz <= mz_range[1]`."""
+        return range_slice(self.mz, mz_range)
+
+    def read_ragged(self, scans: np.ndarray, mz_range: tuple = None) -> RaggedScans:
+        """Decode the scans with indices `scans` keeping the m/z values of every scan,
+        for acquisitions where they differ (e.g. centroided or zero-suppressed data).
+        Empty scans are allowed.
+
+        Parameters
+        ----------
+        scans : np.ndarray
+            The indices of the scans.
+        mz_range : tuple, optional
+            Only keep the points with `mz_range[0] <= mz <= mz_range[1]`.
+
+        Returns
+        -------
+        RaggedScans
+            The scans stored CSR style, with the times of the scans.
+        """
+        scans = np.asarray(scans, dtype=np.int64)
+        mz, intensities = ([np.zeros(0)], [np.zeros(0, dtype=self.dtype)])
+        with open(self.filename, "rb") as f:
+            for i in scans:
+                _, peaks, text = _read_scan_at(f, int(self.offsets[i]))
+                pairs, _ = _peaks_window(peaks, text, slice(None))
+                pairs = pairs[range_slice(pairs[:, 0], mz_range)]
+                mz.append(pairs[:, 0])
+                intensities.append(pairs[:, 1])
+
+        offsets = np.cumsum([0] + [m.size for m in mz[1:]])
+        return RaggedScans(
+            np.concatenate(mz).astype(np.float64),
+            np.concatenate(intensities).astype(self.dtype),
+            offsets,
+            self.times[scans],
+        )
+
+    def read_scans(
+        self, scans: np.ndarray, columns: slice = slice(None), n_workers: int = None
+    ) -> np.ndarray:
+        """Decode the scans with indices `scans` into a (len(scans), scan_size) array.
+
+        Only the m/z `columns` (a slice, see `columns`) of every scan are kept, so
+        reading a narrow window never allocates the full scans.
+
+        With `n_workers` the scans are split into contiguous ranges that a pool of
+        `n_workers` processes decodes straight into a shared output matrix (a block of
+        shared memory, nothing is written to disk). The output is identical to the
+        serial reader.
+
+        Raises
+        ------
+        ValueError
+            If any of the scans is empty or doesn't match the m/z of the first scan.
+        """
+        scans = np.asarray(scans, dtype=np.int64)
+        shape = (scans.size, self.mz[columns].size)
+        if n_workers is None or scans.size == 0:
+            out = np.empty(shape, dtype=self.dtype)
+            _decode_scans(
+                self.filename, self.offsets, scans, columns, self.mz.size, out
+            )
+            return out
+
+        out, _ = fill_rows(
+            _decode_scans,
+            lambda lo, hi: (
+                self.filename,
+                self.offsets,
+                scans[lo:hi],
+                columns,
+                self.mz.size,
+            ),
+            shape,
+            self.dtype,
+            n_workers,
+        )
+        return out
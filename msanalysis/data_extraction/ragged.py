@@ -0,0 +1,142 @@
+"""
+Ragged (variable-length) scans stored CSR style, for centroided or zero-suppressed
+acquisitions where every scan has its own m/z values.
+"""
+import numpy as np
+
+
+class RaggedScans:
+    """Scans with different m/z values, stored as the concatenated m/z values and
+    intensities of all the scans plus the offset of each scan (like a CSR matrix).
+
+    The memory scales with the number of points actually recorded, empty scans cost
+    nothing.
+
+    Parameters
+    ----------
+    mz : np.ndarray
+        1D array of the m/z values of all the scans, one after the other.
+    intensities : np.ndarray
+        1D array of the intensities matching `mz`.
+    offsets : np.ndarray
+        The (n_scans + 1) offsets of the scans, the points of scan i are
+        `mz[offsets[i] : offsets[i + 1]]`.
+    times : np.ndarray, optional
+        The scan times, by default the scan numbers.
+
+    Examples
+    --------
+    >>> scans = RaggedScans(
+    ...     np.array([10.0, 11.0, 10.5]), np.array([1.0, 2.0, 3.0]), np.array([0, 2, 2, 3])
+    ... )
+    >>> scans.n_points
+    array([2, 0, 1])
+    >>> scans[2]
+    (array([10.5]), array([3.]))
+    >>> scans.to_dense()
+    array([[1., 0., 2.],
+           [0., 0., 0.],
+           [0., 3., 0.]])
+    """
+
+    def __init__(
+        self,
+        mz: np.ndarray,
+        intensities: np.ndarray,
+        offsets: np.ndarray,
+        times: np.ndarray = None,
+    ):
+        self.mz = np.asarray(mz)
+        self.intensities = np.asarray(intensities)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        if self.mz.shape != self.intensities.shape:
+            raise ValueError("mz and intensities must have the same shape")
+        if self.offsets[0] != 0 or self.offsets[-1] != self.mz.size:
+            raise ValueError(
+                "The offsets must start at 0 and end at the number of points"
+            )
+        if times is None:
+            times = np.arange(len(self), dtype=np.float64)
+        self.times = np.asarray(times)
+        if self.times.size != len(self):
+            raise ValueError("The size of times doesn't match the number of scans")
+
+    def __len__(self) -> int:
+        return self.offsets.size - 1
+
+    @property
+    def n_points(self) -> np.ndarray:
+        """The number of points in each scan."""
+        return np.diff(self.offsets)
+
+    @property
+    def scan_index(self) -> np.ndarray:
+        """The scan of every point, i.e. the row indices of the CSR matrix."""
+        return np.repeat(np.arange(len(self)), self.n_points)
+
+    def __getitem__(self, i: int) -> tuple:
+        """Return the (mz, intensities) of scan `i` as views."""
+        i = range(len(self))[i]
+        start, stop = self.offsets[i], self.offsets[i + 1]
+        return self.mz[start:stop], self.intensities[start:stop]
+
+    def select_mz(self, mz_range: tuple) -> "RaggedScans":
+        """Keep the points with `mz_range[0] <= mz <= mz_range[1]` in every scan."""
+        keep = (self.mz >= mz_range[0]) & (self.mz <= mz_range[1])
+        counts = np.bincount(self.scan_index[keep], minlength=len(self))
+        offsets = np.concatenate(([0], np.cumsum(counts)))
+        return RaggedScans(self.mz[keep], self.intensities[keep], offsets, self.times)
+
+    def sum(self, mz_range: tuple = None) -> np.ndarray:
+        """Return the summed intensity of every scan (the total ion current), or of the
+        points with `mz_range[0] <= mz <= mz_range[1]`.
+        """
+        scans = self if mz_range is None else self.select_mz(mz_range)
+        sums = np.bincount(
+            scans.scan_index, weights=scans.intensities, minlength=len(self)
+        )
+        return sums.astype(np.result_type(self.intensities.dtype, np.float32))
+
+    def to_dense(self, mz: np.ndarray = None, tolerance: float = None) -> np.ndarray:
+        """Convert to a dense (n_scans, mz.size) intensity matrix.
+
+        Parameters
+        ----------
+        mz : np.ndarray, optional
+            The sorted m/z grid of the columns, every point is added to the closest one.
+            By default the grid is made of all the distinct m/z values in the scans, so
+            zero-suppressed scans of a common grid are restored exactly.
+        tolerance : float, optional
+            Drop the points that are further than this from the closest grid value, by
+            default all the points are kept.
+
+        Returns
+        -------
+        np.ndarray
+            The intensities, with zeros where a scan has no points. Points of a scan
+            that fall on the same grid value are summed.
+        """
+        if mz is None:
+            mz = np.unique(self.mz)
+            columns = np.searchsorted(mz, self.mz)
+            keep = slice(None)
+        else:
+            mz = np.asarray(mz)
+            if mz.size < 2:
+                columns = np.zeros(self.mz.size, dtype=np.int64)
+            else:
+                right = np.clip(np.searchsorted(mz, self.mz), 1, mz.size - 1)
+                left = right - 1
+                closer = np.abs(self.mz - mz[left]) <= np.abs(mz[right] - self.mz)
+                columns = np.where(closer, left, right)
+            keep = slice(None)
+            if tolerance is not None:
+                keep = np.abs(self.mz - mz[columns]) <= tolerance
+                columns = columns[keep]
+
+        dtype = np.result_type(self.intensities.dtype, np.float32)
+        flat = self.scan_index[keep] * mz.size + columns
+        dense = np.bincount(
+            flat, weights=self.intensities[keep], minlength=len(self) * mz.size
+        )
+        return dense.reshape(len(self), mz.size).astype(dtype, copy=False)
@@ -0,0 +1,368 @@
+"""
+Loading many runs (an mzXML file plus an optional LabView log each) at once, with the
+decoded arrays of every run cached by `read_mzXML`.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from .cache import get_fingerprint_cache_dir, load_cache, save_cache, clear_cache
+from .cache import is_cache_valid, write_manifest, fast_hash
+from .utils import read_mzXML, is_mzXML_cached
+
+# The columns of the LabView logs, as in the examples
+LABVIEW_COLUMNS = ["time", "b", "temp", "d", "e", "f", "g", "h"]
+# Bump whenever a change to the alignment invalidates existing caches
+_ALIGN_CACHE_VERSION = 1
+_ALIGN_CACHE_NAMES = ["times", "channels"]
+
+
+def read_labview(filename: str, columns: list = LABVIEW_COLUMNS) -> pd.DataFrame:
+    """Read a LabView CSV log, with the times relative to the first row.
+
+    Parameters
+    ----------
+    filename : str
+        The path to the CSV file (without a header).
+    columns : list, optional
+        The names of the columns, by default `LABVIEW_COLUMNS`.
+
+    Returns
+    -------
+    pd.DataFrame
+        The log, where df["time"] starts at 0.
+    """
+    df = pd.read_csv(filename, names=columns)
+    df["time"] -= df["time"][0]
+    return df
+
+
+def align_channels(
+    times: np.ndarray, lv_times: np.ndarray, values: np.ndarray, method: str = "linear"
+) -> np.ndarray:
+    """Align LabView channels sampled at `lv_times` onto the scan `times`.
+
+    All the channels are aligned at once from a single `np.searchsorted` of the scan
+    times.
+
+    Parameters
+    ----------
+    times : np.ndarray
+        The scan times.
+    lv_times : np.ndarray
+        The sorted times of the LabView samples.
+    values : np.ndarray
+        The (n_samples, n_channels) values of the channels.
+    method : str, optional
+        Either "linear" (the default), which interpolates linearly between the samples
+        like `np.interp` on every channel, or "asof", which takes the last sample at or
+        before each scan (the first sample for scans before it).
+
+    Returns
+    -------
+    np.ndarray
+        The (n_scans, n_channels) values of the channels at the scan times.
+    """
+    if method not in ("linear", "asof"):
+        raise ValueError(f"Unknown method {method}, use 'linear' or 'asof'")
+    times, lv_times = (np.asarray(times), np.asarray(lv_times))
+    values = np.asarray(values, dtype=np.float64).reshape(lv_times.size, -1)
+    if lv_times.size == 0:
+        raise ValueError("There are no LabView samples to align")
+
+    after = np.searchsorted(lv_times, times, side="right")
+    if method == "asof" or lv_times.size == 1:
+        return values[np.maximum(after - 1, 0)]
+
+    right = np.clip(after, 1, lv_times.size - 1)
+    left = right - 1
+    dt = lv_times[right] - lv_times[left]
+    weights = np.divide(
+        times - lv_times[left], dt, out=np.ones(times.size), where=dt > 0
+    )
+    weights = np.clip(weights, 0, 1)[:, np.newaxis]
+    return values[left] * (1 - weights) + values[right] * weights
+
+
+def _get_run_cache_dir(mzXML_path: str, cache_dir: str) -> str:
+    # By default every run is cached next to its mzXML file
+    return (
+        os.path.dirname(os.path.abspath(mzXML_path)) if cache_dir is None else cache_dir
+    )
+
+
+def _cache_run(mzXML_path: str, dtype, cache_dir: str):
+    # Decode an mzXML file into its cache, runs in a worker process
+    read_mzXML(mzXML_path, dtype, cache_dir=cache_dir)
+
+
+def align_run(
+    mzXML_path: str,
+    labview_path: str,
+    method: str = "linear",
+    truncate: bool = True,
+    mz_range: tuple = None,
+    dtype=np.float64,
+    cache_dir: str = None,
+    columns: list = LABVIEW_COLUMNS,
+) -> dict:
+    """Read a run and align every channel of its LabView log onto the scan times.
+
+    This replaces reading the CSV, zeroing its time, dropping the scans after the end
+    of the log and interpolating the temperature onto the scan times by hand.
+
+    Parameters
+    ----------
+    mzXML_path : str
+        The path to the mzXML file.
+    labview_path : str
+        The path to the LabView CSV log (see `read_labview`).
+    method : str, optional
+        How to align the channels, "linear" (the default) or "asof" (see
+        `align_channels`).
+    truncate : bool, optional
+        Whether to drop the scans after the last LabView sample, by default True as the
+        LabView logging is stopped after the mass spec.
+    mz_range : tuple, optional
+        Only keep the m/z values with `mz_range[0] <= mz <= mz_range[1]`.
+    dtype : np.dtype, optional
+        The floating point type of the intensities, by default np.float64.
+    cache_dir : str, optional
+        A directory to cache the decoded scans (see `read_mzXML`) and the aligned table
+        in, by default nothing is cached. The aligned table is keyed by the fingerprint
+        of the LabView log and rebuilt when either file changes.
+    columns : list, optional
+        The names of the columns of the log, by default `LABVIEW_COLUMNS`.
+
+    Returns
+    -------
+    dict
+        The data of `read_mzXML` (mz, intensities and times) plus data["labview"], a
+        DataFrame with every LabView channel at the scan times (one row per scan,
+        indexed by the scan time).
+
+    Examples
+    --------
+    >>> data = align_run("run.mzXML", "run.csv", mz_range=(130, 180))
+    >>> temp_interp = data["labview"]["temp"].to_numpy()
+    """
+    channels = [c for c in columns if c != "time"]
+    aligned_cache_dir, params = (None, None)
+    if cache_dir is not None:
+        aligned_cache_dir = get_fingerprint_cache_dir(labview_path, cache_dir)
+        params = {
+            "mzXML_hash": fast_hash(mzXML_path),
+            "method": method,
+            "truncate": truncate,
+            "columns": list(columns),
+        }
+
+    if aligned_cache_dir is not None and is_cache_valid(
+        aligned_cache_dir,
+        labview_path,
+        _ALIGN_CACHE_VERSION,
+        params,
+        _ALIGN_CACHE_NAMES,
+    ):
+        cache = load_cache(aligned_cache_dir, _ALIGN_CACHE_NAMES, mmap_mode=None)
+        times, values = (cache["times"], cache["channels"])
+        data = read_mzXML(
+            mzXML_path,
+            dtype,
+            scans=slice(times.size),
+            mz_range=mz_range,
+            cache_dir=cache_dir,
+        )
+    else:
+        df = read_labview(labview_path, columns)
+        lv_times = df["time"].to_numpy()
+        rt_range = (-np.inf, lv_times[-1]) if truncate else None
+        data = read_mzXML(
+            mzXML_path,
+            dtype,
+            rt_range=rt_range,
+            mz_range=mz_range,
+            cache_dir=cache_dir,
+        )
+        times = data["times"]
+        values = align_channels(times, lv_times, df[channels].to_numpy(), method)
+        if aligned_cache_dir is not None:
+            clear_cache(aligned_cache_dir)
+            save_cache(aligned_cache_dir, times=times, channels=values)
+            write_manifest(
+                aligned_cache_dir, labview_path, _ALIGN_CACHE_VERSION, params
+            )
+
+    data["labview"] = pd.DataFrame(
+        values, columns=channels, index=pd.Index(times, name="time")
+    )
+    return data
+
+
+class Run:
+    """One run: the decoded scans of its mzXML file and optionally its LabView log.
+
+    Attributes
+    ----------
+    name : str
+        The name of the mzXML file without its extension.
+    mzXML_path, labview_path : str
+        The paths of the files (`labview_path` is None without a log).
+    cache_dir : str
+        The directory of the cache of the decoded arrays (see `read_mzXML`).
+    mz : np.ndarray
+        The m/z values.
+    intensities : np.memmap
+        The (n_scans, scan_size) intensities, memory-mapped from the cache.
+    times : np.ndarray
+        The scan times in seconds.
+    labview : pd.DataFrame
+        The LabView log (see `read_labview`) or None.
+    """
+
+    def __init__(
+        self,
+        mzXML_path: str,
+        labview_path: str = None,
+        dtype=np.float64,
+        cache_dir: str = None,
+        **kwargs,
+    ):
+        self.name = os.path.splitext(os.path.basename(mzXML_path))[0]
+        self.mzXML_path = mzXML_path
+        self.labview_path = labview_path
+        self.cache_dir = _get_run_cache_dir(mzXML_path, cache_dir)
+
+        data = read_mzXML(mzXML_path, dtype, cache_dir=self.cache_dir)
+        self.mz = data["mz"]
+        self.intensities = data["intensities"]
+        self.times = data["times"]
+        self.labview = None
+        if labview_path is not None:
+            self.labview = read_labview(labview_path, **kwargs)
+
+    def __repr__(self) -> str:
+        return (
+            f"Run({self.name!r}, n_scans={len(self.times)}, scan_size={self.mz.size})"
+        )
+
+
+class RunCollection:
+    """The runs loaded with `load_runs`, in the given order.
+
+    Runs can be looked up by position or by name, e.g. `runs[0]` or
+    `runs["20200124_17645"]`, and `runs.metadata` summarises all of them.
+    """
+
+    def __init__(self, runs: list):
+        self.runs = list(runs)
+        self.names = [run.name for run in self.runs]
+        if len(set(self.names)) != len(self.names):
+            raise ValueError("The runs must have distinct file names")
+
+    def __len__(self) -> int:
+        return len(self.runs)
+
+    def __iter__(self):
+        return iter(self.runs)
+
+    def __getitem__(self, key) -> Run:
+        if isinstance(key, str):
+            return self.runs[self.names.index(key)]
+        return self.runs[key]
+
+    @property
+    def metadata(self) -> pd.DataFrame:
+        """A table with one row per run: its files, the number of scans, the scan size,
+        the m/z and time ranges and the type of the intensities.
+        """
+        rows = [
+            {
+                "name": run.name,
+                "mzXML_path": run.mzXML_path,
+                "labview_path": run.labview_path,
+                "n_scans": run.times.size,
+                "scan_size": run.mz.size,
+                "mz_min": run.mz.min() if run.mz.size else np.nan,
+                "mz_max": run.mz.max() if run.mz.size else np.nan,
+                "time_max": run.times.max() if run.times.size else np.nan,
+                "dtype": run.intensities.dtype.name,
+            }
+            for run in self.runs
+        ]
+        return pd.DataFrame(rows).set_index("name")
+
+    @property
+    def same_mz(self) -> bool:
+        """Whether all the runs were recorded on the same m/z grid."""
+        return all(
+            run.mz.shape == self.runs[0].mz.shape and np.all(run.mz == self.runs[0].mz)
+            for run in self.runs[1:]
+        )
+
+
+def load_runs(
+    paths: list,
+    n_workers: int = None,
+    dtype=np.float64,
+    cache_dir: str = None,
+    **kwargs,
+) -> RunCollection:
+    """Load many runs, decoding their mzXML files concurrently.
+
+    The decoded arrays of every run are cached by `read_mzXML` and memory-mapped from
+    there, so loading runs whose files didn't change only opens the caches.
+
+    Parameters
+    ----------
+    paths : list
+        The runs, each either the path to an mzXML file or a tuple
+        (mzXML path, LabView CSV path).
+    n_workers : int, optional
+        The number of processes decoding the runs that aren't cached yet, by default
+        they're decoded serially.
+    dtype : np.dtype, optional
+        The floating point type of the intensities, by default np.float64.
+    cache_dir : str, optional
+        The directory of the caches (see `read_mzXML`), by default every run is cached
+        in the directory of its mzXML file.
+    **kwargs
+        Passed on to `read_labview`, e.g. `columns`.
+
+    Returns
+    -------
+    RunCollection
+        The runs in the order of `paths`.
+
+    Examples
+    --------
+    >>> runs = load_runs([("run1.mzXML", "run1.csv"), ("run2.mzXML", "run2.csv")], 8)
+    >>> runs.metadata
+    >>> run = runs["run1"]
+    >>> run.intensities.shape, run.labview["temp"].max()
+    """
+    paths = [(p, None) if isinstance(p, str) else tuple(p) for p in paths]
+    stale = {}
+    for mzXML_path, _ in paths:
+        run_cache_dir = _get_run_cache_dir(mzXML_path, cache_dir)
+        if not is_mzXML_cached(mzXML_path, dtype, run_cache_dir):
+            stale[os.path.abspath(mzXML_path)] = run_cache_dir
+
+    if n_workers is None or len(stale) < 2:
+        for mzXML_path, run_cache_dir in stale.items():
+            _cache_run(mzXML_path, dtype, run_cache_dir)
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            futures = [
+                pool.submit(_cache_run, mzXML_path, dtype, run_cache_dir)
+                for mzXML_path, run_cache_dir in stale.items()
+            ]
+            for future in futures:
+                future.result()
+
+    return RunCollection(
+        Run(mzXML_path, labview_path, dtype, cache_dir, **kwargs)
+        for mzXML_path, labview_path in paths
+    )
@@ -0,0 +1,228 @@
+"""
+Chunked on-disk experiment store. The intensities are tiled in both the scan and the
+m/z dimension so a window query (e.g. a temperature range crossed with an m/z range)
+only reads the tiles it overlaps.
+
+A store is a self-contained directory:
+
+    store.json       shape, tile size, dtype and compression
+    mz.npy           the m/z values
+    times.npy        the scan times
+    tiles/i_j.npy    tile (i, j), or tiles/i_j.zlib when compressed
+"""
+import json
+import os
+import shutil
+import zlib
+
+import numpy as np
+
+from ._ranges import range_slice
+
+_STORE_VERSION = 1
+_METADATA = "store.json"
+# Detector noise barely compresses at higher levels, so favour speed
+_ZLIB_LEVEL = 1
+
+
+def _tile_path(path: str, i: int, j: int, compression: str) -> str:
+    extension = "zlib" if compression == "zlib" else "npy"
+    return os.path.join(path, "tiles", f"{i}_{j}.{extension}")
+
+
+def write_store(
+    path: str,
+    mz: np.ndarray,
+    intensities,
+    times: np.ndarray = None,
+    chunks: tuple = (1024, 1024),
+    compression: str = None,
+    overwrite: bool = False,
+):
+    """Write an experiment to a chunked store at `path`.
+
+    The intensities are read one band of `chunks[0]` scans at a time, so memory-mapped
+    arrays (e.g. from `read_exported_txt`) or an `ExportedTxtDataset` larger than memory
+    can be written.
+
+    Parameters
+    ----------
+    path : str
+        The directory of the store.
+    mz : np.ndarray
+        1D array of the m/z values.
+    intensities : np.ndarray
+        2D (n_scans, scan_size) array (or anything that supports slicing of scans).
+    times : np.ndarray, optional
+        The scan times, by default the scan numbers.
+    chunks : tuple, optional
+        The (n_scans, n_mz) size of each tile, by default (1024, 1024).
+    compression : str, optional
+        Either `None` (raw .npy tiles that can be memory-mapped) or "zlib".
+    overwrite : bool, optional
+        Whether to replace an existing store at `path`.
+
+    Raises
+    ------
+    ValueError
+        If the store exists (and `overwrite` is False) or the arguments don't match.
+    """
+    if compression not in (None, "zlib"):
+        raise ValueError(f"Unknown compression {compression}, use None or 'zlib'")
+    n_scans, scan_size = intensities.shape
+    if mz.size != scan_size:
+        raise ValueError("The size of mz doesn't match the intensities")
+    if times is None:
+        times = np.arange(n_scans, dtype=np.float64)
+    if times.size != n_scans:
+        raise ValueError("The size of times doesn't match the intensities")
+
+    if os.path.exists(path):
+        if not overwrite:
+            raise ValueError(f"{path} already exists, use overwrite=True to replace it")
+        shutil.rmtree(path)
+    os.makedirs(os.path.join(path, "tiles"))
+
+    np.save(os.path.join(path, "mz.npy"), mz)
+    np.save(os.path.join(path, "times.npy"), times)
+
+    cs, cm = chunks
+    dtype = None
+    for i, r0 in enumerate(range(0, n_scans, cs)):
+        band = np.asarray(intensities[r0 : r0 + cs])
+        dtype = band.dtype
+        for j, c0 in enumerate(range(0, scan_size, cm)):
+            tile = np.ascontiguousarray(band[:, c0 : c0 + cm])
+            if compression == "zlib":
+                with open(_tile_path(path, i, j, compression), "wb") as f:
+                    f.write(zlib.compress(tile.tobytes(), _ZLIB_LEVEL))
+            else:
+                np.save(_tile_path(path, i, j, compression), tile)
+
+    # Written last so a partially written store can't be opened
+    metadata = {
+        "version": _STORE_VERSION,
+        "shape": [n_scans, scan_size],
+        "chunks": [cs, cm],
+        "dtype": np.dtype(dtype or np.float64).str,
+        "compression": compression,
+    }
+    with open(os.path.join(path, _METADATA), "w") as f:
+        json.dump(metadata, f, indent=2)
+
+
+class ExperimentStore:
+    """Read access to a chunked store written with `write_store`.
+
+    Indexing the store with `store[scans, mz_columns]` (slices or ints) or calling
+    `query` only reads the tiles that overlap the requested window.
+
+    Parameters
+    ----------
+    path : str
+        The directory of the store.
+
+    Examples
+    --------
+    >>> store = read_store("run_store")
+    >>> times, mz, block = store.query(rt_range=(600, 900), mz_range=(130, 180))
+    """
+
+    def __init__(self, path: str):
+        with open(os.path.join(path, _METADATA), "r") as f:
+            metadata = json.load(f)
+        if metadata["version"] != _STORE_VERSION:
+            raise ValueError(f"Unsupported store version {metadata['version']}")
+
+        self.path = path
+        self.shape = tuple(metadata["shape"])
+        self.chunks = tuple(metadata["chunks"])
+        self.dtype = np.dtype(metadata["dtype"])
+        self.compression = metadata["compression"]
+        self.mz = np.load(os.path.join(path, "mz.npy"))
+        self.times = np.load(os.path.join(path, "times.npy"))
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def _read_tile(self, i: int, j: int) -> np.ndarray:
+        tile_path = _tile_path(self.path, i, j, self.compression)
+        if self.compression == "zlib":
+            rows = min(self.chunks[0], self.shape[0] - i * self.chunks[0])
+            columns = min(self.chunks[1], self.shape[1] - j * self.chunks[1])
+            # Decompress into a buffer of the size of the tile, instead of growing one
+            size = rows * columns * self.dtype.itemsize
+            with open(tile_path, "rb") as f:
+                data = zlib.decompress(f.read(), bufsize=max(size, 1))
+            return np.frombuffer(data, dtype=self.dtype).reshape(rows, -1)
+        return np.load(tile_path, mmap_mode="r")
+
+    def read(self, scans: slice, columns: slice) -> np.ndarray:
+        """Read the window `[scans, columns]` of the intensities (both slices with
+        a positive step) from the tiles it overlaps.
+        """
+        r0, r1, rs = scans.indices(self.shape[0])
+        c0, c1, csp = columns.indices(self.shape[1])
+        if rs < 1 or csp < 1:
+            raise ValueError("Only slices with a positive step are supported")
+        r1, c1 = (max(r0, r1), max(c0, c1))
+
+        cs, cm = self.chunks
+        out = np.empty((r1 - r0, c1 - c0), dtype=self.dtype)
+        for i in range(r0 // cs, -(-r1 // cs)):
+            for j in range(c0 // cm, -(-c1 // cm)):
+                tile = self._read_tile(i, j)
+                # Overlap of the tile with the window, in global coordinates
+                a0, a1 = (max(r0, i * cs), min(r1, (i + 1) * cs))
+                b0, b1 = (max(c0, j * cm), min(c1, (j + 1) * cm))
+                out[a0 - r0 : a1 - r0, b0 - c0 : b1 - c0] = tile[
+                    a0 - i * cs : a1 - i * cs, b0 - j * cm : b1 - j * cm
+                ]
+        return out[::rs, ::csp]
+
+    def __getitem__(self, key) -> np.ndarray:
+        if not isinstance(key, tuple):
+            key = (key, slice(None))
+        scans, columns = key
+
+        squeeze = []
+        if isinstance(scans, (int, np.integer)):
+            scans = slice(scans, scans + 1) if scans != -1 else slice(-1, None)
+            squeeze.append(0)
+        if isinstance(columns, (int, np.integer)):
+            columns = slice(columns, columns + 1) if columns != -1 else slice(-1, None)
+            squeeze.append(1)
+
+        out = self.read(scans, columns)
+        return out.squeeze(axis=tuple(squeeze)) if squeeze else out
+
+    def query(
+        self, rt_range: tuple = None, mz_range: tuple = None, scans: slice = None
+    ) -> tuple:
+        """Read a rectangle of scans and m/z values.
+
+        Parameters
+        ----------
+        rt_range : tuple, optional
+            Keep the scans with `rt_range[0] <= times <= rt_range[1]`, the times have to
+            be sorted.
+        mz_range : tuple, optional
+            Keep the m/z values with `mz_range[0] <= mz <= mz_range[1]`, the m/z values
+            have to be sorted.
+        scans : slice, optional
+            Keep a slice of scans instead of using `rt_range`.
+
+        Returns
+        -------
+        (np.ndarray, np.ndarray, np.ndarray)
+            The times, m/z values and intensities of the window.
+        """
+        if scans is None or rt_range is not None:
+            scans = range_slice(self.times, rt_range)
+        columns = range_slice(self.mz, mz_range)
+        return self.times[scans], self.mz[columns], self.read(scans, columns)
+
+
+def read_store(path: str) -> ExperimentStore:
+    """Open the chunked store at `path` (see `write_store`)."""
+    return ExperimentStore(path)
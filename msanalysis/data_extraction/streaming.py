@@ -0,0 +1,102 @@
+"""
+Generators that stream scans in batches so files larger than memory can be analysed.
+"""
+import numpy as np
+
+from .lazy import ExportedTxtDataset
+from .mzml import MzMLDataset
+from .mzxml import iter_mzXML_spectra
+from .utils import _CHUNK_SIZE
+
+
+def _iter_txt_batches(filename: str, batch_size: int, chunk_size: int, dtype):
+    dataset = ExportedTxtDataset(filename, chunk_size, dtype)
+    for start in range(0, len(dataset), batch_size):
+        scans = np.arange(start, min(start + batch_size, len(dataset)))
+        # The text exports don't have timestamps, so the scan numbers are used
+        yield scans.astype(np.float64), dataset.mz, dataset.read_scans(scans)
+
+
+def _iter_mzML_batches(filename: str, batch_size: int, dtype):
+    dataset = MzMLDataset(filename, dtype)
+    for start in range(0, len(dataset), batch_size):
+        scans = slice(start, start + batch_size)
+        yield dataset.times[scans], dataset.mz, dataset[scans]
+
+
+def _iter_mzXML_batches(filename: str, batch_size: int, dtype):
+    mz = None
+    times, block, n = (None, None, 0)
+    for i, scan in enumerate(iter_mzXML_spectra(filename)):
+        if mz is None:
+            mz = scan["mz"]
+        if scan["intensity"].size == 0:
+            print(f"Scan {i} (0-based indexing) is empty.")
+            raise ValueError(f"One (or more) empty scans in {filename}, exiting!!")
+        if scan["intensity"].size != mz.size:
+            raise ValueError(f"Scan {i} in {filename} doesn't match the m/z of scan 0")
+
+        if block is None:
+            times = np.empty(batch_size)
+            block = np.empty((batch_size, mz.size), dtype=dtype)
+            n = 0
+        times[n] = scan["time"]
+        block[n] = scan["intensity"]
+        n += 1
+        if n == batch_size:
+            yield times, mz, block
+            block = None
+
+    if block is not None:
+        yield times[:n], mz, block[:n]
+
+
+def iter_scans(
+    filename: str,
+    batch_size: int = 1000,
+    chunk_size: int = _CHUNK_SIZE,
+    dtype=np.float64,
+):
+    """Iterate over the scans of an mzXML file, an indexed mzML file or a text file
+    exported by the merlin software in batches of `batch_size` scans.
+
+    Only one batch is held in memory at a time, so this works for files that are much
+    larger than the available memory. Concatenating the batches gives the same data as
+    `read_mzXML` or `read_exported_txt`. See `msanalysis.data_processing.streaming` for
+    analysis functions that consume these batches.
+
+    Parameters
+    ----------
+    filename : str
+        The path to the mzXML (.mzXML), indexed mzML (.mzML) or text export (.txt) file.
+    batch_size : int, optional
+        The number of scans in each batch, by default 1000.
+    chunk_size : int, optional
+        The number of bytes read at once from text exports, by default 64 MB.
+    dtype : np.dtype, optional
+        The floating point type of the intensities, by default np.float64.
+
+    Yields
+    ------
+    (np.ndarray, np.ndarray, np.ndarray)
+        The times of the scans in seconds (the scan numbers for text exports, which
+        don't have timestamps), the m/z values and the (n_batch, scan_size) intensities.
+
+    Raises
+    ------
+    ValueError
+        If the file type isn't supported or (for mzXML and mzML) a scan is empty.
+    """
+    if batch_size < 1:
+        raise ValueError("batch_size must be at least 1")
+
+    extension = filename.lower().rsplit(".", 1)[-1]
+    if extension == "mzxml":
+        return _iter_mzXML_batches(filename, batch_size, dtype)
+    elif extension == "mzml":
+        return _iter_mzML_batches(filename, batch_size, dtype)
+    elif extension == "txt":
+        return _iter_txt_batches(filename, batch_size, chunk_size, dtype)
+    raise ValueError(
+        f"Can't stream scans from {filename}, expected .mzXML, .mzML or .txt"
+    )
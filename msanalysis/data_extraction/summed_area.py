@@ -0,0 +1,223 @@
+"""
+Summed-area tables (2D prefix sums) of the intensities, so the total intensity of any
+rectangle of scans and m/z values takes four lookups instead of a pass over the data.
+"""
+import os
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+from ._ranges import range_slice
+from .cache import append_rows
+
+_SUMMED_AREA = "summed_area.npy"
+_BLOCK_BYTES = 64 * 1024**2  # bytes of intensities summed at a time
+
+
+def _summed_area_rows(block: np.ndarray, last_row: np.ndarray) -> np.ndarray:
+    # The rows of the table for a block of scans, given the row before them
+    rows = np.zeros((block.shape[0], block.shape[1] + 1))
+    np.cumsum(block, axis=1, dtype=np.float64, out=rows[:, 1:])
+    np.cumsum(rows, axis=0, out=rows)
+    rows += last_row
+    return rows
+
+
+def _iter_summed_area_rows(intensities, last_row: np.ndarray, start: int = 0):
+    # Yield (first row, rows) of the table for the scans from start on, a block at a time
+    row_bytes = max(intensities.shape[1] * 8, 1)
+    block_size = max(_BLOCK_BYTES // row_bytes, 1)
+    for i in range(start, intensities.shape[0], block_size):
+        rows = _summed_area_rows(np.asarray(intensities[i : i + block_size]), last_row)
+        last_row = rows[-1]
+        yield i + 1, rows
+
+
+def build_summed_area(intensities, filename: str = None) -> np.ndarray:
+    """Build the summed-area table of the intensities in one pass over the scans.
+
+    Parameters
+    ----------
+    intensities : np.ndarray
+        2D (n_scans, scan_size) array, which can be memory-mapped. It's read a block of
+        scans at a time.
+    filename : str, optional
+        Write the table to this .npy file and return it memory-mapped, by default it's
+        built in memory.
+
+    Returns
+    -------
+    np.ndarray
+        The (n_scans + 1, scan_size + 1) float64 table, where `table[i, j]` is the sum of
+        `intensities[:i, :j]`.
+    """
+    n_scans, scan_size = intensities.shape
+    shape = (n_scans + 1, scan_size + 1)
+    if filename is None:
+        table = np.zeros(shape)
+    else:
+        table = open_memmap(filename, mode="w+", dtype=np.float64, shape=shape)
+        table[0] = 0
+    for i, rows in _iter_summed_area_rows(intensities, np.zeros(scan_size + 1)):
+        table[i : i + rows.shape[0]] = rows
+    if filename is not None:
+        table.flush()
+        table = np.load(filename, mmap_mode="r")
+    return table
+
+
+class SummedAreaTable:
+    """Constant time sums over rectangles of scans and m/z values.
+
+    The sums are differences of four entries of a float64 summed-area table, so their
+    absolute error is about 1e-16 times the total intensity of the run. That's well
+    below the resolution of float32 intensities, but rectangles holding a tiny fraction
+    of the total lose relative precision.
+
+    Parameters
+    ----------
+    table : np.ndarray
+        The (n_scans + 1, scan_size + 1) table from `build_summed_area`.
+    mz : np.ndarray, optional
+        The m/z values of the columns, needed for `query` with `mz_range`.
+    times : np.ndarray, optional
+        The scan times, needed for `query` with `rt_range`.
+
+    Examples
+    --------
+    >>> mz, intensities = read_exported_txt("run.txt")
+    >>> table = get_summed_area(intensities, mz)
+    >>> table.query(mz_range=(130, 180), scans=slice(1000, 5000))
+    """
+
+    def __init__(self, table: np.ndarray, mz: np.ndarray = None, times=None):
+        self.table = table
+        self.mz = mz
+        self.times = times
+
+    @property
+    def shape(self) -> tuple:
+        """The (n_scans, scan_size) shape of the intensities."""
+        return (self.table.shape[0] - 1, self.table.shape[1] - 1)
+
+    def sums(self, scan_start, scan_stop, column_start, column_stop) -> np.ndarray:
+        """Return the sums of `intensities[scan_start:scan_stop, column_start:column_stop]`
+        for arrays of bounds (broadcast against each other), clipped to the intensities.
+        """
+        n_scans, scan_size = self.shape
+        r0, r1 = (np.clip(scan_start, 0, n_scans), np.clip(scan_stop, 0, n_scans))
+        c0, c1 = (
+            np.clip(column_start, 0, scan_size),
+            np.clip(column_stop, 0, scan_size),
+        )
+        r1, c1 = (np.maximum(r0, r1), np.maximum(c0, c1))
+        t = self.table
+        return t[r1, c1] - t[r0, c1] - t[r1, c0] + t[r0, c0]
+
+    def sum(self, scans: slice = slice(None), columns: slice = slice(None)) -> float:
+        """Return the sum of `intensities[scans, columns]` (slices with a step of 1)."""
+        r0, r1, rs = scans.indices(self.shape[0])
+        c0, c1, cs = columns.indices(self.shape[1])
+        if rs != 1 or cs != 1:
+            raise ValueError("Only slices with a step of 1 are supported")
+        return float(self.sums(r0, r1, c0, c1))
+
+    def scan_sums(self, column_start, column_stop) -> np.ndarray:
+        """Return the sums of `intensities[:, column_start:column_stop]` for every scan,
+        as a (n_windows, n_scans) array for 1D arrays of column bounds.
+        """
+        scan_size = self.shape[1]
+        column_start = np.clip(np.asarray(column_start).reshape(-1), 0, scan_size)
+        column_stop = np.clip(np.asarray(column_stop).reshape(-1), 0, scan_size)
+        column_stop = np.maximum(column_start, column_stop)
+        # Read the columns of the bounds once, their differences along the scans are
+        # the cumulative sums of every scan along m/z
+        columns, inverse = np.unique(
+            np.concatenate((column_start, column_stop)), return_inverse=True
+        )
+        cumulative = np.diff(self.table[:, columns], axis=0).T
+        n = column_start.size
+        return cumulative[inverse[n:]] - cumulative[inverse[:n]]
+
+    def query(
+        self, rt_range: tuple = None, mz_range: tuple = None, scans: slice = None
+    ) -> float:
+        """Return the total intensity of a rectangle of scans and m/z values.
+
+        Parameters
+        ----------
+        rt_range : tuple, optional
+            Sum the scans with `rt_range[0] <= times <= rt_range[1]`, the times have to be
+            sorted.
+        mz_range : tuple, optional
+            Sum the m/z values with `mz_range[0] <= mz <= mz_range[1]`, the m/z values
+            have to be sorted.
+        scans : slice, optional
+            Sum a slice of scans instead of using `rt_range`.
+        """
+        if scans is None or rt_range is not None:
+            scans = range_slice(self.times, rt_range)
+        columns = range_slice(self.mz, mz_range)
+        return self.sum(scans, columns)
+
+
+def _cached_intensities_path(intensities) -> str:
+    # The .npy file of the intensities if they're a whole cached array memory-mapped
+    # from it (e.g. by read_exported_txt or the read_mzXML cache), otherwise None
+    filename = getattr(intensities, "filename", None)
+    if filename is None or os.path.basename(filename) != "intensities.npy":
+        return None
+    full = np.load(filename, mmap_mode="r")
+    if full.shape != intensities.shape or full.strides != intensities.strides:
+        return None
+    return filename
+
+
+def get_summed_area(intensities, mz: np.ndarray = None, times=None) -> SummedAreaTable:
+    """Return the summed-area table of the intensities.
+
+    When the intensities are memory-mapped from a dataset cache (`read_exported_txt`
+    or `read_mzXML` with `cache_dir`), the table is stored in that cache directory and
+    memory-mapped, so it's only built once per run. If scans were appended to the cache
+    since (live text exports), only their rows are added to the table. Otherwise the
+    table is built in memory.
+
+    The table takes (n_scans + 1) * (scan_size + 1) * 8 bytes, twice the size of float32
+    intensities.
+
+    Parameters
+    ----------
+    intensities : np.ndarray
+        2D (n_scans, scan_size) array.
+    mz : np.ndarray, optional
+        The m/z values, for `SummedAreaTable.query` with `mz_range`.
+    times : np.ndarray, optional
+        The scan times, for `SummedAreaTable.query` with `rt_range`.
+
+    Returns
+    -------
+    SummedAreaTable
+    """
+    intensities_path = _cached_intensities_path(intensities)
+    if intensities_path is None:
+        return SummedAreaTable(build_summed_area(intensities), mz, times)
+
+    path = os.path.join(os.path.dirname(intensities_path), _SUMMED_AREA)
+    n_scans, scan_size = intensities.shape
+    table = None
+    if os.path.exists(path):
+        table = np.load(path, mmap_mode="r")
+        if table.shape[1] != scan_size + 1 or table.shape[0] > n_scans + 1:
+            table = None
+    if table is None:
+        # Built next to the cache first so an interrupted build is never loaded
+        build_summed_area(intensities, path + ".partial")
+        os.replace(path + ".partial", path)
+        table = np.load(path, mmap_mode="r")
+    elif table.shape[0] < n_scans + 1:
+        last_row = np.array(table[-1])
+        start = table.shape[0] - 1
+        for i, rows in _iter_summed_area_rows(intensities, last_row, start):
+            append_rows(path, rows, i)
+        table = np.load(path, mmap_mode="r")
+    return SummedAreaTable(table, mz, times)
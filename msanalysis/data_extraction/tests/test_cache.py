@@ -0,0 +1,105 @@
+import os
+import pytest
+import numpy as np
+
+from msanalysis.data_extraction.cache import (
+    append_rows,
+    get_cache_dir,
+    is_cache_appendable,
+    is_cache_valid,
+    load_cache,
+    save_cache,
+    write_manifest,
+)
+
+npt = np.testing
+
+
+@pytest.fixture
+def cached_source(tmp_path):
+    source = str(tmp_path / "run.txt")
+    with open(source, "w") as f:
+        f.write("Masses\tIntensities\n1.000\t2.0e0\n")
+
+    cache_dir = get_cache_dir(source)
+    save_cache(cache_dir, mz=np.arange(5.0))
+    write_manifest(cache_dir, source, 1, {"pts_per_amu": 27})
+    return source, cache_dir
+
+
+def test_load_cache(cached_source):
+    _, cache_dir = cached_source
+    cache = load_cache(cache_dir, ["mz"])
+    npt.assert_equal(isinstance(cache["mz"], np.memmap), True)
+    npt.assert_array_equal(cache["mz"], np.arange(5.0))
+
+
+def test_cache_valid(cached_source):
+    source, cache_dir = cached_source
+    npt.assert_equal(
+        is_cache_valid(cache_dir, source, 1, {"pts_per_amu": 27}, ["mz"]), True
+    )
+
+    # Different parser, parameters or arrays
+    npt.assert_equal(
+        is_cache_valid(cache_dir, source, 2, {"pts_per_amu": 27}, ["mz"]), False
+    )
+    npt.assert_equal(
+        is_cache_valid(cache_dir, source, 1, {"pts_per_amu": 9}, ["mz"]), False
+    )
+    npt.assert_equal(
+        is_cache_valid(
+            cache_dir, source, 1, {"pts_per_amu": 27}, ["mz", "intensities"]
+        ),
+        False,
+    )
+
+    # Only touching the file keeps the cache
+    stat = os.stat(source)
+    os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    npt.assert_equal(
+        is_cache_valid(cache_dir, source, 1, {"pts_per_amu": 27}, ["mz"]), True
+    )
+
+    # Re-exported data with the same size
+    with open(source, "w") as f:
+        f.write("Masses\tIntensities\n1.000\t3.0e0\n")
+    os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns + 2 * 10**9))
+    npt.assert_equal(
+        is_cache_valid(cache_dir, source, 1, {"pts_per_amu": 27}, ["mz"]), False
+    )
+
+
+def test_cache_appendable(cached_source):
+    source, cache_dir = cached_source
+    npt.assert_equal(is_cache_appendable(cache_dir, source, 1, ["mz"]), True)
+
+    with open(source, "a") as f:
+        f.write("2.000\t4.0e0\n")
+    npt.assert_equal(is_cache_appendable(cache_dir, source, 1, ["mz"]), True)
+    npt.assert_equal(is_cache_appendable(cache_dir, source, 2, ["mz"]), False)
+
+    # Rewritten from the start
+    with open(source, "w") as f:
+        f.write("Masses\tIntensities\n1.000\t3.0e0\n2.000\t4.0e0\n")
+    npt.assert_equal(is_cache_appendable(cache_dir, source, 1, ["mz"]), False)
+
+
+def test_append_rows(tmp_path):
+    path = str(tmp_path / "rows.npy")
+    rows = np.arange(12, dtype=np.float32).reshape(4, 3)
+    np.save(path, rows[:0])
+    append_rows(path, rows[:1])
+    append_rows(path, rows[1:])
+    npt.assert_array_equal(np.load(path), rows)
+
+    # Replace the last rows
+    append_rows(path, rows[:1], start=3)
+    npt.assert_array_equal(np.load(path), np.concatenate((rows[:3], rows[:1])))
+    append_rows(path, rows[:1], start=1)
+    npt.assert_array_equal(np.load(path), np.concatenate((rows[:1], rows[:1])))
+
+    with pytest.raises(ValueError):
+        append_rows(path, rows[:, :2])
+    with pytest.raises(ValueError):
+        append_rows(path, rows.astype(np.float64))
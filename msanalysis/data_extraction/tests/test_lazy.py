@@ -0,0 +1,95 @@
+import os
+import pytest
+import numpy as np
+
+from msanalysis.data_extraction import ExportedTxtDataset, read_exported_txt
+from msanalysis.data_extraction.cache import get_cache_dir, get_cache_path, clear_cache
+from msanalysis.data_extraction.cache import read_manifest
+from msanalysis.sample_data import get_txt_sample_path
+
+npt = np.testing
+
+
+@pytest.fixture
+def export(tmp_path):
+    # Small export with a few scans so we can index into it
+    mz = np.round(np.linspace(10, 20, 31), 3)
+    intensities = np.arange(7 * 31).reshape(7, 31) * 1.5
+    filename = str(tmp_path / "run.txt")
+    with open(filename, "w") as f:
+        for row in intensities:
+            f.write("Masses\tIntensities\n")
+            f.write("\n".join(f"{m:.3f}\t{i:.4e}" for m, i in zip(mz, row)) + "\n")
+    return filename, mz, intensities
+
+
+def test_dataset_index_persisted(export):
+    filename, mz, _ = export
+    dataset = ExportedTxtDataset(filename)
+    npt.assert_equal(dataset.shape, (7, 31))
+    npt.assert_array_equal(dataset.mz, mz)
+    npt.assert_equal(
+        os.path.exists(get_cache_path(get_cache_dir(filename), "offsets")), True
+    )
+
+
+@pytest.mark.parametrize(
+    "key",
+    [
+        3,
+        -1,
+        slice(2, 5),
+        slice(None, None, 3),
+        [0, 1, 2, 5, 6],
+        (slice(1, 4), slice(5, 9)),
+    ],
+)
+def test_dataset_getitem(export, key):
+    filename, _, intensities = export
+    dataset = ExportedTxtDataset(filename, chunk_size=100)
+    npt.assert_array_equal(dataset[key], intensities[key])
+
+
+def test_dataset_sample():
+    mz, intensities = read_exported_txt(get_txt_sample_path())
+    dataset = ExportedTxtDataset(get_txt_sample_path())
+    window = (mz > 60) & (mz < 280)
+    npt.assert_array_equal(dataset[:, window], intensities[:, window])
+
+
+def test_dataset_keeps_live_cache(export):
+    filename, mz, intensities = export
+    with open(filename, "rb") as f:
+        data = f.read()
+    offsets = ExportedTxtDataset(filename).offsets
+    clear_cache(get_cache_dir(filename))
+
+    # Followed live up to the middle of scan 4
+    with open(filename, "wb") as f:
+        f.write(data[: offsets[4] + 50])
+    read_exported_txt(filename, live=True)
+    with open(filename, "ab") as f:
+        f.write(data[offsets[4] + 50 : offsets[5] + 50])
+
+    # The dataset skips the scan that's being written and leaves the cache as it is
+    dataset = ExportedTxtDataset(filename)
+    npt.assert_equal(dataset.shape, (5, 31))
+    npt.assert_array_equal(dataset[:], intensities[:5])
+    cache_dir = get_cache_dir(filename)
+    npt.assert_equal(read_manifest(cache_dir)["params"], {"live": True})
+    npt.assert_equal(np.load(get_cache_path(cache_dir, "intensities")).shape[0], 4)
+
+    # So the next live update only appends the new scans
+    _, intensities_read = read_exported_txt(filename, live=True)
+    npt.assert_array_equal(intensities_read, intensities[:5])
+
+
+def test_dataset_incomplete_scan(export):
+    filename, _, _ = export
+    offsets = ExportedTxtDataset(filename).offsets
+    with open(filename, "rb") as f:
+        data = f.read()
+    with open(filename, "wb") as f:
+        f.write(data[: offsets[2] + 60])
+    with pytest.raises(AssertionError):
+        ExportedTxtDataset(filename)
@@ -0,0 +1,57 @@
+import pytest
+import numpy as np
+from pyopenms import MSExperiment, MzMLFile, MzXMLFile
+
+from msanalysis.data_extraction import MzMLDataset, iter_scans, read_mzML, read_mzXML
+from msanalysis.sample_data import get_mzXML_sample_path
+
+npt = np.testing
+
+
+@pytest.fixture
+def mzML_file(tmp_path):
+    # pyopenms writes indexed mzML
+    exp = MSExperiment()
+    MzXMLFile().load(get_mzXML_sample_path(), exp)
+    filename = str(tmp_path / "run.mzML")
+    MzMLFile().store(filename, exp)
+    return filename
+
+
+def test_read_mzML(mzML_file):
+    data = read_mzXML(get_mzXML_sample_path())
+    dataset = read_mzML(mzML_file)
+    npt.assert_equal(isinstance(dataset, MzMLDataset), True)
+    npt.assert_equal(dataset.shape, data["intensities"].shape)
+    npt.assert_array_equal(dataset.mz, data["mz"])
+    npt.assert_allclose(dataset.times, data["times"])
+
+    npt.assert_array_equal(dataset[3], data["intensities"][3])
+    npt.assert_array_equal(dataset[5:10], data["intensities"][5:10])
+    npt.assert_array_equal(
+        dataset[[0, -1], 100:200], data["intensities"][[0, -1], 100:200]
+    )
+    npt.assert_array_equal(np.array(list(dataset)), data["intensities"])
+
+    dataset = read_mzML(mzML_file, dtype=np.float32)
+    npt.assert_equal(dataset[:2].dtype, np.float32)
+
+
+def test_read_mzML_not_indexed(tmp_path, mzML_file):
+    with open(mzML_file) as f:
+        text = f.read()
+    # Only keep the <mzML> element, without the index around it
+    filename = str(tmp_path / "plain.mzML")
+    with open(filename, "w") as f:
+        f.write('<?xml version="1.0" encoding="ISO-8859-1"?>\n')
+        f.write(text[text.index("<mzML") : text.index("</mzML>") + len("</mzML>")])
+    with pytest.raises(ValueError):
+        read_mzML(filename)
+
+
+def test_iter_scans_mzML(mzML_file):
+    data = read_mzXML(get_mzXML_sample_path())
+    batches = list(iter_scans(mzML_file, batch_size=7))
+    npt.assert_equal(len(batches), 3)
+    npt.assert_array_equal(np.concatenate([b[2] for b in batches]), data["intensities"])
+    npt.assert_allclose(np.concatenate([b[0] for b in batches]), data["times"])
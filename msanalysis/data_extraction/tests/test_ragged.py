@@ -0,0 +1,48 @@
+import pytest
+import numpy as np
+
+from msanalysis.data_extraction import RaggedScans
+
+npt = np.testing
+
+
+@pytest.fixture
+def scans():
+    # Zero-suppressed scans of the grid 10, 10.5, ..., 12 (the second one is empty)
+    mz = np.array([10.0, 11.0, 12.0, 10.5, 11.0])
+    intensities = np.array([1.0, 2.0, 3.0, 4.0, 5.0])
+    return RaggedScans(mz, intensities, [0, 3, 3, 5], times=[0.0, 2.5, 5.0])
+
+
+def test_ragged_access(scans):
+    npt.assert_equal(len(scans), 3)
+    npt.assert_array_equal(scans.n_points, [3, 0, 2])
+    npt.assert_array_equal(scans.scan_index, [0, 0, 0, 2, 2])
+    npt.assert_array_equal(scans[1][0], [])
+    npt.assert_array_equal(scans[-1][1], [4.0, 5.0])
+    npt.assert_array_equal(scans.sum(), [6.0, 0.0, 9.0])
+    npt.assert_array_equal(scans.sum(mz_range=(10.5, 11)), [2.0, 0.0, 9.0])
+
+    window = scans.select_mz((11, 12))
+    npt.assert_array_equal(window.n_points, [2, 0, 1])
+    npt.assert_array_equal(window.times, scans.times)
+
+    with pytest.raises(ValueError):
+        RaggedScans(np.zeros(3), np.zeros(3), [0, 2])
+
+
+def test_ragged_to_dense(scans):
+    npt.assert_array_equal(
+        scans.to_dense(),
+        [[1.0, 0.0, 2.0, 3.0], [0.0, 0.0, 0.0, 0.0], [0.0, 4.0, 5.0, 0.0]],
+    )
+
+    # Points are added to the closest value of a coarser grid (the lower one on ties)
+    npt.assert_array_equal(
+        scans.to_dense(np.array([10.0, 12.0])), [[3.0, 3.0], [0.0, 0.0], [9.0, 0.0]]
+    )
+    npt.assert_array_equal(
+        scans.to_dense(np.array([10.0, 12.0]), tolerance=0.5),
+        [[1.0, 3.0], [0.0, 0.0], [4.0, 0.0]],
+    )
+    npt.assert_equal(scans.to_dense(np.array([11.0])).shape, (3, 1))
@@ -0,0 +1,122 @@
+import os
+import shutil
+import pytest
+import numpy as np
+
+from msanalysis.data_extraction import load_runs, read_mzXML, align_run
+from msanalysis.data_extraction.runs import (
+    align_channels,
+    read_labview,
+    LABVIEW_COLUMNS,
+)
+from msanalysis.data_extraction.cache import get_fingerprint_cache_dir
+from msanalysis.sample_data import get_mzXML_sample_path, get_csv_sample_path
+
+npt = np.testing
+
+
+@pytest.fixture
+def run_paths(tmp_path):
+    # Three copies of the sample run with their LabView logs
+    paths = []
+    for i in range(3):
+        mzXML_path = str(tmp_path / f"run{i}.mzXML")
+        shutil.copy(get_mzXML_sample_path(), mzXML_path)
+        paths.append((mzXML_path, get_csv_sample_path()))
+    return paths
+
+
+def intensities_path(mzXML_path):
+    cache_dir = get_fingerprint_cache_dir(mzXML_path, os.path.dirname(mzXML_path))
+    return os.path.join(cache_dir, "intensities.npy")
+
+
+@pytest.mark.parametrize("n_workers", [None, 2])
+def test_load_runs(run_paths, n_workers):
+    data = read_mzXML(get_mzXML_sample_path())
+    runs = load_runs(run_paths, n_workers=n_workers)
+    npt.assert_equal(len(runs), 3)
+    npt.assert_equal(runs.names, ["run0", "run1", "run2"])
+    npt.assert_equal(runs.same_mz, True)
+    for run in runs:
+        npt.assert_equal(
+            os.path.isdir(get_fingerprint_cache_dir(run.mzXML_path, run.cache_dir)),
+            True,
+        )
+        npt.assert_equal(isinstance(run.intensities, np.memmap), True)
+        npt.assert_array_equal(run.intensities, data["intensities"])
+        npt.assert_array_equal(run.times, data["times"])
+        npt.assert_equal(run.labview["time"][0], 0)
+
+    metadata = runs.metadata
+    npt.assert_array_equal(metadata["n_scans"], [20, 20, 20])
+    npt.assert_array_equal(metadata.loc["run1", "scan_size"], data["mz"].size)
+
+
+def test_load_runs_cached(run_paths):
+    runs = load_runs(run_paths)
+    mtimes = [os.path.getmtime(intensities_path(p)) for p, _ in run_paths]
+
+    # Unchanged runs only open their cache, the float32 cache is separate
+    runs = load_runs([p for p, _ in run_paths])
+    npt.assert_equal(runs["run2"].labview, None)
+    for (p, _), mtime in zip(run_paths, mtimes):
+        npt.assert_equal(os.path.getmtime(intensities_path(p)), mtime)
+    runs = load_runs([p for p, _ in run_paths], dtype=np.float32)
+    npt.assert_equal(runs.metadata["dtype"].tolist(), ["float32"] * 3)
+
+    with pytest.raises(ValueError):
+        load_runs([run_paths[0][0], run_paths[0][0]])
+
+
+def test_load_runs_cache_dir(run_paths, tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    runs = load_runs(run_paths[:1], cache_dir=cache_dir)
+    npt.assert_equal(runs[0].cache_dir, cache_dir)
+    npt.assert_equal(len(os.listdir(cache_dir)), 1)
+
+
+def test_align_channels():
+    lv_times = np.array([0.0, 1.0, 1.0, 3.0])
+    values = np.array([[0.0, 10.0], [1.0, 20.0], [2.0, 30.0], [4.0, 40.0]])
+    times = np.array([-1.0, 0.5, 1.0, 2.0, 3.0, 5.0])
+    linear = align_channels(times, lv_times, values)
+    for j in range(2):
+        npt.assert_allclose(linear[:, j], np.interp(times, lv_times, values[:, j]))
+    asof = align_channels(times, lv_times, values, method="asof")
+    npt.assert_array_equal(asof[:, 0], [0.0, 0.0, 2.0, 2.0, 4.0, 4.0])
+
+    with pytest.raises(ValueError):
+        align_channels(times, lv_times, values, method="nearest")
+
+
+def test_align_run(tmp_path):
+    mzXML_path = str(tmp_path / "run.mzXML")
+    labview_path = str(tmp_path / "run.csv")
+    shutil.copy(get_mzXML_sample_path(), mzXML_path)
+    shutil.copy(get_csv_sample_path(), labview_path)
+
+    # What the examples used to do by hand
+    df = read_labview(labview_path)
+    last_lv_time = df["time"].to_numpy()[-1]
+    expected = read_mzXML(mzXML_path, rt_range=(0, last_lv_time), mz_range=(130, 180))
+    temp_interp = np.interp(expected["times"], df["time"], df["temp"])
+
+    cache_dir = str(tmp_path / "cache")
+    for _ in range(2):
+        data = align_run(
+            mzXML_path, labview_path, mz_range=(130, 180), cache_dir=cache_dir
+        )
+        for name in ["mz", "intensities", "times"]:
+            npt.assert_array_equal(data[name], expected[name])
+        npt.assert_allclose(data["labview"]["temp"], temp_interp)
+        npt.assert_array_equal(data["labview"].index, expected["times"])
+        npt.assert_equal(list(data["labview"].columns), LABVIEW_COLUMNS[1:])
+        npt.assert_equal(len(os.listdir(cache_dir)), 2)
+
+    # An edited log is realigned
+    with open(labview_path, "a") as f:
+        f.write(f"{len(df)},1e9,0,0,0,0,0,0,0\n")
+    data = align_run(mzXML_path, labview_path, cache_dir=cache_dir)
+    npt.assert_equal(data["times"].size, read_mzXML(mzXML_path)["times"].size)
+    npt.assert_equal(len(os.listdir(cache_dir)), 3)
@@ -0,0 +1,65 @@
+import os
+import pytest
+import numpy as np
+
+from msanalysis.data_extraction import write_store, read_store
+
+npt = np.testing
+
+
+@pytest.fixture
+def run():
+    rng = np.random.default_rng(7)
+    mz = np.linspace(2, 100, 101)
+    times = np.arange(53) * 2.5
+    intensities = rng.random((53, 101)).astype(np.float32)
+    return mz, times, intensities
+
+
+@pytest.mark.parametrize("compression", [None, "zlib"])
+@pytest.mark.parametrize(
+    "key",
+    [
+        (slice(None), slice(None)),
+        (slice(5, 17), slice(30, 61)),
+        (slice(None, None, 3), slice(10, 90, 7)),
+        (4, slice(None)),
+        (-1, 3),
+    ],
+)
+def test_store_roundtrip(tmp_path, run, compression, key):
+    mz, times, intensities = run
+    path = str(tmp_path / "store")
+    write_store(path, mz, intensities, times, chunks=(8, 16), compression=compression)
+
+    store = read_store(path)
+    npt.assert_equal(store.shape, intensities.shape)
+    npt.assert_equal(store.dtype, np.float32)
+    npt.assert_array_equal(store.mz, mz)
+    npt.assert_array_equal(store[key], intensities[key])
+
+
+def test_store_query(tmp_path, run):
+    mz, times, intensities = run
+    path = str(tmp_path / "store")
+    write_store(path, mz, intensities, times, chunks=(8, 16))
+
+    # Tiles outside of the window are never read
+    os.remove(os.path.join(path, "tiles", "0_0.npy"))
+    t, m, block = read_store(path).query(rt_range=(25, 50), mz_range=(40, 60))
+    rows = (times >= 25) & (times <= 50)
+    cols = (mz >= 40) & (mz <= 60)
+    npt.assert_array_equal(t, times[rows])
+    npt.assert_array_equal(m, mz[cols])
+    npt.assert_array_equal(block, intensities[rows][:, cols])
+
+
+def test_store_overwrite(tmp_path, run):
+    mz, times, intensities = run
+    path = str(tmp_path / "store")
+    write_store(path, mz, intensities)
+    with pytest.raises(ValueError):
+        write_store(path, mz, intensities)
+    write_store(path, mz, intensities[:10], overwrite=True)
+    npt.assert_equal(read_store(path).shape, (10, 101))
+    npt.assert_array_equal(read_store(path).times, np.arange(10))
@@ -0,0 +1,35 @@
+import pytest
+import numpy as np
+
+from msanalysis.data_extraction import iter_scans, read_mzXML, read_exported_txt
+from msanalysis.sample_data import get_mzXML_sample_path, get_txt_sample_path
+
+npt = np.testing
+
+
+@pytest.mark.parametrize("batch_size", [1, 3, 1000])
+def test_iter_scans_mzXML(batch_size):
+    data = read_mzXML(get_mzXML_sample_path())
+    batches = list(iter_scans(get_mzXML_sample_path(), batch_size=batch_size))
+    npt.assert_equal(all(b[2].shape[0] <= batch_size for b in batches), True)
+
+    times = np.concatenate([b[0] for b in batches])
+    intensities = np.concatenate([b[2] for b in batches])
+    npt.assert_allclose(times, data["times"])
+    npt.assert_array_equal(batches[0][1], data["mz"])
+    npt.assert_array_equal(intensities, data["intensities"])
+
+
+def test_iter_scans_txt():
+    mz, intensities = read_exported_txt(get_txt_sample_path())
+    batches = list(iter_scans(get_txt_sample_path(), batch_size=1))
+    npt.assert_equal(len(batches), 2)
+    npt.assert_array_equal(batches[0][1], mz)
+    npt.assert_array_equal(np.concatenate([b[2] for b in batches]), intensities)
+
+
+def test_iter_scans_errors():
+    with pytest.raises(ValueError):
+        iter_scans("run.csv")
+    with pytest.raises(ValueError):
+        iter_scans(get_txt_sample_path(), batch_size=0)
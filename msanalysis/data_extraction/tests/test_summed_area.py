@@ -0,0 +1,73 @@
+import os
+import pytest
+import numpy as np
+
+from msanalysis.data_extraction import get_summed_area, SummedAreaTable
+from msanalysis.data_extraction import summed_area
+from msanalysis.data_extraction.summed_area import build_summed_area
+from msanalysis.data_extraction.cache import append_rows, save_cache, load_cache
+
+npt = np.testing
+
+
+@pytest.fixture
+def intensities():
+    rng = np.random.default_rng(1)
+    return (rng.random((40, 25)) * 1000).astype(np.float32)
+
+
+def test_summed_area(intensities, monkeypatch):
+    monkeypatch.setattr(summed_area, "_BLOCK_BYTES", 7 * 26 * 8)
+    table = build_summed_area(intensities)
+    npt.assert_equal(table.shape, (41, 26))
+    npt.assert_allclose(table[-1, -1], intensities.sum(dtype=np.float64))
+
+    mz = np.linspace(50, 74, 25)
+    times = np.arange(40) * 2.0
+    table = SummedAreaTable(table, mz, times)
+    rng = np.random.default_rng(2)
+    for _ in range(20):
+        r0, r1 = np.sort(rng.integers(0, 41, 2))
+        c0, c1 = np.sort(rng.integers(0, 26, 2))
+        expected = intensities[r0:r1, c0:c1].sum(dtype=np.float64)
+        npt.assert_allclose(table.sum(slice(r0, r1), slice(c0, c1)), expected)
+
+    npt.assert_allclose(
+        table.scan_sums([0, 3, 10], [25, 8, 10]),
+        [
+            intensities.sum(axis=1, dtype=np.float64),
+            intensities[:, 3:8].sum(axis=1, dtype=np.float64),
+            np.zeros(40),
+        ],
+    )
+    npt.assert_allclose(
+        table.query(rt_range=(10, 20), mz_range=(55, 60)),
+        intensities[5:11, 5:11].sum(dtype=np.float64),
+    )
+    npt.assert_allclose(table.sum(slice(-5, None)), intensities[-5:].sum())
+    with pytest.raises(ValueError):
+        table.sum(slice(None, None, 2))
+
+
+def test_get_summed_area_cached(intensities, tmp_path):
+    cache_dir = str(tmp_path / "run_cache")
+    save_cache(cache_dir, intensities=intensities[:30])
+    cached = load_cache(cache_dir, ["intensities"])["intensities"]
+
+    # Only whole cached arrays keep their table in the cache
+    get_summed_area(cached[:10])
+    npt.assert_equal(os.listdir(cache_dir), ["intensities.npy"])
+    table = get_summed_area(cached)
+    path = os.path.join(cache_dir, "summed_area.npy")
+    npt.assert_equal(isinstance(table.table, np.memmap), True)
+    npt.assert_array_equal(table.table, build_summed_area(intensities[:30]))
+    mtime = os.path.getmtime(path)
+    get_summed_area(cached)
+    npt.assert_equal(os.path.getmtime(path), mtime)
+
+    # Scans appended to the cache are added to the table
+    append_rows(os.path.join(cache_dir, "intensities.npy"), intensities[30:])
+    cached = load_cache(cache_dir, ["intensities"])["intensities"]
+    table = get_summed_area(cached)
+    npt.assert_equal(table.shape, intensities.shape)
+    npt.assert_allclose(table.table, build_summed_area(intensities))
@@ -1,13 +1,58 @@
 import os
+import base64
+import shutil
+import gc
+import zlib
 import pytest
 import numpy as np
 
-from msanalysis.data_extraction import read_mzXML, read_exported_txt
+from msanalysis.data_extraction import read_mzXML, read_exported_txt, MzXMLDataset
+from msanalysis.data_extraction.mzxml import index_mzXML
+from msanalysis.data_extraction.utils import parse_exported_txt, index_exported_txt
+from msanalysis.data_extraction.cache import get_cache_dir, clear_cache, load_cache
+from msanalysis.data_extraction.cache import get_fingerprint_cache_dir
 from msanalysis.sample_data import get_mzXML_sample_path, get_txt_sample_path
 
 npt = np.testing
 
 
+def write_mzXML(
+    filename, mz, intensities, times, precision=32, compression=None, index=True
+):
+    # Write a minimal mzXML file with network byte order peaks and a scan index
+    dtype = ">f8" if precision == 64 else ">f4"
+    compression_type = compression or "none"
+    parts = [
+        b'<?xml version="1.0" encoding="ISO-8859-1"?>\n',
+        b'<mzXML xmlns="http://sashimi.sourceforge.net/schema_revision/mzXML_3.1">\n',
+        f'<msRun scanCount="{len(times)}">\n'.encode(),
+    ]
+    offsets = []
+    for i, (t, row) in enumerate(zip(times, intensities)):
+        # Ragged scans have their own m/z values
+        scan_mz = mz[i] if isinstance(mz, list) else mz
+        data = np.column_stack((scan_mz, row)).astype(dtype).tobytes()
+        if compression == "zlib":
+            data = zlib.compress(data)
+        offsets.append(sum(len(p) for p in parts))
+        parts.append(
+            f'<scan num="{i + 1}" msLevel="1" peaksCount="{len(scan_mz)}" '
+            f'retentionTime="PT{t}S">\n<peaks precision="{precision}" '
+            f'byteOrder="network" compressionType="{compression_type}">'
+            f"{base64.b64encode(data).decode()}</peaks>\n</scan>\n".encode()
+        )
+    parts.append(b"</msRun>\n")
+    if index:
+        index_offset = sum(len(p) for p in parts)
+        parts.append(b'<index name = "scan" >\n')
+        for i, offset in enumerate(offsets):
+            parts.append(f'<offset id = "{i + 1}" >{offset}</offset>\n'.encode())
+        parts.append(f"</index>\n<indexOffset>{index_offset}</indexOffset>\n".encode())
+    parts.append(b"</mzXML>\n")
+    with open(filename, "wb") as f:
+        f.write(b"".join(parts))
+
+
 def test_read_mzXML():
     data = read_mzXML(get_mzXML_sample_path())
     mz, intensities, times = data["mz"], data["intensities"], data["times"]
@@ -17,16 +62,429 @@ def test_read_mzXML():
 
 
 def test_read_exported_txt():
-    npz_filepath = get_txt_sample_path()[:-3] + "npz"
-    if os.path.exists(npz_filepath):
-        os.remove(npz_filepath)
+    cache_dir = get_cache_dir(get_txt_sample_path())
+    clear_cache(cache_dir)
 
     # Read from file
     mz, intensities = read_exported_txt(get_txt_sample_path())
     npt.assert_equal((2, 26947), intensities.shape)
-    npt.assert_equal(os.path.exists(npz_filepath), True)
+    npt.assert_equal(os.path.exists(cache_dir), True)
+
+    # Read from the cache, the intensities are memory-mapped
+    mz_cached, intensities_cached = read_exported_txt(get_txt_sample_path())
+    npt.assert_equal((2, 26947), intensities_cached.shape)
+    npt.assert_equal(isinstance(intensities_cached, np.memmap), True)
+    npt.assert_array_equal(mz, mz_cached)
+    npt.assert_array_equal(intensities, intensities_cached)
+
+
+@pytest.mark.parametrize("chunk_size", [1000, 65536])
+def test_parse_exported_txt_chunks(chunk_size):
+    # Chunk boundaries shouldn't change the parsed data
+    ref = np.loadtxt(get_txt_sample_path(), comments="M")
+    mz, intensities = parse_exported_txt(get_txt_sample_path(), 2, 26947, chunk_size)
+    npt.assert_equal(mz, ref[:26947, 0])
+    npt.assert_equal(intensities.ravel(), ref[:, 1])
+
+    with pytest.raises(ValueError):
+        parse_exported_txt(get_txt_sample_path(), 3, 26947, chunk_size)
+
+
+@pytest.mark.parametrize("chunk_size", [3, 7, 19, 25])
+def test_read_exported_txt_small_chunks(tmp_path, chunk_size):
+    # Chunks shorter than a line hold only a header or whitespace
+    mz = np.round(np.linspace(10, 20, 31), 3)
+    intensities = np.arange(3 * 31).reshape(3, 31) * 1.5
+    filename = str(tmp_path / "run.txt")
+    with open(filename, "w") as f:
+        for row in intensities:
+            f.write("Masses\tIntensities\n")
+            f.write("\n".join(f"{m:.3f}\t{i:.4e}" for m, i in zip(mz, row)) + "\n")
+
+    mz_read, intensities_read = parse_exported_txt(filename, 3, 31, chunk_size)
+    npt.assert_array_equal(mz_read, mz)
+    npt.assert_array_equal(intensities_read, intensities)
+    mz_read, intensities_read = read_exported_txt(filename, chunk_size=chunk_size)
+    npt.assert_array_equal(mz_read, mz)
+    npt.assert_array_equal(intensities_read, intensities)
+
+
+def test_index_exported_txt():
+    index = index_exported_txt(get_txt_sample_path(), 1000)
+    npt.assert_equal(index["n_points"], [26947, 26947])
+    npt.assert_equal(index["offsets"][-1], os.path.getsize(get_txt_sample_path()))
+    with open(get_txt_sample_path(), "rb") as f:
+        for offset in index["offsets"][:-1]:
+            f.seek(offset)
+            npt.assert_equal(f.readline().startswith(b"Masses"), True)
+
+    ref = np.loadtxt(get_txt_sample_path(), comments="M")
+    npt.assert_equal(index["mz"], ref[:26947, 0])
+
+
+def test_read_exported_txt_geometry(tmp_path):
+    # A mass range other than the usual 2-1000 amu
+    mz = np.round(np.linspace(10, 20, 31), 3)
+    intensities = np.arange(3 * 31).reshape(3, 31) * 1.5
+    filename = str(tmp_path / "run.txt")
+    with open(filename, "w") as f:
+        for row in intensities:
+            f.write("Masses\tIntensities\n")
+            f.write("\n".join(f"{m:.3f}\t{i:.4e}" for m, i in zip(mz, row)) + "\n")
+
+    mz_read, intensities_read = read_exported_txt(filename, pts_per_amu=3)
+    npt.assert_array_equal(mz_read, mz)
+    npt.assert_array_equal(intensities_read, intensities)
+    with pytest.raises(ValueError):
+        read_exported_txt(filename, pts_per_amu=27)
+
+    # Drop the last point of the last scan
+    with open(filename, "rb") as f:
+        data = f.read()
+    with open(filename, "wb") as f:
+        f.write(data[: data[:-1].rfind(b"\n") + 1])
+    with pytest.raises(AssertionError):
+        read_exported_txt(filename)
+
+
+def test_read_exported_txt_single_pass(tmp_path, monkeypatch):
+    from msanalysis.data_extraction import utils
+
+    filename = str(tmp_path / "run.txt")
+    shutil.copy(get_txt_sample_path(), filename)
+    index = index_exported_txt(filename)
+
+    # The scans are indexed while they're parsed, the file is only read once
+    def index_again(*args, **kwargs):
+        raise AssertionError("The export was indexed before it was parsed")
+
+    monkeypatch.setattr(utils, "index_exported_txt", index_again)
+    mz, intensities = read_exported_txt(filename, chunk_size=1000)
+    ref = np.loadtxt(filename, comments="M")
+    npt.assert_equal(mz, ref[:26947, 0])
+    npt.assert_equal(intensities.ravel(), ref[:, 1])
+    cache = load_cache(get_cache_dir(filename), ["offsets", "n_points"])
+    npt.assert_array_equal(cache["offsets"], index["offsets"])
+    npt.assert_array_equal(cache["n_points"], index["n_points"])
+
 
-    # Read from npz file
+def test_parse_exported_txt_workers(tmp_path):
+    filename = str(tmp_path / "run.txt")
+    shutil.copy(get_txt_sample_path(), filename)
+    offsets = index_exported_txt(filename)["offsets"]
+    mz, intensities = parse_exported_txt(filename, 2, 26947)
+    mz_par, intensities_par = parse_exported_txt(
+        filename, 2, 26947, offsets=offsets, n_workers=2
+    )
+    npt.assert_array_equal(mz, mz_par)
+    npt.assert_array_equal(intensities, intensities_par)
+    # The workers share memory, nothing is written next to the export
+    npt.assert_equal(os.listdir(tmp_path), ["run.txt"])
+
+
+def test_read_exported_txt_dtype():
     mz, intensities = read_exported_txt(get_txt_sample_path())
-    npt.assert_equal((2, 26947), intensities.shape)
-    npt.assert_equal(os.path.exists(npz_filepath), True)
+    mz32, intensities32 = read_exported_txt(get_txt_sample_path(), dtype=np.float32)
+    npt.assert_equal(intensities32.dtype, np.float32)
+    npt.assert_array_equal(intensities32, intensities.astype(np.float32))
+
+    # The cache is rebuilt when a different type is requested
+    _, intensities = read_exported_txt(get_txt_sample_path())
+    npt.assert_equal(intensities.dtype, np.float64)
+
+
+def test_read_mzXML_dtype():
+    data = read_mzXML(get_mzXML_sample_path(), dtype=np.float32)
+    npt.assert_equal(data["intensities"].dtype, np.float32)
+
+
+def test_read_exported_txt_live(tmp_path):
+    mz = np.round(np.linspace(10, 20, 31), 3)
+    intensities = np.arange(4 * 31).reshape(4, 31) * 1.5
+    lines = []
+    for row in intensities:
+        lines.append("Masses\tIntensities\r\n")
+        lines.extend(f"{m:.3f}\t{i:.4e}\r\n" for m, i in zip(mz, row))
+    data = "".join(lines).encode()[:-2]  # The export ends without a newline
+    filename = str(tmp_path / "run.txt")
+    with open(filename, "wb") as f:
+        f.write(data)
+    scans = index_exported_txt(filename)["offsets"]
+
+    def export(n_bytes):
+        with open(filename, "wb") as f:
+            f.write(data[:n_bytes])
+
+    # A lone first scan can't be checked yet
+    export(scans[1] - 10)
+    mz_read, intensities_read = read_exported_txt(filename, live=True)
+    npt.assert_equal(intensities_read.shape[0], 0)
+
+    # The partial scan (ending in the middle of a number) is skipped
+    export(scans[2] - 20)
+    mz_read, intensities_read = read_exported_txt(filename, live=True)
+    npt.assert_array_equal(mz_read, mz)
+    npt.assert_array_equal(intensities_read, intensities[:1])
+
+    export(scans[3] + 7)
+    mz_read, intensities_read = read_exported_txt(filename, live=True)
+    npt.assert_array_equal(intensities_read, intensities[:3])
+    mz_read, intensities_read = read_exported_txt(filename, live=True)
+    npt.assert_array_equal(intensities_read, intensities[:3])
+
+    # The last scan of the finished run doesn't end with a newline, it's picked up by
+    # a normal read
+    export(len(data))
+    _, intensities_read = read_exported_txt(filename, live=True)
+    npt.assert_array_equal(intensities_read, intensities[:3])
+    mz_read, intensities_read = read_exported_txt(filename)
+    npt.assert_array_equal(mz_read, mz)
+    npt.assert_array_equal(intensities_read, intensities)
+    index = np.load(os.path.join(get_cache_dir(filename), "offsets.npy"))
+    npt.assert_array_equal(index, index_exported_txt(filename)["offsets"])
+
+    # The finished cache is reused as is
+    _, intensities_read = read_exported_txt(filename)
+    npt.assert_array_equal(intensities_read, intensities)
+
+
+def test_read_exported_txt_live_chunks(tmp_path):
+    # One refresh parses several chunks, appending rows to the cache more than once
+    mz = np.round(np.linspace(10, 20, 31), 3)
+    intensities = np.arange(6 * 31).reshape(6, 31) * 1.5
+    filename = str(tmp_path / "run.txt")
+    with open(filename, "w") as f:
+        for row in intensities:
+            f.write("Masses\tIntensities\n")
+            f.write("\n".join(f"{m:.3f}\t{i:.4e}" for m, i in zip(mz, row)) + "\n")
+    scans = index_exported_txt(filename)["offsets"]
+    with open(filename, "rb") as f:
+        data = f.read()
+    with open(filename, "wb") as f:
+        f.write(data[: scans[5] + 30])
+
+    _, intensities_read = read_exported_txt(filename, live=True, chunk_size=2000)
+    npt.assert_array_equal(intensities_read, intensities[:5])
+    with open(filename, "wb") as f:
+        f.write(data)
+    _, intensities_read = read_exported_txt(filename, chunk_size=2000)
+    npt.assert_array_equal(intensities_read, intensities)
+
+
+def test_read_mzXML_native():
+    data = read_mzXML(get_mzXML_sample_path())
+    native = read_mzXML(get_mzXML_sample_path(), backend="native")
+    npt.assert_array_equal(native["mz"], data["mz"])
+    npt.assert_array_equal(native["intensities"], data["intensities"])
+    npt.assert_allclose(native["times"], data["times"])
+
+    with pytest.raises(ValueError):
+        read_mzXML(get_mzXML_sample_path(), backend="xml")
+
+
+@pytest.mark.parametrize("precision", [32, 64])
+@pytest.mark.parametrize("compression", [None, "zlib"])
+def test_read_mzXML_native_encodings(tmp_path, precision, compression):
+    mz = np.linspace(10, 20, 31)
+    intensities = np.random.default_rng(0).random((3, 31))
+    times = np.array([0.0, 2.5, 5.0])
+    filename = str(tmp_path / "run.mzXML")
+    write_mzXML(filename, mz, intensities, times, precision, compression)
+
+    ref = intensities.astype(np.float32) if precision == 32 else intensities
+    data = read_mzXML(filename, dtype=np.float32, backend="native")
+    npt.assert_equal(data["intensities"].dtype, np.float32)
+    npt.assert_array_equal(data["intensities"], ref.astype(np.float32))
+    data = read_mzXML(filename, backend="native")
+    npt.assert_array_equal(data["intensities"], ref)
+    npt.assert_array_equal(data["times"], times)
+
+
+def test_read_mzXML_scans():
+    data = read_mzXML(get_mzXML_sample_path())
+    part = read_mzXML(get_mzXML_sample_path(), scans=slice(5, 10))
+    npt.assert_array_equal(part["mz"], data["mz"])
+    npt.assert_array_equal(part["intensities"], data["intensities"][5:10])
+    npt.assert_array_equal(part["times"], data["times"][5:10])
+
+    part = read_mzXML(get_mzXML_sample_path(), rt_range=(10, 20))
+    window = (data["times"] >= 10) & (data["times"] <= 20)
+    npt.assert_array_equal(part["intensities"], data["intensities"][window])
+    npt.assert_array_equal(part["times"], data["times"][window])
+
+    part = read_mzXML(get_mzXML_sample_path(), scans=[0, 6, 19], rt_range=(10, 60))
+    npt.assert_array_equal(part["intensities"], data["intensities"][[6, 19]])
+
+
+@pytest.mark.parametrize("chunk_size", [7, 1000, 2**20])
+def test_index_mzXML(tmp_path, chunk_size):
+    mz = np.linspace(10, 20, 31)
+    intensities = np.random.default_rng(0).random((5, 31))
+    times = np.arange(5) * 2.5
+    with_index, without_index = (str(tmp_path / "a.mzXML"), str(tmp_path / "b.mzXML"))
+    write_mzXML(with_index, mz, intensities, times, compression="zlib")
+    write_mzXML(without_index, mz, intensities, times, compression="zlib", index=False)
+
+    offsets = index_mzXML(with_index)
+    npt.assert_equal(offsets.size, 5)
+    npt.assert_array_equal(index_mzXML(without_index, chunk_size), offsets)
+
+    dataset = MzXMLDataset(without_index, dtype=np.float32)
+    npt.assert_equal(dataset.shape, (5, 31))
+    npt.assert_array_equal(dataset.times, times)
+    npt.assert_array_equal(dataset[::2], intensities[::2].astype(np.float32))
+    npt.assert_array_equal(dataset[3, 4:6], intensities[3, 4:6].astype(np.float32))
+
+
+def test_read_mzXML_windows():
+    data = read_mzXML(get_mzXML_sample_path())
+    mz_window = (data["mz"] >= 60) & (data["mz"] <= 280)
+    rt_window = data["times"] <= 30
+
+    part = read_mzXML(get_mzXML_sample_path(), mz_range=(60, 280))
+    npt.assert_array_equal(part["mz"], data["mz"][mz_window])
+    npt.assert_array_equal(part["intensities"], data["intensities"][:, mz_window])
+
+    part = read_mzXML(get_mzXML_sample_path(), rt_range=(0, 30), mz_range=(60, 280))
+    npt.assert_array_equal(part["times"], data["times"][rt_window])
+    npt.assert_array_equal(
+        part["intensities"], data["intensities"][rt_window][:, mz_window]
+    )
+
+
+def test_read_exported_txt_windows():
+    mz, intensities = read_exported_txt(get_txt_sample_path())
+    window = (mz >= 60) & (mz <= 280)
+
+    # Both the freshly parsed and the cached data are windowed
+    clear_cache(get_cache_dir(get_txt_sample_path()))
+    for _ in range(2):
+        mz_part, part = read_exported_txt(
+            get_txt_sample_path(), mz_range=(60, 280), scans=slice(1, None)
+        )
+        npt.assert_equal(isinstance(part, np.memmap), True)
+        npt.assert_array_equal(mz_part, mz[window])
+        npt.assert_array_equal(part, intensities[1:, window])
+
+    mz_part, part = read_exported_txt(get_txt_sample_path(), scans=[0, 0])
+    npt.assert_array_equal(part, intensities[[0, 0]])
+
+
+@pytest.mark.parametrize("precision", [32, 64])
+@pytest.mark.parametrize("compression", [None, "zlib"])
+def test_mzXML_dataset_columns(tmp_path, precision, compression):
+    # Uncompressed windows are decoded from the middle of the base64 text
+    mz = np.linspace(10, 20, 31)
+    intensities = np.random.default_rng(0).random((2, 31))
+    filename = str(tmp_path / "run.mzXML")
+    write_mzXML(filename, mz, intensities, [0, 1], precision, compression)
+    if precision == 32:
+        intensities = intensities.astype(np.float32)
+
+    dataset = MzXMLDataset(filename)
+    npt.assert_array_equal(dataset.mz, mz.astype(intensities.dtype))
+    for start in range(4):
+        for stop in [start, start + 1, 17, 31, 40]:
+            columns = slice(start, stop)
+            npt.assert_array_equal(
+                dataset.read_scans([0, 1], columns), intensities[:, columns]
+            )
+    npt.assert_array_equal(
+        dataset.read_scans([1], slice(2, 20, 3)), intensities[1:, 2:20:3]
+    )
+
+
+def test_read_mzXML_ragged(tmp_path):
+    rng = np.random.default_rng(0)
+    mz = [np.sort(rng.choice(np.arange(100.0), n, replace=False)) for n in [5, 0, 9, 1]]
+    intensities = [rng.random(m.size) for m in mz]
+    filename = str(tmp_path / "run.mzXML")
+    write_mzXML(filename, mz, intensities, [0, 1, 2, 3], precision=64)
+
+    with pytest.raises(ValueError):
+        read_mzXML(filename, backend="native")
+
+    scans = read_mzXML(filename, ragged=True)
+    npt.assert_equal(len(scans), 4)
+    npt.assert_array_equal(scans.n_points, [5, 0, 9, 1])
+    npt.assert_array_equal(scans.times, [0, 1, 2, 3])
+    for i in range(4):
+        npt.assert_array_equal(scans[i][0], mz[i])
+        npt.assert_array_equal(scans[i][1], intensities[i])
+
+    scans = read_mzXML(filename, ragged=True, rt_range=(1, 3), mz_range=(20, 60))
+    npt.assert_array_equal(scans.times, [1, 2, 3])
+    window = (mz[2] >= 20) & (mz[2] <= 60)
+    npt.assert_array_equal(scans[1][1], intensities[2][window])
+
+    # Dense data read as ragged
+    data = read_mzXML(get_mzXML_sample_path())
+    scans = read_mzXML(get_mzXML_sample_path(), ragged=True)
+    npt.assert_array_equal(scans.to_dense(data["mz"]), data["intensities"])
+
+
+def test_read_mzXML_workers(tmp_path):
+    data = read_mzXML(get_mzXML_sample_path(), backend="native")
+    parallel = read_mzXML(get_mzXML_sample_path(), n_workers=2)
+    npt.assert_array_equal(parallel["intensities"], data["intensities"])
+    npt.assert_array_equal(parallel["times"], data["times"])
+
+    mz = np.linspace(10, 20, 31)
+    intensities = np.random.default_rng(0).random((9, 31))
+    filename = str(tmp_path / "run.mzXML")
+    write_mzXML(filename, mz, intensities, np.arange(9.0), 64, "zlib")
+    serial = read_mzXML(filename, rt_range=(2, 7), mz_range=(12, 18))
+    parallel = read_mzXML(filename, rt_range=(2, 7), mz_range=(12, 18), n_workers=3)
+    npt.assert_equal(parallel["intensities"].tobytes(), serial["intensities"].tobytes())
+    npt.assert_equal(os.listdir(tmp_path), ["run.mzXML"])
+
+    # The scans are decoded into shared memory and returned without a copy, the block
+    # is released with the last view of the array
+    dataset = MzXMLDataset(filename)
+    out = dataset.read_scans(np.arange(9), n_workers=2)
+    npt.assert_equal(out.flags.owndata, False)
+    view = out[3:]
+    del out
+    gc.collect()
+    npt.assert_array_equal(view, intensities[3:])
+
+
+def test_read_mzXML_cache(tmp_path):
+    filename = str(tmp_path / "run.mzXML")
+    shutil.copy(get_mzXML_sample_path(), filename)
+    cache_dir = str(tmp_path / "cache")
+    data = read_mzXML(filename)
+
+    cached = read_mzXML(filename, cache_dir=cache_dir)
+    file_cache_dir = get_fingerprint_cache_dir(filename, cache_dir)
+    npt.assert_equal(os.listdir(cache_dir), [os.path.basename(file_cache_dir)])
+    mtime = os.path.getmtime(os.path.join(file_cache_dir, "intensities.npy"))
+    for _ in range(2):
+        npt.assert_equal(isinstance(cached["intensities"], np.memmap), True)
+        for name in ["mz", "intensities", "times"]:
+            npt.assert_array_equal(cached[name], data[name])
+        cached = read_mzXML(filename, cache_dir=cache_dir)
+    npt.assert_equal(
+        os.path.getmtime(os.path.join(file_cache_dir, "intensities.npy")), mtime
+    )
+
+    # Windows are cut out of the cache
+    window = read_mzXML(filename, scans=[1, 3], mz_range=(60, 100))
+    cached = read_mzXML(filename, scans=[1, 3], mz_range=(60, 100), cache_dir=cache_dir)
+    for name in ["mz", "intensities", "times"]:
+        npt.assert_array_equal(cached[name], window[name])
+    rt_range = (data["times"][2], data["times"][5])
+    cached = read_mzXML(filename, rt_range=rt_range, cache_dir=cache_dir)
+    npt.assert_equal(isinstance(cached["intensities"], np.memmap), True)
+    npt.assert_array_equal(cached["intensities"], data["intensities"][2:6])
+
+    # Another type rebuilds the cache, an edited file gets a new one
+    cached = read_mzXML(filename, np.float32, cache_dir=cache_dir)
+    npt.assert_equal(cached["intensities"].dtype, np.float32)
+    with open(filename, "ab") as f:
+        f.write(b"\n")
+    read_mzXML(filename, cache_dir=cache_dir)
+    npt.assert_equal(len(os.listdir(cache_dir)), 2)
+
+    with pytest.raises(ValueError):
+        read_mzXML(filename, ragged=True, cache_dir=cache_dir)
@@ -7,35 +7,523 @@ import os
 import numpy as np
 from pyopenms import MSExperiment, MzXMLFile
 
+from .cache import get_cache_dir, get_cache_path, load_cache, save_cache, clear_cache
+from .cache import is_cache_valid, is_cache_appendable, write_manifest, read_manifest
+from .cache import append_rows, get_fingerprint_cache_dir
+from ._parallel import fill_rows
+from ._ranges import range_slice, select_scans
+from .mzxml import MzXMLDataset, read_mzXML_native
 
-def convert_lines_to_np_array(lines: list, n_scans: int, scan_size: int):
-    intensities = np.zeros((n_scans, scan_size))
-    mz = np.zeros(scan_size)
 
-    li = 1
+# Every scan in the Merlin exports starts with this header line
+_MERLIN_HEADER = b"Masses\tIntensities"
+_CHUNK_SIZE = 64 * 1024**2  # bytes
+# Bump whenever a change to the text parser invalidates existing caches
+_TXT_PARSER_VERSION = 2
+# Bump whenever a change to the mzXML decoding invalidates existing caches
+_MZXML_CACHE_VERSION = 1
+_MZXML_CACHE_NAMES = ["mz", "intensities", "times"]
 
-    # Kept separate for speed to avoid
-    for j in range(scan_size):
-        mz[j] = float(lines[li].rsplit()[0])
-        intensities[0, j] = float(lines[li].rsplit()[1])
-        li += 1
 
-    for i in range(1, n_scans):
-        li += 1
-        for j in range(scan_size):
-            intensities[i, j] = float(lines[li].rsplit()[1])
-            li += 1
+def _index_block(block: bytes, base: int, offsets: list, n_lines: list):
+    # Record the offset of every scan header in block and count the lines of each scan
+    # (including its header). base is the byte offset of block in the file.
+    pos = 0
+    search = 0
+    while True:
+        h = block.find(_MERLIN_HEADER, search)
+        if h < 0:
+            break
+        if n_lines:
+            n_lines[-1] += block.count(b"\n", pos, h)
+        elif block[pos:h].strip():
+            raise ValueError("Found data before the first scan header")
+        offsets.append(base + h)
+        n_lines.append(0)
+        pos, search = h, h + len(_MERLIN_HEADER)
 
-    return mz, intensities
+    if n_lines:
+        n_lines[-1] += block.count(b"\n", pos)
+    elif block[pos:].strip():
+        raise ValueError("Found data before the first scan header")
 
 
-def read_exported_txt(filename: str, pts_per_amu=27, overwrite=False) -> tuple:
+def _line_blocks(f, start: int, stop: int, chunk_size: int):
+    # Yield (byte offset, block) for the bytes of f between start and stop, in blocks of
+    # about chunk_size bytes cut after a newline. The last block is whatever follows
+    # the last newline (possibly nothing).
+    f.seek(start)
+    base = start
+    tail = b""
+    while base + len(tail) < stop:
+        chunk = f.read(min(chunk_size, stop - base - len(tail)))
+        if not chunk:
+            break
+        chunk = tail + chunk
+        cut = chunk.rfind(b"\n") + 1
+        tail = chunk[cut:]
+        yield base, chunk[:cut]
+        base += cut
+    yield base, tail
+
+
+def index_exported_txt(
+    filename: str, chunk_size: int = _CHUNK_SIZE, start: int = 0, stop: int = None
+) -> dict:
+    """Index the scans in a text file exported by the merlin software.
+
+    In a single streaming pass (in chunks of `chunk_size` bytes) this finds the
+    "Masses\tIntensities" header that starts every scan and records the byte offset
+    and the number of points of each scan. The m/z grid is taken from the first scan,
+    so the scan geometry (mass range and points per amu) never has to be known ahead.
+
+    Parameters
+    ----------
+    filename : str
+        The path to the txt datafile.
+    chunk_size : int, optional
+        The number of bytes to read at once, by default 64 MB.
+    start : int, optional
+        Only index the file from this byte offset on, which has to be the start of a
+        scan (or the end of the data), by default 0.
+    stop : int, optional
+        Only index the file up to this byte offset, by default its end.
+
+    Returns
+    -------
+    dict
+        Where index["offsets"] are the byte offsets of the scans followed by `stop` (the
+        size of the file by default) so it has n_scans + 1 entries, index["n_points"] is
+        the number of points in each scan and index["mz"] is the m/z grid of the first
+        scan.
+
+    Raises
+    ------
+    ValueError
+        If the file (or the range) doesn't start with a scan header.
+    """
+    if stop is None:
+        stop = os.path.getsize(filename)
+    offsets = []
+    n_lines = []
+    with open(filename, "rb") as f:
+        for base, block in _line_blocks(f, start, stop, chunk_size):
+            _index_block(block, base, offsets, n_lines)
+        # The last block is what follows the last newline
+        tail = block
+        if tail.strip():  # Last line without a trailing newline
+            n_lines[-1] += 1
+
+        # Headers don't count as points
+        n_points = np.array(n_lines, dtype=np.int64) - 1
+        offsets = np.array(offsets + [base + len(tail)], dtype=np.int64)
+
+        mz = np.empty(n_points[0] if n_points.size > 0 else 0)
+        if mz.size > 0:
+            f.seek(offsets[0])
+            block = f.read(offsets[1] - offsets[0])
+            _parse_block(block, mz, np.empty(mz.size), 0)
+
+    return {"offsets": offsets, "n_points": n_points, "mz": mz}
+
+
+def load_txt_index(
+    filename: str, chunk_size: int = _CHUNK_SIZE, overwrite: bool = False
+) -> dict:
+    """Return the scan index of a text export (see `index_exported_txt`).
+
+    The index is persisted in the cache directory of the file, so it's only built the
+    first time (or after the file changed). Building a new index clears any stale data
+    cached for the file. A cache that's followed live (`read_exported_txt(live=True)`)
+    is never cleared: its index is extended with the scans appended since in memory,
+    so the next live update still only parses the new scans.
+
+    Parameters
+    ----------
+    filename : str
+        The path to the txt datafile.
+    chunk_size : int, optional
+        The number of bytes to read at once, by default 64 MB.
+    overwrite : bool, optional
+        Whether to rebuild the index even if the persisted one is still valid.
+
+    Returns
+    -------
+    dict
+        The index with the keys "offsets", "n_points" and "mz".
+    """
+    cache_dir = get_cache_dir(filename)
+    names = ["offsets", "n_points", "mz"]
+    if not overwrite and is_cache_valid(
+        cache_dir, filename, _TXT_PARSER_VERSION, {}, names
+    ):
+        return load_cache(cache_dir, names, mmap_mode=None)
+    manifest = read_manifest(cache_dir) or {}
+    if (
+        not overwrite
+        and manifest.get("params") == {"live": True}
+        and is_cache_appendable(cache_dir, filename, _TXT_PARSER_VERSION, names)
+    ):
+        # The persisted index is where the next live update starts, leave it as it is.
+        # Like the live updates, skip the scan that's being written.
+        index = load_cache(cache_dir, names, mmap_mode=None)
+        start = int(index["offsets"][-1])
+        stop = max(start, _complete_lines_end(filename, chunk_size))
+        new = index_exported_txt(filename, chunk_size, start, stop)
+        n_new = new["n_points"].size
+        if n_new > 0 and new["n_points"][-1] != index["mz"].size:
+            n_new -= 1
+        index["offsets"] = np.concatenate(
+            (index["offsets"], new["offsets"][1 : n_new + 1])
+        )
+        index["n_points"] = np.concatenate((index["n_points"], new["n_points"][:n_new]))
+        return index
+
+    index = index_exported_txt(filename, chunk_size)
+    clear_cache(cache_dir)
+    save_cache(cache_dir, **index)
+    write_manifest(cache_dir, filename, _TXT_PARSER_VERSION, {})
+    return index
+
+
+def _block_values(block: bytes) -> np.ndarray:
+    # Drop the scan headers and let NumPy parse the remaining whitespace separated
+    # (m/z, intensity) pairs in C
+    block = block.replace(_MERLIN_HEADER, b"")
+    if not block.strip():
+        # NumPy parses a block without any number as [-1.]
+        return np.zeros(0)
+    values = np.fromstring(block, sep=" ")
+    if values.size % 2 != 0:
+        raise ValueError("Malformed (m/z, intensity) pairs found in exported txt file")
+    return values
+
+
+def _parse_block(block: bytes, mz: np.ndarray, flat: np.ndarray, pos: int) -> int:
+    # Parse the pairs of block into flat (and mz until it's full) from pair pos on.
+    # Returns the number of pairs written so far.
+    values = _block_values(block)
+    n_pairs = values.size // 2
+    if pos + n_pairs > flat.size:
+        raise ValueError("Malformed (m/z, intensity) pairs found in exported txt file")
+
+    flat[pos : pos + n_pairs] = values[1::2]
+    if pos < mz.size:
+        n_mz = min(mz.size - pos, n_pairs)
+        mz[pos : pos + n_mz] = values[0 : 2 * n_mz : 2]
+    return pos + n_pairs
+
+
+def _parse_range(
+    filename: str,
+    start: int,
+    stop: int,
+    mz: np.ndarray,
+    out: np.ndarray,
+    chunk_size: int,
+):
+    # Parse the scans between the byte offsets start and stop into out, block by block
+    flat = out.reshape(-1)
+    pos = 0
+    with open(filename, "rb") as f:
+        for _, block in _line_blocks(f, start, stop, chunk_size):
+            pos = _parse_block(block, mz, flat, pos)
+
+    if pos != flat.size:
+        raise ValueError(f"Expected {flat.size} data points in {filename}, found {pos}")
+
+
+def _parse_range_worker(
+    filename: str, start: int, stop: int, chunk_size: int, out: np.ndarray
+) -> np.ndarray:
+    # Runs in a worker process, returns the m/z values of its scans
+    mz = np.empty(out.shape[1])
+    _parse_range(filename, start, stop, mz, out, chunk_size)
+    return mz
+
+
+def parse_exported_txt(
+    filename: str,
+    n_scans: int,
+    scan_size: int,
+    chunk_size: int = _CHUNK_SIZE,
+    offsets: np.ndarray = None,
+    n_workers: int = None,
+    out_filename: str = None,
+    dtype=np.float64,
+) -> tuple:
+    """Parse the text file exported by the merlin software into NumPy arrays.
+
+    The file is read in blocks of `chunk_size` bytes (cut on line boundaries) and each
+    block is parsed in bulk straight into a preallocated intensity matrix, so the peak
+    memory stays close to the size of the output.
+
+    Parameters
+    ----------
+    filename : str
+        The path to the txt datafile.
+    n_scans : int
+        The number of scans in the file.
+    scan_size : int
+        The number of points in each scan.
+    chunk_size : int, optional
+        The number of bytes to read at once, by default 64 MB.
+    offsets : np.ndarray, optional
+        The byte offsets of the scans (see `index_exported_txt`), only needed when
+        `n_workers` is given.
+    n_workers : int, optional
+        If given, the scans are split into contiguous ranges and parsed by a pool of
+        `n_workers` processes that write directly into a shared output matrix (a block
+        of shared memory, or `out_filename`). The output is identical to the serial
+        parser. By default the file is parsed serially.
+    out_filename : str, optional
+        If given, the intensities are written directly into a .npy file at this path
+        and returned memory-mapped in read-only mode instead of being held in memory.
+    dtype : np.dtype, optional
+        The floating point type of the intensities, by default np.float64.
+
+    Returns
+    -------
+    (np.ndarray, np.ndarray)
+        The MZ values and the intensities with shape (n_scans, scan_size).
+        The intensities are a `np.memmap` if `out_filename` is given.
+
+    Raises
+    ------
+    ValueError
+        If the file doesn't contain exactly `n_scans * scan_size` data points.
+    """
+    mz = np.empty(scan_size)
+    shape = (n_scans, scan_size)
+
+    if n_workers is None or n_scans == 0:
+        if out_filename is None:
+            intensities = np.empty(shape, dtype=dtype)
+        else:
+            intensities = np.lib.format.open_memmap(
+                out_filename, mode="w+", dtype=dtype, shape=shape
+            )
+        _parse_range(
+            filename, 0, os.path.getsize(filename), mz, intensities, chunk_size
+        )
+        if out_filename is not None:
+            del intensities
+            intensities = np.load(out_filename, mmap_mode="r")
+        return mz, intensities
+
+    if offsets is None:
+        offsets = index_exported_txt(filename, chunk_size)["offsets"]
+    if offsets.size != n_scans + 1:
+        raise ValueError(
+            f"Expected {n_scans} scans in {filename}, found {offsets.size-1}"
+        )
+
+    intensities, mz = fill_rows(
+        _parse_range_worker,
+        lambda lo, hi: (filename, int(offsets[lo]), int(offsets[hi]), chunk_size),
+        shape,
+        dtype,
+        n_workers,
+        out_filename,
+    )
+    return mz[0], intensities
+
+
+def _check_pts_per_amu(mz: np.ndarray, pts_per_amu: int, filename: str):
+    # The exports use a uniform grid, so the points per amu follow from its ends
+    if pts_per_amu is None or mz.size < 2:
+        return
+    found = (mz.size - 1) / (mz[-1] - mz[0])
+    if round(found) != pts_per_amu:
+        raise ValueError(
+            f"Expected {pts_per_amu} points per amu in {filename}, found {found:.2f}"
+        )
+
+
+def _complete_lines_end(filename: str, chunk_size: int) -> int:
+    # Byte offset just after the last newline of the file, i.e. the end of the lines
+    # that were completely written
+    with open(filename, "rb") as f:
+        end = f.seek(0, os.SEEK_END)
+        while end > 0:
+            f.seek(max(end - chunk_size, 0))
+            block = f.read(end - max(end - chunk_size, 0))
+            newline = block.rfind(b"\n")
+            if newline >= 0:
+                return end - len(block) + newline + 1
+            end -= len(block)
+    return 0
+
+
+class _TxtCacheUpdate:
+    # Indexes and parses the blocks of a text export in the same pass and appends the
+    # scans to the cached intensities as they're completed, i.e. once the header of
+    # the next scan is found
+
+    def __init__(self, filename: str, cache_dir: str, dtype, index: dict):
+        self.filename = filename
+        self.cache_dir = cache_dir
+        self.path = get_cache_path(cache_dir, "intensities")
+        self.dtype = dtype
+        self.scan_size = None if index is None else index["mz"].size
+        self.mz = None if index is None else index["mz"]
+        self.n_rows = 0 if index is None else index["n_points"].size
+        # The scan headers found in this pass and the lines of every scan
+        self.offsets = []
+        self.n_lines = []
+        self.n_done = 0
+        self.values = np.zeros(0)
+
+    def add(self, base: int, block: bytes):
+        """Index and parse the lines of `block`, found at byte `base` of the file."""
+        _index_block(block, base, self.offsets, self.n_lines)
+        self.values = np.concatenate((self.values, _block_values(block)))
+        self._append(max(len(self.offsets) - 1, self.n_done))
+
+    def finish(self, tail: bytes, live: bool):
+        """Append the last scan once `tail`, the text after the last newline, was added.
+        While the run is exported it's skipped unless it's complete.
+        """
+        if tail.strip():  # Last line without a trailing newline
+            self.n_lines[-1] += 1
+        last = len(self.offsets)
+        if live and (
+            self.n_done == last
+            or self.scan_size is None  # A lone first scan can't be checked
+            or self.n_lines[-1] - 1 != self.scan_size
+        ):
+            return
+        self._append(last)
+
+    def scan_ends(self, end: int) -> np.ndarray:
+        """The byte offsets where the appended scans end, `end` is the end of the data."""
+        ends = self.offsets[1 : self.n_done + 1]
+        if len(ends) < self.n_done:
+            ends.append(end)
+        return np.array(ends, dtype=np.int64)
+
+    def _append(self, n: int):
+        # Write the scans n_done to n to the cache
+        n_points = np.array(self.n_lines[self.n_done : n], dtype=np.int64) - 1
+        if n_points.size == 0:
+            return
+        if self.scan_size is None:
+            self.scan_size = int(n_points[0])
+            self.mz = self.values[0 : 2 * self.scan_size : 2].copy()
+            save_cache(
+                self.cache_dir,
+                intensities=np.empty((0, self.scan_size), dtype=self.dtype),
+            )
+        if (n_points != self.scan_size).any():
+            raise AssertionError(
+                f"Incomplete scans were found please check {self.filename}"
+            )
+        size = 2 * n_points.size * self.scan_size
+        if self.values.size < size:
+            raise ValueError(
+                "Malformed (m/z, intensity) pairs found in exported txt file"
+            )
+        rows = self.values[1:size:2].reshape(n_points.size, self.scan_size)
+        append_rows(self.path, rows.astype(self.dtype), self.n_rows)
+        self.values = self.values[size:]
+        self.n_rows += n_points.size
+        self.n_done = n
+
+
+def _update_txt_cache(
+    filename: str, cache_dir: str, chunk_size: int, dtype, live: bool
+) -> tuple:
+    # Index and parse the scans added to filename since the cache was last updated in a
+    # single pass, appending them to the cached intensities. The persisted index only
+    # covers the scans that were parsed, its last offset is where the next update starts.
+    names = ["offsets", "n_points", "mz", "intensities"]
+    if (
+        is_cache_appendable(cache_dir, filename, _TXT_PARSER_VERSION, names)
+        and load_cache(cache_dir, ["intensities"])["intensities"].dtype == dtype
+    ):
+        index = load_cache(cache_dir, names[:3], mmap_mode=None)
+    else:
+        clear_cache(cache_dir)
+        index = None
+
+    start = 0 if index is None else int(index["offsets"][-1])
+    stop = os.path.getsize(filename)
+    if live:
+        # While the run is exported, only complete lines can be trusted
+        stop = max(start, _complete_lines_end(filename, chunk_size))
+    update = _TxtCacheUpdate(filename, cache_dir, dtype, index)
+    with open(filename, "rb") as f:
+        for base, block in _line_blocks(f, start, stop, chunk_size):
+            update.add(base, block)
+    update.finish(block, live)
+
+    if index is None:
+        if update.n_done == 0 and live:
+            return np.zeros(0), np.zeros((0, 0), dtype=dtype)
+        if update.n_done == 0:
+            raise AssertionError(f"Incomplete scans were found please check {filename}")
+        index = {
+            "offsets": np.array(update.offsets[:1], dtype=np.int64),
+            "n_points": np.zeros(0, dtype=np.int64),
+            "mz": update.mz,
+        }
+    ends = update.scan_ends(base + len(block))
+    index["offsets"] = np.concatenate((index["offsets"], ends))
+    index["n_points"] = np.concatenate(
+        (index["n_points"], np.full(ends.size, index["mz"].size, dtype=np.int64))
+    )
+    save_cache(cache_dir, **index)
+    # A cache built while the run is exported may be missing the last scan, so it's
+    # only reused by reads that are live too (or that finish it)
+    params = {"live": True} if live else {}
+    write_manifest(cache_dir, filename, _TXT_PARSER_VERSION, params)
+    return np.array(index["mz"]), np.load(
+        get_cache_path(cache_dir, "intensities"), mmap_mode="r"
+    )
+
+
+def _select_windows(
+    mz: np.ndarray, intensities: np.ndarray, mz_range: tuple, scans
+) -> tuple:
+    # Slice the m/z window and the scans, both are views if scans is a slice
+    columns = range_slice(mz, mz_range)
+    rows = slice(None) if scans is None else scans
+    return mz[columns], intensities[rows, columns]
+
+
+def read_exported_txt(
+    filename: str,
+    pts_per_amu: int = None,
+    overwrite=False,
+    chunk_size: int = _CHUNK_SIZE,
+    n_workers: int = None,
+    dtype=np.float64,
+    live: bool = False,
+    mz_range: tuple = None,
+    scans: slice = None,
+) -> tuple:
     """Reads the large text files exported by the merlin software and returns NumPy objects.
 
     Since the files can be large (> 1GB) and reading text files is slow, a binary version
-    of the data is saved after the text file is parsed. If the function finds a binary
-    file (look for .npz) extension, it will skip parsing the data from the text file and
-    load it directly from the binary. This is typically one to two orders of magnitude faster.
+    of the data is saved while the text file is parsed. If the function finds the binary
+    cache (raw .npy files in a directory next to the text file), it will skip parsing the
+    data from the text file and memory-map it directly from the binary. Opening the cache
+    takes constant time regardless of the size of the data and only the scans/m/z
+    windows that are actually used are read from disk.
+
+    The scan geometry (mass range and points per amu) is detected from the scan headers
+    in the file, so runs with any mass range can be read.
+
+    The cache stores a small manifest with the size, modification time and a fast hash
+    of the text file as well as the parser version. The cache is only rebuilt when one
+    of them changed, e.g. when the run was re-exported.
+
+    Exports that are still being written during a run can be followed with `live=True`.
+    Each call then only parses the scans that were completed since the previous call and
+    appends them to the cache, so refreshing costs time proportional to the new scans.
+    The scan that's being written is ignored until it's complete. Once the run is over a
+    normal call parses whatever is left (including a final scan without a trailing
+    newline) instead of the whole file.
 
 
     Parameters
@@ -43,71 +531,309 @@ def read_exported_txt(filename: str, pts_per_amu=27, overwrite=False) -> tuple:
     filename : str
         The path to the txt datafile. This path is also used when saving
         the data in binary data. E.g. if filename is /path/to/file.txt the
-        data will be saved as /path/to/file.npz for faster loading if the user
+        data will be saved in /path/to/file_cache/ for faster loading if the user
         wants to load it again.
     pts_per_amu: int, optional
-        The number of points per mz unit, by default 27
+        The expected number of points per mz unit. The geometry is always detected from
+        the file, if this is given it's only checked against the detected m/z grid.
     overwrite: bool, optional
-        Whether to overwrite the compressed data (the npz file).
+        Whether to overwrite the binary cache even if it's still valid.
+    chunk_size: int, optional
+        The number of bytes read at once while parsing the text file, by default 64 MB.
+    n_workers: int, optional
+        The number of processes used to parse the text file, by default the file is
+        parsed serially, indexing the scans in the same pass. The workers need the scan
+        index to split the file, so it's read once more to build it (unless it's
+        cached, see `load_txt_index`). The output is the same either way.
+    dtype: np.dtype, optional
+        The floating point type of the intensities, by default np.float64. Using
+        np.float32 halves the memory and disk bandwidth of every later operation. The
+        cache is rebuilt if it holds a different type.
+    live: bool, optional
+        Whether the file is still being exported, see above. The file must only be
+        appended to between calls, `n_workers` is ignored.
+    mz_range: tuple, optional
+        Only return the m/z values with `mz_range[0] <= mz <= mz_range[1]`.
+    scans: slice or np.ndarray, optional
+        Only return these scans (0-based indices in file order, any NumPy index), like
+        `read_mzXML`. The exports don't have timestamps, so there's no `rt_range`. With
+        a slice both windows are views of the memory-mapped cache, so only the selected
+        part of the intensities is ever read from disk. The whole file is still parsed
+        once to build the cache.
 
     Returns
     -------
-    (np.ndarray, np.ndarray)
+    (np.ndarray, np.memmap)
         A tuple where the first element is an array of the MZ values and
         the second are the intensities. The shape of intensities is
-        (n_scans, scan_size).
+        (n_scans, scan_size), or the size of the windows, and they are memory-mapped
+        (read-only) from the cache.
 
     Raises
     ------
     AssertionError
-        Raises assertion error if any incomplete scans are found.
+        Raises assertion error if any incomplete scans are found (other than the last one
+        when `live` is True).
+    ValueError
+        If the detected points per amu don't match `pts_per_amu`.
 
     Examples
     --------
     >>> from msanalysis.data_extraction import read_exported_txt
     >>> from msanalysis.sample_data import get_txt_sample_path
     >>> mz, ints  = read_exported_txt(get_txt_sample_path())
-    Time to read data from npz file 0.0083160400390625
-    >>> mz, ints  = read_exported_txt(get_txt_sample_path())
-    Time to read file: 0.008026361465454102
-    Time to convert lines to np.array 0.032723188400268555
-    Saving compressed binary version of data at /home/james/Insync/jasm3285@colorado.edu/Google Drive/research/projects/msanalysis/msanalysis/sample_data/TiCl4_SnF4.npz
+    Time to read file: 0.0019936561584472656
+    Saving binary version of data at /home/james/msanalysis/msanalysis/sample_data/TiCl4_SnF4_cache
+    Time to convert lines to np.array 0.020917892456054688
     >>> _  = read_exported_txt(get_txt_sample_path())
-    Time to read data from npz file 0.002399921417236328
+    Time to open cached data 0.00043010711669921875
 
     """
 
-    npy_filename = filename[:-4] + ".npz"
+    cache_dir = get_cache_dir(filename)
+    cache_names = ["mz", "intensities"]
 
-    if os.path.exists(npy_filename) and overwrite == False:
+    if live:
+        if overwrite:
+            clear_cache(cache_dir)
         t0 = time.time()
-        npzfile = np.load(npy_filename)
-        mz, intensities = (npzfile["mz"], npzfile["intensities"])
-        print(f"Time to read data from npz file {time.time()-t0}")
-        return mz, intensities
-    else:
+        mz, intensities = _update_txt_cache(
+            filename, cache_dir, chunk_size, dtype, True
+        )
+        print(f"Time to parse new scans {time.time()-t0}")
+        _check_pts_per_amu(mz, pts_per_amu, filename)
+        return _select_windows(mz, intensities, mz_range, scans)
 
+    manifest = read_manifest(cache_dir) or {}
+    if (
+        overwrite == False
+        and is_cache_valid(cache_dir, filename, _TXT_PARSER_VERSION, {}, cache_names)
+        and load_cache(cache_dir, ["intensities"])["intensities"].dtype == dtype
+    ):
+        t0 = time.time()
+        cache = load_cache(cache_dir, cache_names)
+        mz, intensities = (np.array(cache["mz"]), cache["intensities"])
+        print(f"Time to open cached data {time.time()-t0}")
+        _check_pts_per_amu(mz, pts_per_amu, filename)
+        return _select_windows(mz, intensities, mz_range, scans)
+    elif overwrite == False and manifest.get("params") == {"live": True}:
+        # The run was followed live, only the scans added since have to be parsed
         t0 = time.time()
-        with open(filename, "r") as f:
-            lines = f.readlines()
-        t1 = time.time()
-        print(f"Time to read file: {t1-t0}")
-
-        scan_range = 1000 - 2
-        scan_size = scan_range * pts_per_amu + 1
-        n_scans = int(len(lines) / (scan_size + 1))
-        if len(lines) % (scan_size + 1) != 0:
+        mz, intensities = _update_txt_cache(
+            filename, cache_dir, chunk_size, dtype, False
+        )
+        print(f"Time to parse new scans {time.time()-t0}")
+        _check_pts_per_amu(mz, pts_per_amu, filename)
+        return _select_windows(mz, intensities, mz_range, scans)
+    elif n_workers is None:
+        # Index and parse the file in a single pass, straight into the cache so the
+        # intensities never have to fit in memory
+        print(f"Saving binary version of data at {cache_dir}")
+        t0 = time.time()
+        clear_cache(cache_dir)
+        mz, intensities = _update_txt_cache(
+            filename, cache_dir, chunk_size, dtype, False
+        )
+        print(f"Time to convert lines to np.array {time.time()-t0}")
+        _check_pts_per_amu(mz, pts_per_amu, filename)
+        return _select_windows(mz, intensities, mz_range, scans)
+    else:
+        # The workers need the offsets of the scans to split the file, so it's indexed
+        # first (unless the index is cached)
+        t0 = time.time()
+        index = load_txt_index(filename, chunk_size, overwrite)
+        print(f"Time to read file: {time.time()-t0}")
+
+        n_points = index["n_points"]
+        if n_points.size == 0 or (n_points != n_points[0]).any():
             raise AssertionError(f"Incomplete scans were found please check {filename}")
+        n_scans, scan_size = (n_points.size, int(n_points[0]))
+        _check_pts_per_amu(index["mz"], pts_per_amu, filename)
 
+        # Parse straight into the cache so the intensities never have to fit in memory.
+        # The file only gets its final name once it's complete.
+        print(f"Saving binary version of data at {cache_dir}")
+        intensities_path = get_cache_path(cache_dir, "intensities")
+        partial_path = get_cache_path(cache_dir, "intensities.partial")
         t0 = time.time()
-        mz, intensities = convert_lines_to_np_array(lines, n_scans, scan_size)
+        try:
+            mz, intensities = parse_exported_txt(
+                filename,
+                n_scans,
+                scan_size,
+                chunk_size,
+                index["offsets"],
+                n_workers,
+                partial_path,
+                dtype,
+            )
+            del intensities
+            os.replace(partial_path, intensities_path)
+        except BaseException:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+            raise
         print(f"Time to convert lines to np.array {time.time()-t0}")
-        print(f"Saving compressed binary version of data at {npy_filename}")
-        np.savez(npy_filename, mz=mz, intensities=intensities)
-        return mz, intensities
+        intensities = np.load(intensities_path, mmap_mode="r")
+        return _select_windows(mz, intensities, mz_range, scans)
+
+
+def is_mzXML_cached(filename: str, dtype, cache_dir: str) -> bool:
+    """Check whether `read_mzXML` has a valid cache of the mzXML file `filename` with
+    intensities of type `dtype` in `cache_dir` (see `get_fingerprint_cache_dir`).
+    """
+    return is_cache_valid(
+        get_fingerprint_cache_dir(filename, cache_dir),
+        filename,
+        _MZXML_CACHE_VERSION,
+        {"dtype": np.dtype(dtype).str},
+        _MZXML_CACHE_NAMES,
+    )
+
+
+def _read_mzXML_cached(
+    filename: str,
+    dtype,
+    backend: str,
+    scans,
+    rt_range: tuple,
+    mz_range: tuple,
+    n_workers: int,
+    cache_dir: str,
+) -> dict:
+    # Open the decoded arrays of filename from its cache in cache_dir, decoding the
+    # whole file into the cache first if it's missing or stale
+    file_cache_dir = get_fingerprint_cache_dir(filename, cache_dir)
+    if not is_mzXML_cached(filename, dtype, cache_dir):
+        if n_workers is None:
+            data = read_mzXML(filename, dtype, backend)
+        else:
+            data = read_mzXML(filename, dtype, scans=slice(None), n_workers=n_workers)
+        print(f"Saving binary version of data at {file_cache_dir}")
+        clear_cache(file_cache_dir)
+        save_cache(file_cache_dir, **data)
+        params = {"dtype": np.dtype(dtype).str}
+        write_manifest(file_cache_dir, filename, _MZXML_CACHE_VERSION, params)
+
+    t0 = time.time()
+    cache = load_cache(file_cache_dir, _MZXML_CACHE_NAMES)
+    mz, times = (np.array(cache["mz"]), np.array(cache["times"]))
+    # Plain slices keep the intensities memory-mapped
+    if scans is None:
+        rows = range_slice(times, rt_range)
+    elif isinstance(scans, slice) and rt_range is None:
+        rows = scans
+    else:
+        rows = select_scans(times, scans, rt_range)
+    columns = range_slice(mz, mz_range)
+    data = {
+        "mz": mz[columns],
+        "intensities": cache["intensities"][rows, columns],
+        "times": times[rows],
+    }
+    print(f"Time to open cached data {time.time()-t0}")
+    return data
 
 
-def read_mzXML(filename: str) -> dict:
+def read_mzXML(
+    filename: str,
+    dtype=np.float64,
+    backend: str = "pyopenms",
+    scans=None,
+    rt_range: tuple = None,
+    mz_range: tuple = None,
+    ragged: bool = False,
+    n_workers: int = None,
+    cache_dir: str = None,
+) -> dict:
+    """Read all the scans in an mzXML file.
+
+    Parameters
+    ----------
+    filename : str
+        The path to the mzXML file.
+    dtype : np.dtype, optional
+        The floating point type of the intensities, by default np.float64. Using
+        np.float32 halves the memory of the intensities.
+    backend : str, optional
+        Either "pyopenms" (the default), which loads the whole experiment with pyopenms
+        and copies the spectra out of it, or "native", which decodes the scans with
+        incremental XML parsing straight into the output (see `read_mzXML_native`).
+        The native backend needs a fraction of the memory on large files.
+    scans : slice or np.ndarray, optional
+        Only read these scans (0-based indices in file order, any NumPy index).
+    rt_range : tuple, optional
+        Only read the scans with `rt_range[0] <= times <= rt_range[1]` (in seconds).
+        With `scans` or `rt_range` the scan offsets are taken from the `<index>` of the
+        file and only the selected scans are decoded (see `MzXMLDataset`), so the time
+        depends on the number of scans read rather than the size of the file.
+    mz_range : tuple, optional
+        Only keep the m/z values with `mz_range[0] <= mz <= mz_range[1]`. The window is
+        cut out of every scan as it's decoded, so the full scans are never held in
+        memory. Like `scans` and `rt_range`, this uses `MzXMLDataset`.
+    ragged : bool, optional
+        Whether to keep the m/z values of every scan, for centroided or zero-suppressed
+        data where the scans don't share the m/z of the first one. The scans are then
+        returned as `RaggedScans` (concatenated points plus per-scan offsets) instead of
+        a dict, empty scans are allowed and the memory scales with the number of points.
+    n_workers : int, optional
+        The number of processes decoding the scans, by default they're decoded serially.
+        The output is the same either way. This uses `MzXMLDataset` too.
+    cache_dir : str, optional
+        A directory to cache the decoded arrays in, by default nothing is cached. The
+        first read decodes the whole file (with `backend` or `n_workers`) and saves mz,
+        intensities and times as raw .npy files in cache_dir/<file name>_<fingerprint>/,
+        where the fingerprint is a hash of the size and both ends of the file. Later
+        reads of the unchanged file (even if it was moved) memory-map the intensities
+        instead of parsing the XML, and `scans`, `rt_range` and `mz_range` are cut out of
+        the cache. Caches of earlier versions of a file aren't removed.
+
+    Returns
+    -------
+    dict
+        Where data["mz"] is the m/z array of the first scan, data["intensities"] the
+        (n_scans, scan_size) intensities and data["times"] the scan times in seconds.
+        With `ragged` the scans are returned as `RaggedScans` instead. With `cache_dir`
+        the intensities are memory-mapped (read-only) from the cache, unless `scans` is
+        an array or a slice combined with `rt_range`.
+
+    Raises
+    ------
+    ValueError
+        If any of the scans is empty (unless `ragged`), the backend is unknown or
+        `ragged` is used with `cache_dir`.
+    """
+    if ragged and cache_dir is not None:
+        raise ValueError("Ragged scans can't be cached, use ragged without cache_dir")
+    if cache_dir is not None:
+        return _read_mzXML_cached(
+            filename, dtype, backend, scans, rt_range, mz_range, n_workers, cache_dir
+        )
+    if ragged:
+        t0 = time.time()
+        dataset = MzXMLDataset(filename, dtype)
+        scans = dataset.read_ragged(dataset.select(scans, rt_range), mz_range)
+        print(f"Time to load mzXML scans {time.time()-t0}")
+        return scans
+    if any(arg is not None for arg in (scans, rt_range, mz_range, n_workers)):
+        t0 = time.time()
+        dataset = MzXMLDataset(filename, dtype)
+        selected = dataset.select(scans, rt_range)
+        columns = dataset.columns(mz_range)
+        data = {
+            "mz": dataset.mz[columns],
+            "intensities": dataset.read_scans(selected, columns, n_workers),
+            "times": dataset.times[selected],
+        }
+        print(f"Time to load mzXML scans {time.time()-t0}")
+        return data
+    elif backend == "native":
+        t0 = time.time()
+        data = read_mzXML_native(filename, dtype)
+        print(f"Time to load mzXML file {time.time()-t0}")
+        return data
+    elif backend != "pyopenms":
+        raise ValueError(f"Unknown backend {backend}, use 'pyopenms' or 'native'")
 
     exp = MSExperiment()
     t0 = time.time()
@@ -119,7 +845,7 @@ def read_mzXML(filename: str) -> dict:
     n = len(exp.getSpectra())
     mz = exp.getSpectra()[0].get_peaks()[0]
     n_pt_per_scan = mz.size
-    intensities = np.zeros((n, n_pt_per_scan))
+    intensities = np.zeros((n, n_pt_per_scan), dtype=dtype)
     times = np.array([spec.getRT() for spec in exp.getSpectra()])  # Now in seconds
     for i, s in enumerate(exp.getSpectra()):
         peaks = s.get_peaks()[1]
@@ -5,38 +5,68 @@ from .peak_detection import find_ms_peaks
 from .peak_detection import deconvolute_spectrum
 from .peak_detection import embed_spectrum
 from .smoothing import moving_average
+from .smoothing import write_moving_average
+from .binning import bin_by_temperature
+from .chromatograms import extract_ion_chromatograms
+from ._windows import Windows
 
 
 def get_relative_abundance(
-    mz: np.ndarray, intensities: np.ndarray, species_mz: list, bin_width: float = 0.45
+    mz: np.ndarray,
+    intensities: np.ndarray,
+    species_mz: list,
+    bin_width: float = 0.45,
+    summed_area=None,
 ) -> np.ndarray:
     """Return `np.ndarray` of abundances of the MZs specified
-    
+
+    All the windows are turned into ranges of m/z indices at once with `np.searchsorted`.
+    Their edges split the m/z axis into segments that are summed with `np.add.reduceat`
+    and every window is then a difference of the cumulative sums of the segments (like
+    `extract_ion_chromatograms`), so the intensities are read once without copies
+    whatever the number of species (overlapping windows included).
+
     Parameters
     ----------
     mz : np.ndarray
-        1D `np.ndarray` holding the mz values for the experiment.
+        1D `np.ndarray` holding the (sorted) mz values for the experiment.
     intensities: np.ndarray
         2D `np.ndarray` where the first axis is the scan number and the second one is
-        the m/z axis.
+        the m/z axis. Memory-mapped arrays (e.g. from `read_exported_txt`) are read a
+        block of scans at a time and only in the m/z range of the species.
     species_mz : list
         List of MZs of interest.
     bin_width : float, optional
         How far around the species_mz to collect intensities, by default 0.45
-    
+    summed_area : SummedAreaTable, optional
+        The summed-area table of the intensities (see
+        `msanalysis.data_extraction.get_summed_area`). The abundances are then looked
+        up in the table in constant time per scan and species, without reading the
+        intensities.
+
     Returns
     -------
     np.ndarray
-        2D array (nspecies, nspectra). Abundances of species for all spectra given.
+        2D array (nspecies, nspectra). Abundances of species for all spectra given, with
+        the same floating point type as `intensities`.
     """
 
-    abundances = np.zeros((len(species_mz), intensities.shape[0]))
+    dtype = np.result_type(intensities.dtype, np.float32)
+    species_mz = np.asarray(species_mz, dtype=np.float64).reshape(-1)
+    abundances = np.zeros((species_mz.size, intensities.shape[0]), dtype=dtype)
 
-    # For each species_mz of interest, bin and add the intensities
-    for i, species_mz_i in enumerate(species_mz):
-        ub = species_mz_i + bin_width
-        lb = species_mz_i - bin_width
-        indices = np.where((mz > lb) & (mz < ub))
-        abundances[i] = np.sum(intensities[:, indices[0]], axis=1)
+    # The window of each species is lb < mz < ub, i.e. the indices [lo, hi)
+    lo = np.searchsorted(mz, species_mz - bin_width, side="right")
+    hi = np.searchsorted(mz, species_mz + bin_width, side="left")
+    if summed_area is not None:
+        if summed_area.shape != intensities.shape:
+            raise ValueError("The summed-area table doesn't match the intensities")
+        abundances[:] = summed_area.scan_sums(lo, hi)
+        return abundances
+    windows = Windows(lo, hi)
+    block_size = windows.block_size(intensities.dtype.itemsize)
+    for start in range(0, intensities.shape[0], block_size):
+        block = intensities[start : start + block_size]
+        abundances[:, start : start + block.shape[0]] = windows.sums(block)
 
     return abundances
@@ -0,0 +1,78 @@
+"""
+Sums and maxima of many m/z windows over blocks of scans, shared by
+`extract_ion_chromatograms` and `get_relative_abundance`.
+"""
+import numpy as np
+
+# Bytes of intensities reduced at a time, the m/z values between windows that are
+# further apart than _MIN_GAP aren't read
+_BLOCK_BYTES = 64 * 1024**2
+_MIN_GAP = 256
+
+
+class Windows:
+    # The windows [lo, hi) of m/z indices, reduced over blocks of scans. The edges of
+    # all the windows split the m/z axis into segments that are reduced with one
+    # reduceat per run of consecutive segments, then every window combines its
+    # segments, so the cost doesn't depend on the number of windows.
+
+    def __init__(self, lo: np.ndarray, hi: np.ndarray):
+        self.n_windows = lo.size
+        self.edges = np.unique(np.concatenate((lo, hi)))
+        # Segment k holds the indices [edges[k], edges[k + 1]), window i the segments
+        # [lo[i], hi[i])
+        self.lo = np.searchsorted(self.edges, lo)
+        self.hi = np.searchsorted(self.edges, hi)
+        self.n_segments = max(self.edges.size - 1, 0)
+        n_windows = np.cumsum(
+            np.bincount(self.lo, minlength=self.edges.size)
+            - np.bincount(self.hi, minlength=self.edges.size)
+        )[:-1]
+        # Wide segments outside all the windows aren't read
+        read = (n_windows > 0) | (np.diff(self.edges) < _MIN_GAP)
+        changes = np.flatnonzero(np.diff(read.astype(np.int8), prepend=0, append=0))
+        self.runs = list(zip(changes[::2], changes[1::2]))
+
+    def block_size(self, itemsize: int) -> int:
+        """The number of scans per block."""
+        width = self.edges[-1] - self.edges[0] if self.edges.size else 0
+        return max(_BLOCK_BYTES // max(width * itemsize, 1), 1)
+
+    def _segments(self, block: np.ndarray, ufunc, weights=None, out=None) -> np.ndarray:
+        # The segments that aren't read keep the initial value of `out`
+        segments = out
+        if segments is None:
+            fill = 0.0 if ufunc is np.add else -np.inf
+            segments = np.full((block.shape[0], self.n_segments), fill)
+        for k0, k1 in self.runs:
+            e = self.edges
+            run = block[:, e[k0] : e[k1]]
+            if weights is not None:
+                run = run * weights[e[k0] : e[k1]]
+            segments[:, k0:k1] = ufunc.reduceat(run, e[k0:k1] - e[k0], axis=1)
+        return segments
+
+    def sums(self, block: np.ndarray, weights: np.ndarray = None) -> np.ndarray:
+        """The (n_windows, n_scans) sums of the windows over the block of scans, of
+        `block * weights` if the m/z `weights` are given.
+        """
+        # Prepend a column of zeros so window i is sums[:, hi[i]] - sums[:, lo[i]]
+        sums = np.zeros((block.shape[0], self.n_segments + 1))
+        self._segments(block, np.add, weights, out=sums[:, 1:])
+        np.cumsum(sums, axis=1, out=sums)
+        return (sums[:, self.hi] - sums[:, self.lo]).T
+
+    def maxima(self, block: np.ndarray) -> np.ndarray:
+        """The (n_windows, n_scans) maxima of the windows over the block of scans, 0 for
+        empty windows.
+        """
+        segments = self._segments(block, np.maximum)
+        maxima = np.full((self.n_windows, block.shape[0]), -np.inf)
+        n = self.hi - self.lo
+        # Windows only span a few segments (the edges of the windows they overlap), so
+        # loop over the segments of all the windows at once
+        for j in range(n.max(initial=0)):
+            has = n > j
+            maxima[has] = np.maximum(maxima[has], segments[:, self.lo[has] + j].T)
+        maxima[n == 0] = 0
+        return maxima
@@ -0,0 +1,137 @@
+"""
+Aggregating the scans of a run into temperature bins, e.g. the average spectrum for
+every 2 °C of a TPD ramp.
+"""
+import numpy as np
+
+_STATISTICS = ("sum", "mean", "max")
+_BLOCK_BYTES = 64 * 1024**2  # bytes of intensities aggregated at a time
+
+
+class TemperatureBins:
+    """Accumulates blocks of scans into temperature bins, for `bin_by_temperature` and
+    its streaming version. Every block is sorted by bin once, so each bin is a
+    contiguous run of rows that is reduced in one call.
+
+    Parameters
+    ----------
+    edges : np.ndarray
+        The increasing edges of the temperature bins.
+    statistic : str
+        Either "sum", "mean" or "max".
+    """
+
+    def __init__(self, edges: np.ndarray, statistic: str):
+        if statistic not in _STATISTICS:
+            raise ValueError(f"Unknown statistic {statistic}, use one of {_STATISTICS}")
+        self.edges = np.asarray(edges, dtype=np.float64)
+        if self.edges.ndim != 1 or self.edges.size < 2:
+            raise ValueError("edges must be a 1D array with at least 2 values")
+        if np.any(np.diff(self.edges) <= 0):
+            raise ValueError("edges must be strictly increasing")
+        self.statistic = statistic
+        self.n_bins = self.edges.size - 1
+        self.counts = np.zeros(self.n_bins, dtype=np.int64)
+        self.totals = None
+        self.dtype = None
+
+    def add(self, intensities: np.ndarray, temps: np.ndarray):
+        temps = np.asarray(temps, dtype=np.float64)
+        if temps.shape != (intensities.shape[0],):
+            raise ValueError("There must be one temperature per scan")
+        if self.totals is None:
+            self.dtype = np.result_type(intensities.dtype, np.float32)
+            fill = -np.inf if self.statistic == "max" else 0.0
+            self.totals = np.full((self.n_bins, intensities.shape[1]), fill)
+
+        # Bin i holds edges[i] <= temp < edges[i + 1], the last bin includes its right
+        # edge like np.histogram. Scans outside the edges (or NaN) are dropped.
+        bins = np.searchsorted(self.edges, temps, side="right") - 1
+        bins[temps == self.edges[-1]] = self.n_bins - 1
+        keep = np.flatnonzero((bins >= 0) & (bins < self.n_bins))
+        if keep.size == 0:
+            return
+        order = keep[np.argsort(bins[keep], kind="stable")]
+        sorted_bins = bins[order]
+        bounds = np.flatnonzero(np.diff(sorted_bins, prepend=-1, append=self.n_bins))
+
+        # During a ramp the scans are usually in bin order already, then a slice avoids
+        # copying the block
+        if np.all(np.diff(order) == 1):
+            block = np.asarray(intensities[order[0] : order[-1] + 1])
+        else:
+            block = np.asarray(intensities[order])
+        # Every bin is a contiguous run of rows of the sorted block
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            totals = self.totals[sorted_bins[start]]
+            if self.statistic == "max":
+                np.maximum(totals, block[start:stop].max(axis=0), out=totals)
+            else:
+                totals += block[start:stop].sum(axis=0, dtype=np.float64)
+        self.counts += np.bincount(sorted_bins, minlength=self.n_bins)
+
+    def result(self, scan_size: int = 0) -> tuple:
+        if self.totals is None:
+            self.totals = np.zeros((self.n_bins, scan_size))
+            self.dtype = np.float64
+        binned = self.totals.copy()
+        if self.statistic == "mean":
+            binned /= np.maximum(self.counts, 1)[:, np.newaxis]
+        if self.statistic != "sum":
+            binned[self.counts == 0] = np.nan
+        return binned.astype(self.dtype, copy=False), self.counts
+
+
+def bin_by_temperature(
+    intensities: np.ndarray,
+    temp_interp: np.ndarray,
+    edges: np.ndarray,
+    statistic: str = "mean",
+) -> tuple:
+    """Aggregate the scans into temperature bins.
+
+    The scans are sorted by bin once, so every bin is a contiguous run of rows that is
+    reduced with a single call, instead of a boolean mask over all the scans per bin.
+    This is done for blocks of about 64 MiB of scans at a time, so memory-mapped
+    intensities (e.g. from `read_exported_txt` or the `read_mzXML` cache) are only read
+    once and never fully loaded. See `stream_bin_by_temperature` for scan batches.
+
+    Parameters
+    ----------
+    intensities : np.ndarray
+        2D (n_scans, scan_size) array, which can be memory-mapped.
+    temp_interp : np.ndarray
+        The temperature of every scan, e.g. from `align_run`.
+    edges : np.ndarray
+        The increasing edges of the bins. Bin i holds the scans with
+        `edges[i] <= temp < edges[i + 1]` and the last bin includes its right edge (like
+        `np.histogram`). Scans outside the edges are ignored.
+    statistic : str, optional
+        How to aggregate the scans of every bin, either "sum", "mean" (the default) or
+        "max". The sums are accumulated in float64.
+
+    Returns
+    -------
+    (np.ndarray, np.ndarray)
+        The (n_bins, scan_size) aggregated spectra, with the same floating point type as
+        `intensities`, and the number of scans in every bin. Empty bins are 0 for "sum"
+        and NaN otherwise.
+
+    Examples
+    --------
+    >>> data = align_run("run.mzXML", "run.csv")
+    >>> temp_interp = data["labview"]["temp"].to_numpy()
+    >>> edges = np.arange(temp_interp.min(), temp_interp.max() + 2, 2)  # every 2 °C
+    >>> spectra, counts = bin_by_temperature(data["intensities"], temp_interp, edges)
+    """
+    temp_interp = np.asarray(temp_interp)
+    if temp_interp.shape != (intensities.shape[0],):
+        raise ValueError("There must be one temperature per scan")
+
+    bins = TemperatureBins(edges, statistic)
+    row_bytes = max(intensities.shape[1] * intensities.dtype.itemsize, 1)
+    block_size = max(_BLOCK_BYTES // row_bytes, 1)
+    for start in range(0, intensities.shape[0], block_size):
+        stop = start + block_size
+        bins.add(intensities[start:stop], temp_interp[start:stop])
+    return bins.result(intensities.shape[1])
@@ -0,0 +1,141 @@
+"""
+Extracted-ion chromatograms (XICs): the signal in an m/z window around every target,
+scan by scan, for large target lists.
+"""
+import numpy as np
+
+from ._windows import Windows
+
+_MODES = ("sum", "max", "centroid")
+
+
+def _half_widths(targets: np.ndarray, tolerance, ppm) -> np.ndarray:
+    if tolerance is None and ppm is None:
+        raise ValueError("Give the tolerance in m/z units or in ppm (or both)")
+    half_widths = np.zeros(targets.size)
+    if tolerance is not None:
+        half_widths = np.maximum(half_widths, np.broadcast_to(tolerance, targets.shape))
+    if ppm is not None:
+        ppm_widths = targets * np.broadcast_to(ppm, targets.shape) * 1e-6
+        half_widths = np.maximum(half_widths, ppm_widths)
+    return half_widths
+
+
+class _Chromatograms:
+    # Accumulates the XICs of blocks of scans, recomputing the windows if the m/z
+    # values change between batches
+
+    def __init__(self, targets, tolerance, ppm, mode: str):
+        if mode not in _MODES:
+            raise ValueError(f"Unknown mode {mode}, use one of {_MODES}")
+        self.targets = np.asarray(targets, dtype=np.float64).reshape(-1)
+        self.half_widths = _half_widths(self.targets, tolerance, ppm)
+        self.mode = mode
+        self.mz = None
+        self.windows = None
+        self.dtype = np.float64
+        self.blocks = []
+
+    def set_mz(self, mz: np.ndarray):
+        if self.mz is not None and (mz is self.mz or np.array_equal(mz, self.mz)):
+            return
+        self.mz = mz
+        # The windows of all the targets from one sweep of the sorted m/z axis
+        lo = np.searchsorted(mz, self.targets - self.half_widths, side="left")
+        hi = np.searchsorted(mz, self.targets + self.half_widths, side="right")
+        self.windows = Windows(lo, hi)
+
+    def add(self, mz: np.ndarray, block: np.ndarray):
+        self.set_mz(mz)
+        self.dtype = np.result_type(block.dtype, np.float32)
+        if self.windows.n_windows == 0:
+            self.blocks.append(np.zeros((0, block.shape[0])))
+        elif self.mode == "sum":
+            self.blocks.append(self.windows.sums(block))
+        elif self.mode == "max":
+            self.blocks.append(self.windows.maxima(block))
+        else:
+            totals = self.windows.sums(block)
+            weighted = self.windows.sums(block, mz.astype(block.dtype))
+            with np.errstate(invalid="ignore", divide="ignore"):
+                centroids = weighted / totals
+            centroids[totals <= 0] = np.nan
+            self.blocks.append(centroids)
+
+    def result(self) -> np.ndarray:
+        if not self.blocks:
+            return np.zeros((self.targets.size, 0), dtype=self.dtype)
+        return np.concatenate(self.blocks, axis=1).astype(self.dtype, copy=False)
+
+
+def extract_ion_chromatograms(
+    dataset, targets, tolerance=None, ppm=None, mode: str = "sum"
+) -> tuple:
+    """Extract the ion chromatogram of every target m/z in one pass over the scans.
+
+    The window of every target is found with `np.searchsorted` on the sorted m/z axis
+    and all the windows are reduced together (see `get_relative_abundance`), a block of
+    scans at a time, so the cost barely grows with the number of targets and
+    memory-mapped or streamed runs are only read once.
+
+    Parameters
+    ----------
+    dataset : dict or iterable
+        Either a run as returned by `read_mzXML` or `align_run`, i.e. a dict with the
+        sorted "mz" values, the (n_scans, scan_size) "intensities" (which can be
+        memory-mapped) and optionally the scan "times", or batches of
+        (times, mz, intensities), e.g. from `iter_scans`.
+    targets : array_like
+        The m/z of the targets.
+    tolerance : float or array_like, optional
+        The half-width of the window of every target in m/z units, a scalar or one
+        value per target.
+    ppm : float or array_like, optional
+        The half-width of the window of every target in ppm of its m/z, a scalar or one
+        value per target. With both `tolerance` and `ppm` the wider window is used, so
+        e.g. `tolerance=[0.5, 0]` and `ppm=[0, 20]` mixes both kinds of tolerances.
+    mode : str, optional
+        How the intensities in each window are reduced: "sum" (the default), "max" or
+        "centroid", the intensity-weighted mean m/z (NaN if there's no signal).
+
+    Returns
+    -------
+    (np.ndarray, np.ndarray)
+        The times of the scans (the scan numbers if the dataset has none) and the
+        (n_targets, n_scans) chromatograms in the order of `targets`, with the same
+        floating point type as the intensities. A target's window holds the m/z values
+        with `target - half-width <= mz <= target + half-width`.
+
+    Raises
+    ------
+    ValueError
+        If the mode is unknown or neither `tolerance` nor `ppm` is given.
+
+    Examples
+    --------
+    >>> data = read_mzXML("run.mzXML")
+    >>> times, xics = extract_ion_chromatograms(data, [137.0, 157.1], ppm=50)
+    >>> times, xics = extract_ion_chromatograms(
+    ...     iter_scans("run.txt"), targets, tolerance=0.45, mode="max"
+    ... )
+    """
+    chromatograms = _Chromatograms(targets, tolerance, ppm, mode)
+    if isinstance(dataset, dict):
+        mz, intensities = (np.asarray(dataset["mz"]), dataset["intensities"])
+        times = dataset.get("times")
+        if times is None:
+            times = np.arange(intensities.shape[0], dtype=np.float64)
+        chromatograms.set_mz(mz)
+        block_size = chromatograms.windows.block_size(intensities.dtype.itemsize)
+        for start in range(0, intensities.shape[0], block_size):
+            chromatograms.add(mz, intensities[start : start + block_size])
+        if intensities.shape[0] == 0:
+            chromatograms.dtype = np.result_type(intensities.dtype, np.float32)
+        return np.asarray(times), chromatograms.result()
+
+    times = []
+    for t, mz, intensities in dataset:
+        times.append(t)
+        chromatograms.add(mz, intensities)
+    times = np.concatenate(times) if times else np.zeros(0)
+    return times, chromatograms.result()
@@ -1,32 +1,306 @@
+import os
+
 import numpy as np
+from numpy.lib.format import open_memmap
+
+_MODES = ("valid", "same")
+_BLOCK_BYTES = 64 * 1024**2  # bytes of float64 running sums per block of scans
+_STRIP_SIZE = 2048  # m/z columns summed at a time within a block
+
+
+class MovingAverage:
+    """Moving averages along the scans of blocks of scans, for `moving_average` and its
+    streaming version. The running sums C[j] of the first j scans are accumulated in
+    float64 in scan order, so the result doesn't depend on how the scans are split into
+    blocks, and the sum of the window of scans [j - n, j) is C[j] - C[j - n].
+
+    Parameters
+    ----------
+    n : int
+        Width of the moving average.
+    scan_size : int
+        The number of m/z values of the scans.
+    mode : str, optional
+        Either "valid" (the default) or "same", see `moving_average`.
+    center : bool, optional
+        Whether the windows are centered on the scans in "same" mode, by default True.
+    """
+
+    def __init__(self, n: int, scan_size: int, mode: str = "valid", center=True):
+        _check_options(n, mode)
+        self.n = n
+        self.mode = mode
+        # In "same" mode, row i averages the scans [i - left, i + right]
+        self.right = (n - 1) // 2 if center else 0
+        self.left = n - 1 - self.right
+        # The running sums C[j - n + 1], ..., C[j] after the first j scans, C[j] = 0
+        # for j <= 0
+        self.sums = np.zeros((n, scan_size))
+        self.seen = 0
+        self.buffer = None
+        self.averages = None
+
+    def first_row(self) -> int:
+        """The row of the next average, i.e. of the window ending at the next scan."""
+        if self.mode == "valid":
+            return self.seen - self.n + 1
+        return self.seen - self.right
 
+    def add(self, block: np.ndarray, out: np.ndarray = None) -> tuple:
+        """Return (first row, averages) of the windows ending at the scans of the
+        block, without the rows before the first full window in "valid" mode.
 
-def moving_average(intensities: np.ndarray, n=50) -> np.ndarray:
+        The averages are written to their rows of `out` if it's given, otherwise they're
+        returned in a buffer that is reused by the next call.
+        """
+        n, b = (self.n, block.shape[0])
+        width = min(_STRIP_SIZE, self.sums.shape[1])
+        if self.buffer is None or self.buffer.shape[0] != n + b:
+            self.buffer = np.empty((n + b, width))
+            self.differences = np.empty((b, width))
+
+        # The windows end at the scans seen + k, i.e. at C[j] with j = seen + 1 + k
+        first = self.first_row()
+        skip = min(max(-first, 0), b)
+        if self.mode == "same":
+            counts = np.arange(self.seen + 1 + skip, self.seen + 1 + b)
+            counts = np.minimum(counts, n).astype(np.float64)[:, np.newaxis]
+        else:
+            counts = n
+        rows = self._rows(first + skip, b - skip, out)
+
+        # A strip of columns at a time, so the running sums stay in the CPU cache
+        for start in range(0, self.sums.shape[1], width):
+            columns = slice(start, start + width)
+            sums = self.buffer[:, : self.sums[0, columns].size]
+            sums[:n] = self.sums[:, columns]
+            sums[n:] = block[:, columns]
+            # Row by row, numpy's cumsum along the first axis is several times slower
+            for k in range(n, n + b):
+                np.add(sums[k - 1], sums[k], out=sums[k])
+            self.sums[:, columns] = sums[b:]
+            differences = self.differences[: b - skip, : sums.shape[1]]
+            np.subtract(sums[n + skip :], sums[skip:b], out=differences)
+            np.divide(differences, counts, out=rows[:, columns], casting="unsafe")
+        self.seen += b
+        return first + skip, rows
+
+    def finish(self, out: np.ndarray = None) -> tuple:
+        """Return (first row, averages) of the last rows in "same" mode, whose windows
+        are cut short by the end of the scans.
+        """
+        if self.mode == "valid":
+            return self.first_row(), self._rows(self.first_row(), 0, out)
+        first = max(self.seen - self.right, 0)
+        rows = self._rows(first, self.seen - first, out)
+        # The window of row i is [max(i - left, 0), seen), C[seen] is the last sum
+        starts = np.maximum(np.arange(first, self.seen) - self.left, 0)
+        lower = self.sums[starts - self.seen + self.n - 1]
+        counts = (self.seen - starts).astype(np.float64)[:, np.newaxis]
+        np.divide(self.sums[-1] - lower, counts, out=rows, casting="unsafe")
+        return first, rows
+
+    def _rows(self, first: int, k: int, out: np.ndarray) -> np.ndarray:
+        # Where the k averages from row `first` on go
+        if out is not None:
+            return out[first : first + k]
+        if self.averages is None or self.averages.shape[0] < k:
+            self.averages = np.empty((k, self.sums.shape[1]))
+        return self.averages[:k]
+
+
+def moving_average(
+    intensities: np.ndarray,
+    n=50,
+    mode: str = "valid",
+    center: bool = True,
+    out: np.ndarray = None,
+    dtype=None,
+) -> np.ndarray:
     """Calculates the moving average along the n_scans axis of the intensities array.
-    
-    Adapted from https://stackoverflow.com/questions/14313510/how-to-calculate-moving-average-using-numpy
 
+    The running sums of all the m/z columns are accumulated at once along the scan
+    axis, a block of about 64 MiB of scans at a time, so memory-mapped intensities are
+    only read once and never fully loaded. See `write_moving_average` to write the
+    result of runs larger than memory to disk.
 
     Parameters
     ----------
     intensities : np.ndarray
-        (n_scans, scan_size) 2D numpy array.
+        (n_scans, scan_size) 2D numpy array, which can be memory-mapped.
     n : int, optional
         Width of the moving average, by default 50.
-    
+    mode : str, optional
+        "valid" (the default) only keeps the full windows, so row i is the average of
+        scans i to i + n - 1. "same" keeps one row per scan, where the windows at the
+        start and end are cut short by the scans and average fewer scans.
+    center : bool, optional
+        In "same" mode, whether the window of scan i is centered on it, i.e. scans
+        i - n // 2 to i + (n - 1) // 2 (the default), or trails it, i.e. scans
+        i - n + 1 to i.
+    out : np.ndarray, optional
+        Write the result to this array (e.g. a memory-mapped one) and return it.
+    dtype : np.dtype, optional
+        The floating point type of the result if `out` isn't given, by default that of
+        `intensities` (float64 for integer intensities).
+
     Returns
     -------
     np.ndarray
-        New intensities with shape (n_scans - n + 1, scan_size)
+        New intensities with shape (n_scans - n + 1, scan_size) in "valid" mode and
+        (n_scans, scan_size) in "same" mode (the sums are always accumulated in
+        float64).
+
+    Raises
+    ------
+    ValueError
+        If the mode or `n` is invalid or `out` has the wrong shape.
     """
+    shape = _result_shape(intensities.shape, n, mode)
+    if out is None:
+        if dtype is None:
+            dtype = np.result_type(intensities.dtype, np.float32)
+        out = np.empty(shape, dtype=dtype)
+    elif out.shape != shape:
+        raise ValueError(f"out has shape {out.shape}, the result has shape {shape}")
+
+    block_size = max(_BLOCK_BYTES // max(shape[1] * 8, 1) - n, 1)
+    _smooth_tiles(intensities, out, n, mode, center, block_size, max(shape[1], 1))
+    return out
+
 
-    new_intensities = np.zeros((intensities.shape[0] - n + 1, intensities.shape[1]))
+def _check_options(n: int, mode: str):
+    if mode not in _MODES:
+        raise ValueError(f"Unknown mode {mode}, use one of {_MODES}")
+    if n < 1:
+        raise ValueError("The width of the moving average must be at least 1")
 
-    # Iterate over each mz value
-    for i in range(intensities.shape[1]):
-        a = intensities[:, i]
-        ret = np.cumsum(a, dtype=float)
-        ret[n:] = ret[n:] - ret[:-n]
-        new_intensities[:, i] = ret[n - 1 :] / n
 
-    return new_intensities
+def _result_shape(shape: tuple, n: int, mode: str) -> tuple:
+    _check_options(n, mode)
+    n_scans, scan_size = shape
+    return (max(n_scans - n + 1, 0) if mode == "valid" else n_scans, scan_size)
+
+
+def _smooth_tiles(
+    intensities, out, n: int, mode: str, center: bool, rows: int, columns: int
+):
+    # Smooth tiles of rows x columns, strip by strip of columns from the first scan to
+    # the last, carrying the running sums of the strip from tile to tile
+    n_scans, scan_size = intensities.shape
+    for c0 in range(0, scan_size, columns):
+        c1 = min(c0 + columns, scan_size)
+        average = MovingAverage(n, c1 - c0, mode, center)
+        strip = out[:, c0:c1]
+        for r0 in range(0, n_scans, rows):
+            average.add(np.asarray(intensities[r0 : r0 + rows, c0:c1]), strip)
+        average.finish(strip)
+        # Free the buffers of the strip before the next one allocates its own
+        del average
+
+
+def _tile_size(shape: tuple, n: int, itemsize: int, max_memory: int, chunks) -> tuple:
+    # The largest (rows, columns) tiles whose buffers fit in max_memory: the running
+    # sums of the last n scans of the columns (and as much for the last rows in "same"
+    # mode), the tile read from the intensities and the float64 buffers of the strips
+    # of MovingAverage.add, plus numpy's buffers for casting the averages to the
+    # result type. Reading from a chunked store also holds whole tiles, compressed and
+    # decompressed.
+    scan_size = max(shape[1], 1)
+    available = max_memory - 3 * 8 * np.getbufsize()
+    if chunks is not None:
+        available -= 3 * chunks[0] * chunks[1] * itemsize
+    # The running sums take at most three quarters of the rest
+    columns = min(scan_size, available // (4 * 8 * n))
+    if chunks is not None and chunks[1] < columns < scan_size:
+        columns -= columns % chunks[1]
+    strip = min(columns, _STRIP_SIZE)
+    available -= 8 * (2 * n * columns + n * strip)
+    rows = available // max(columns * itemsize + 2 * 8 * strip, 1)
+    if columns < 1 or rows < 1:
+        raise ValueError(
+            f"max_memory={max_memory} is too small for a moving average of {n} scans"
+        )
+    # Larger tiles than those of moving_average don't speed it up
+    rows = min(rows, max(_BLOCK_BYTES // (columns * 8) - n, 1))
+    if chunks is not None and rows > chunks[0]:
+        rows -= rows % chunks[0]
+    return int(rows), int(columns)
+
+
+def write_moving_average(
+    filename: str,
+    intensities,
+    n: int = 50,
+    mode: str = "valid",
+    center: bool = True,
+    dtype=None,
+    max_memory: int = 1024**3,
+) -> np.ndarray:
+    """Write the moving average along the scans to a .npy file, out of core.
+
+    The intensities are read in tiles of scans and m/z columns and every tile is
+    smoothed and written to the memory-mapped result before the next one is read. The
+    tiles of an m/z strip are read from the first scan to the last, carrying the
+    running sums of the last n scans from tile to tile, so the result is exactly that of
+    `moving_average`. The size of the tiles is chosen so the arrays allocated for the
+    computation stay below `max_memory` (the pages of memory-mapped files are cached by
+    the OS and not counted), e.g. to smooth 50 GB runs on a workstation.
+
+    Parameters
+    ----------
+    filename : str
+        The .npy file of the result. It's written next to it first and only renamed
+        once complete, so an interrupted run never leaves a partial result.
+    intensities : np.ndarray or ExperimentStore
+        2D (n_scans, scan_size) intensities supporting `intensities[scans, columns]`
+        with slices, e.g. memory-mapped from a cache or a chunked store from
+        `read_store` (the tiles are then aligned to the tiles of the store).
+    n : int, optional
+        Width of the moving average, by default 50.
+    mode : str, optional
+        Either "valid" (the default) or "same", see `moving_average`.
+    center : bool, optional
+        Whether the windows are centered on the scans in "same" mode, by default True.
+    dtype : np.dtype, optional
+        The floating point type of the result, by default that of `intensities`
+        (float64 for integer intensities).
+    max_memory : int, optional
+        The bound in bytes on the memory used for the computation, by default 1 GiB.
+
+    Returns
+    -------
+    np.memmap
+        The result memory-mapped read-only from `filename`.
+
+    Raises
+    ------
+    ValueError
+        If the mode or `n` is invalid or `max_memory` is too small to keep the running
+        sums of a single column.
+
+    Examples
+    --------
+    >>> mz, intensities = read_exported_txt("run.txt")
+    >>> smoothed = write_moving_average("run_smoothed.npy", intensities, n=50)
+    >>> store = read_store("run_store")
+    >>> smoothed = write_moving_average("run_smoothed.npy", store, mode="same")
+    """
+    shape = _result_shape(intensities.shape, n, mode)
+    if dtype is None:
+        dtype = np.result_type(intensities.dtype, np.float32)
+    rows, columns = _tile_size(
+        intensities.shape,
+        n,
+        intensities.dtype.itemsize,
+        max_memory,
+        getattr(intensities, "chunks", None),
+    )
+
+    partial = filename + ".partial"
+    out = open_memmap(partial, mode="w+", dtype=dtype, shape=shape)
+    _smooth_tiles(intensities, out, n, mode, center, rows, columns)
+    out.flush()
+    del out
+    os.replace(partial, filename)
+    return np.load(filename, mmap_mode="r")
@@ -0,0 +1,150 @@
+"""
+Versions of the analysis functions that consume the scan batches from
+`msanalysis.data_extraction.iter_scans`, so runs larger than memory can be analysed.
+Each gives the same results as the in-memory function on the full intensities.
+"""
+import numpy as np
+
+from msanalysis.data_processing import get_relative_abundance
+from msanalysis.data_processing.peak_detection import find_ms_peaks
+from msanalysis.data_processing.binning import TemperatureBins
+from msanalysis.data_processing.smoothing import MovingAverage
+
+
+def stream_relative_abundance(
+    batches, species_mz: list, bin_width: float = 0.45
+) -> tuple:
+    """Streaming version of `get_relative_abundance`.
+
+    Parameters
+    ----------
+    batches : iterable
+        Batches of (times, mz, intensities), e.g. from `iter_scans`.
+    species_mz : list
+        List of MZs of interest.
+    bin_width : float, optional
+        How far around the species_mz to collect intensities, by default 0.45
+
+    Returns
+    -------
+    (np.ndarray, np.ndarray)
+        The times of all scans and the 2D array (nspecies, nspectra) of abundances.
+    """
+    times, abundances = ([], [])
+    for t, mz, intensities in batches:
+        times.append(t)
+        abundances.append(
+            get_relative_abundance(mz, intensities, species_mz, bin_width)
+        )
+
+    if not times:
+        return np.zeros(0), np.zeros((len(species_mz), 0))
+    return np.concatenate(times), np.concatenate(abundances, axis=1)
+
+
+def _take_times(times: np.ndarray, label: int, first: int, rows: np.ndarray) -> tuple:
+    # Split the times of the rows off the pending times, which start at scan `label`
+    stop = first + rows.shape[0] - label
+    return times[stop:], label + stop, times[first - label : stop]
+
+
+def stream_moving_average(
+    batches, n: int = 50, mode: str = "valid", center: bool = True
+):
+    """Streaming version of `moving_average` along the scan axis.
+
+    The running sums are carried from batch to batch, so concatenating the yielded
+    blocks gives exactly the same result as `moving_average` on all the scans.
+
+    Parameters
+    ----------
+    batches : iterable
+        Batches of (times, mz, intensities), e.g. from `iter_scans`.
+    n : int, optional
+        Width of the moving average, by default 50.
+    mode : str, optional
+        Either "valid" (the default) or "same", see `moving_average`.
+    center : bool, optional
+        Whether the windows are centered on the scans in "same" mode, by default True.
+
+    Yields
+    ------
+    (np.ndarray, np.ndarray, np.ndarray)
+        Batches of (times, mz, smoothed intensities). In "valid" mode the times are
+        those of the last scan in each window and the first n - 1 scans don't have a
+        full window and are skipped, like in `moving_average`. In "same" mode they're
+        the times of the scans, and centered windows are yielded once the scans after
+        them have been read.
+    """
+    average = None
+    # The times of the scans from `label` on that haven't been yielded yet
+    times, label = (np.zeros(0), 0)
+    # In "valid" mode row i is labelled with the time of scan i + n - 1
+    offset = n - 1 if mode == "valid" else 0
+    for t, mz, intensities in batches:
+        if average is None:
+            average = MovingAverage(n, intensities.shape[1], mode, center)
+            dtype = np.result_type(intensities.dtype, np.float32)
+        times = np.concatenate((times, t))
+        row, new_intensities = average.add(intensities)
+        if new_intensities.shape[0] > 0:
+            times, label, t = _take_times(times, label, row + offset, new_intensities)
+            yield t, mz, new_intensities.astype(dtype)
+
+    if average is not None:
+        row, new_intensities = average.finish()
+        if new_intensities.shape[0] > 0:
+            times, label, t = _take_times(times, label, row + offset, new_intensities)
+            yield t, mz, new_intensities.astype(dtype)
+
+
+def stream_bin_by_temperature(
+    batches, temp_interp: np.ndarray, edges: np.ndarray, statistic: str = "mean"
+) -> tuple:
+    """Streaming version of `bin_by_temperature`.
+
+    Parameters
+    ----------
+    batches : iterable
+        Batches of (times, mz, intensities), e.g. from `iter_scans`.
+    temp_interp : np.ndarray
+        The temperature of every scan in the batches, in order.
+    edges : np.ndarray
+        The increasing edges of the temperature bins.
+    statistic : str, optional
+        Either "sum", "mean" (the default) or "max".
+
+    Returns
+    -------
+    (np.ndarray, np.ndarray)
+        The (n_bins, scan_size) aggregated spectra and the number of scans in every bin.
+    """
+    temp_interp = np.asarray(temp_interp)
+    bins = TemperatureBins(edges, statistic)
+    seen = 0
+    for t, mz, intensities in batches:
+        bins.add(intensities, temp_interp[seen : seen + intensities.shape[0]])
+        seen += intensities.shape[0]
+    if seen != temp_interp.size:
+        raise ValueError("There must be one temperature per scan")
+    return bins.result()
+
+
+def stream_find_ms_peaks(batches, **kwargs):
+    """Streaming version of `find_ms_peaks` that finds the peaks of every scan.
+
+    Parameters
+    ----------
+    batches : iterable
+        Batches of (times, mz, intensities), e.g. from `iter_scans`.
+    **kwargs
+        Passed on to `find_ms_peaks` (and the SciPy `find_peaks` function).
+
+    Yields
+    ------
+    (float, dict)
+        The time of each scan and its stick spectrum (see `find_ms_peaks`).
+    """
+    for t, mz, intensities in batches:
+        for t_i, intensity in zip(t, intensities):
+            yield t_i, find_ms_peaks({"mz": mz, "intensity": intensity}, **kwargs)
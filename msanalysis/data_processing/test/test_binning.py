@@ -0,0 +1,74 @@
+import pytest
+import numpy as np
+
+from msanalysis.data_processing import bin_by_temperature
+from msanalysis.data_processing import binning
+
+npt = np.testing
+
+
+@pytest.fixture
+def ramp():
+    rng = np.random.default_rng(0)
+    intensities = rng.random((200, 30)) * 100
+    # A noisy ramp, so the scans of a bin aren't all contiguous
+    temps = np.linspace(25, 125, 200) + rng.normal(0, 3, 200)
+    return intensities, temps
+
+
+def binned_with_masks(intensities, temps, edges, reduce):
+    out = np.full((edges.size - 1, intensities.shape[1]), np.nan)
+    for i in range(edges.size - 1):
+        upper = temps <= edges[i + 1] if i == edges.size - 2 else temps < edges[i + 1]
+        mask = (temps >= edges[i]) & upper
+        if mask.any():
+            out[i] = reduce(intensities[mask], axis=0)
+    return out
+
+
+@pytest.mark.parametrize("statistic", ["sum", "mean", "max"])
+def test_bin_by_temperature(ramp, statistic):
+    intensities, temps = ramp
+    edges = np.arange(30, 122, 2.0)
+    binned, counts = bin_by_temperature(intensities, temps, edges, statistic)
+
+    expected = binned_with_masks(intensities, temps, edges, getattr(np, statistic))
+    npt.assert_allclose(binned, expected)
+    npt.assert_array_equal(counts, np.histogram(temps, edges)[0])
+
+
+def test_bin_by_temperature_blocks(ramp, tmp_path, monkeypatch):
+    intensities, temps = ramp
+    edges = np.array([0, 10, 50, 80, 200.0])
+    expected, counts = bin_by_temperature(intensities, temps, edges, "max")
+
+    # Memory-mapped float32 intensities read a few scans at a time
+    filename = tmp_path / "intensities.npy"
+    np.save(filename, intensities.astype(np.float32))
+    monkeypatch.setattr(binning, "_BLOCK_BYTES", 7 * intensities.shape[1] * 4)
+    for statistic in ["sum", "mean", "max"]:
+        binned, block_counts = bin_by_temperature(
+            np.load(filename, mmap_mode="r"), temps, edges, statistic
+        )
+        npt.assert_equal(binned.dtype, np.float32)
+        npt.assert_array_equal(block_counts, counts)
+        npt.assert_allclose(
+            binned,
+            bin_by_temperature(intensities, temps, edges, statistic)[0],
+            rtol=1e-6,
+            equal_nan=True,
+        )
+
+    # The first bin is empty
+    npt.assert_equal(counts[0], 0)
+    npt.assert_equal(np.isnan(expected[0]).all(), True)
+
+
+def test_bin_by_temperature_errors(ramp):
+    intensities, temps = ramp
+    with pytest.raises(ValueError):
+        bin_by_temperature(intensities, temps, [0, 10], "median")
+    with pytest.raises(ValueError):
+        bin_by_temperature(intensities, temps, [10, 0])
+    with pytest.raises(ValueError):
+        bin_by_temperature(intensities, temps[1:], [0, 10])
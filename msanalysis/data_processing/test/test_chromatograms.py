@@ -0,0 +1,78 @@
+import pytest
+import numpy as np
+
+from msanalysis.data_processing import extract_ion_chromatograms
+from msanalysis.data_processing import _windows
+
+npt = np.testing
+
+
+@pytest.fixture
+def run():
+    rng = np.random.default_rng(3)
+    mz = np.linspace(50, 350, 3000)
+    intensities = (rng.random((45, mz.size)) * 100).astype(np.float32)
+    return {"mz": mz, "intensities": intensities, "times": np.arange(45) * 0.5}
+
+
+def xics_with_masks(mz, intensities, targets, half_widths, reduce):
+    xics = []
+    for target, half_width in zip(targets, half_widths):
+        window = (mz >= target - half_width) & (mz <= target + half_width)
+        xics.append(reduce(intensities[:, window], mz[window]))
+    return np.array(xics)
+
+
+REDUCE = {
+    "sum": lambda i, mz: i.sum(axis=1, dtype=np.float64),
+    "max": lambda i, mz: i.max(axis=1, initial=0),
+    "centroid": lambda i, mz: (i * mz).sum(axis=1) / i.sum(axis=1),
+}
+
+
+@pytest.mark.parametrize("mode", ["sum", "max", "centroid"])
+def test_extract_ion_chromatograms(run, mode):
+    # Unsorted and overlapping targets, mixed tolerances and a target off the m/z axis
+    targets = np.array([200.0, 57.0, 57.2, 300.0, 120.0, 400.0])
+    tolerance = np.array([0.5, 0.3, 0, 0, 2.0, 0.5])
+    ppm = np.array([0, 0, 2000, 1000, 0, 0])
+    half_widths = np.maximum(tolerance, targets * ppm * 1e-6)
+
+    times, xics = extract_ion_chromatograms(run, targets, tolerance, ppm, mode)
+    npt.assert_array_equal(times, run["times"])
+    npt.assert_equal(xics.dtype, np.float32)
+    with np.errstate(invalid="ignore"):
+        expected = xics_with_masks(
+            run["mz"], run["intensities"], targets, half_widths, REDUCE[mode]
+        )
+    npt.assert_allclose(xics, expected, rtol=1e-5)
+
+
+@pytest.mark.parametrize("mode", ["sum", "max", "centroid"])
+def test_extract_ion_chromatograms_batches(run, mode, monkeypatch):
+    targets = np.arange(55, 345, 0.7)
+    _, expected = extract_ion_chromatograms(run, targets, ppm=3000, mode=mode)
+
+    # Streamed batches and dense blocks of a few scans give the same chromatograms
+    batches = (
+        (run["times"][i : i + 10], run["mz"], run["intensities"][i : i + 10])
+        for i in range(0, 45, 10)
+    )
+    times, xics = extract_ion_chromatograms(batches, targets, ppm=3000, mode=mode)
+    npt.assert_array_equal(times, run["times"])
+    npt.assert_allclose(xics, expected, rtol=1e-6)
+
+    monkeypatch.setattr(_windows, "_BLOCK_BYTES", 4 * 3000 * 4)
+    data = {"mz": run["mz"], "intensities": run["intensities"]}
+    times, xics = extract_ion_chromatograms(data, targets, ppm=3000, mode=mode)
+    npt.assert_array_equal(times, np.arange(45))
+    npt.assert_allclose(xics, expected, rtol=1e-6)
+
+
+def test_extract_ion_chromatograms_errors(run):
+    with pytest.raises(ValueError):
+        extract_ion_chromatograms(run, [100.0])
+    with pytest.raises(ValueError):
+        extract_ion_chromatograms(run, [100.0], 0.5, mode="mean")
+    times, xics = extract_ion_chromatograms(iter([]), [100.0, 200.0], 0.5)
+    npt.assert_equal((times.size, xics.shape), (0, (2, 0)))
@@ -1,7 +1,7 @@
 import pytest
 import numpy as np
 
-from msanalysis.data_extraction import read_mzXML
+from msanalysis.data_extraction import read_mzXML, get_summed_area
 from msanalysis.sample_data import get_mzXML_sample_path
 from msanalysis.data_processing import get_relative_abundance
 
@@ -17,3 +17,46 @@ def test_rel_abundance(mzs):
     abun = get_relative_abundance(mz, intensities, mzs)
     npt.assert_equal(abun.shape[0], len(mzs))
     npt.assert_equal(abun.shape[1], intensities.shape[0])
+
+
+@pytest.mark.parametrize("dtype", [np.float64, np.float32])
+def test_rel_abundance_windows(dtype, monkeypatch):
+    from msanalysis.data_processing import _windows
+
+    data = read_mzXML(get_mzXML_sample_path(), dtype)
+    mz, intensities = data["mz"], data["intensities"]
+    # Overlapping windows, windows past the ends of the m/z axis and between two points
+    mzs = [57, 57.3, 71, 30, 1, 1000, mz[-1], (mz[100] + mz[101]) / 2]
+    bin_width = 0.45
+    expected = np.array(
+        [
+            intensities[:, (mz > m - bin_width) & (mz < m + bin_width)].sum(
+                axis=1, dtype=np.float64
+            )
+            for m in mzs
+        ]
+    )
+    # A few scans at a time
+    monkeypatch.setattr(_windows, "_BLOCK_BYTES", 3 * 8 * mz.size)
+    abun = get_relative_abundance(mz, intensities, mzs, bin_width)
+    npt.assert_equal(abun.dtype, dtype)
+    npt.assert_allclose(abun, expected, rtol=1e-6)
+    npt.assert_array_equal(abun[4:6], 0)
+
+    # Nothing between two m/z values
+    abun = get_relative_abundance(mz, intensities, mzs[-1:], 1e-6)
+    npt.assert_array_equal(abun, 0)
+    npt.assert_array_equal(get_relative_abundance(mz, intensities, []).shape, (0, 20))
+
+
+def test_rel_abundance_summed_area():
+    data = read_mzXML(get_mzXML_sample_path(), np.float32)
+    mz, intensities = data["mz"], data["intensities"]
+    table = get_summed_area(intensities)
+    mzs = [57, 57.3, 71, 1, 1000]
+    abun = get_relative_abundance(mz, intensities, mzs, summed_area=table)
+    npt.assert_equal(abun.dtype, np.float32)
+    npt.assert_allclose(abun, get_relative_abundance(mz, intensities, mzs), rtol=1e-5)
+
+    with pytest.raises(ValueError):
+        get_relative_abundance(mz[:10], intensities[:, :10], mzs, summed_area=table)
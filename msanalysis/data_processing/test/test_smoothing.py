@@ -1,6 +1,12 @@
+import os
+import tracemalloc
+
+import pytest
 import numpy as np
 
-from msanalysis.data_processing.smoothing import moving_average
+from msanalysis.data_extraction import write_store, read_store
+from msanalysis.data_processing import smoothing
+from msanalysis.data_processing.smoothing import moving_average, write_moving_average
 
 npt = np.testing
 
@@ -14,3 +20,104 @@ def test_moving_average():
 
     new_intensities = moving_average(intensities, 3)
     npt.assert_array_equal(new_intensities, intensities[1:-1, :])
+
+
+def test_moving_average_dtype():
+    intensities = np.random.rand(20, 7).astype(np.float32)
+    new_intensities = moving_average(intensities, 4)
+    npt.assert_equal(new_intensities.dtype, np.float32)
+    npt.assert_allclose(
+        new_intensities, moving_average(intensities.astype(np.float64), 4), rtol=1e-6
+    )
+
+
+def naive_moving_average(intensities, n, mode, center):
+    # The average of the scans in the (cut short) window of every row
+    n_scans = intensities.shape[0]
+    if mode == "valid":
+        windows = [(i, i + n) for i in range(n_scans - n + 1)]
+    else:
+        right = (n - 1) // 2 if center else 0
+        windows = [
+            (max(i - (n - 1 - right), 0), min(i + right + 1, n_scans))
+            for i in range(n_scans)
+        ]
+    return np.array([intensities[a:b].mean(axis=0) for a, b in windows])
+
+
+@pytest.mark.parametrize(
+    "mode, center", [("valid", True), ("same", True), ("same", False)]
+)
+@pytest.mark.parametrize("n", [1, 4, 5, 30])
+@pytest.mark.parametrize("block_bytes", [1, 200, 64 * 1024**2])
+def test_moving_average_modes(monkeypatch, mode, center, n, block_bytes):
+    monkeypatch.setattr(smoothing, "_BLOCK_BYTES", block_bytes)
+    monkeypatch.setattr(smoothing, "_STRIP_SIZE", 4)
+    intensities = np.random.default_rng(0).random((23, 6)) * 100
+    new_intensities = moving_average(intensities, n, mode=mode, center=center)
+    npt.assert_allclose(
+        new_intensities,
+        naive_moving_average(intensities, n, mode, center).reshape(-1, 6),
+    )
+
+
+def test_moving_average_out():
+    intensities = np.random.default_rng(1).random((40, 8)).astype(np.float32)
+    out = np.zeros((40, 8), dtype=np.float64)
+    res = moving_average(intensities, 5, mode="same", out=out)
+    npt.assert_(res is out)
+    npt.assert_allclose(
+        out, naive_moving_average(intensities, 5, "same", True), rtol=1e-6
+    )
+
+    npt.assert_equal(moving_average(intensities, 5, dtype=np.float64).dtype, np.float64)
+    with pytest.raises(ValueError):
+        moving_average(intensities, 5, out=out)
+    with pytest.raises(ValueError):
+        moving_average(intensities, 5, mode="full")
+    with pytest.raises(ValueError):
+        moving_average(intensities, 0)
+
+
+@pytest.fixture
+def sources(tmp_path):
+    intensities = np.random.default_rng(2).random((300, 900)).astype(np.float32)
+    np.save(tmp_path / "intensities.npy", intensities)
+    write_store(
+        str(tmp_path / "store"),
+        np.arange(900.0),
+        intensities,
+        chunks=(32, 128),
+        compression="zlib",
+    )
+    return intensities, {
+        "memmap": np.load(tmp_path / "intensities.npy", mmap_mode="r"),
+        "store": read_store(str(tmp_path / "store")),
+    }
+
+
+@pytest.mark.parametrize("source", ["memmap", "store"])
+@pytest.mark.parametrize("mode", ["valid", "same"])
+@pytest.mark.parametrize("max_memory", [300_000, 2_000_000])
+def test_write_moving_average(tmp_path, sources, source, mode, max_memory):
+    intensities, sources = sources
+    filename = str(tmp_path / "smoothed.npy")
+    tracemalloc.start()
+    smoothed = write_moving_average(
+        filename, sources[source], 12, mode=mode, max_memory=max_memory
+    )
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    npt.assert_(peak <= max_memory)
+    npt.assert_array_equal(smoothed, moving_average(intensities, 12, mode=mode))
+    npt.assert_equal(smoothed.dtype, np.float32)
+    npt.assert_(not os.path.exists(filename + ".partial"))
+
+
+def test_write_moving_average_errors(tmp_path, sources):
+    intensities, sources = sources
+    with pytest.raises(ValueError):
+        write_moving_average(str(tmp_path / "a.npy"), intensities, 12, max_memory=1000)
+    with pytest.raises(ValueError):
+        write_moving_average(str(tmp_path / "a.npy"), intensities, 12, mode="full")
+    npt.assert_(not os.path.exists(tmp_path / "a.npy"))
@@ -0,0 +1,99 @@
+import pytest
+import numpy as np
+
+from msanalysis.data_processing import get_relative_abundance, bin_by_temperature
+from msanalysis.data_processing.smoothing import moving_average
+from msanalysis.data_processing.peak_detection import find_ms_peaks
+from msanalysis.data_processing.streaming import (
+    stream_bin_by_temperature,
+    stream_find_ms_peaks,
+    stream_moving_average,
+    stream_relative_abundance,
+)
+
+npt = np.testing
+
+
+def batches(times, mz, intensities, batch_size):
+    for i in range(0, times.size, batch_size):
+        yield times[i : i + batch_size], mz, intensities[i : i + batch_size]
+
+
+@pytest.fixture
+def run():
+    rng = np.random.default_rng(42)
+    mz = np.linspace(50, 80, 300)
+    intensities = rng.random((57, mz.size)) * 100
+    return np.arange(57) * 0.5, mz, intensities
+
+
+@pytest.mark.parametrize("batch_size", [1, 4, 10, 100])
+def test_stream_relative_abundance(run, batch_size):
+    times, mz, intensities = run
+    t, abun = stream_relative_abundance(
+        batches(times, mz, intensities, batch_size), [57, 71]
+    )
+    npt.assert_array_equal(t, times)
+    npt.assert_array_equal(abun, get_relative_abundance(mz, intensities, [57, 71]))
+
+
+@pytest.mark.parametrize("batch_size, n", [(1, 5), (4, 5), (10, 3), (100, 10)])
+def test_stream_moving_average(run, batch_size, n):
+    times, mz, intensities = run
+    out = list(stream_moving_average(batches(times, mz, intensities, batch_size), n))
+    npt.assert_array_equal(np.concatenate([o[0] for o in out]), times[n - 1 :])
+    npt.assert_array_equal(
+        np.concatenate([o[2] for o in out]), moving_average(intensities, n)
+    )
+
+
+@pytest.mark.parametrize("batch_size, n", [(1, 5), (4, 6), (10, 3), (100, 10)])
+@pytest.mark.parametrize("center", [True, False])
+def test_stream_moving_average_same(run, batch_size, n, center):
+    times, mz, intensities = run
+    out = list(
+        stream_moving_average(
+            batches(times, mz, intensities, batch_size), n, mode="same", center=center
+        )
+    )
+    npt.assert_array_equal(np.concatenate([o[0] for o in out]), times)
+    npt.assert_array_equal(
+        np.concatenate([o[2] for o in out]),
+        moving_average(intensities, n, mode="same", center=center),
+    )
+
+
+def test_stream_find_ms_peaks(run):
+    times, mz, intensities = run
+    peaks = list(stream_find_ms_peaks(batches(times, mz, intensities, 7), height=90))
+    npt.assert_equal(len(peaks), times.size)
+    ref = find_ms_peaks({"mz": mz, "intensity": intensities[11]}, height=90)
+    npt.assert_equal(peaks[11][0], times[11])
+    npt.assert_array_equal(peaks[11][1]["mz"], ref["mz"])
+
+
+def test_stream_float32(run):
+    times, mz, intensities = run
+    intensities = intensities.astype(np.float32)
+    out = list(stream_moving_average(batches(times, mz, intensities, 10), 5))
+    smoothed = np.concatenate([o[2] for o in out])
+    npt.assert_equal(smoothed.dtype, np.float32)
+    npt.assert_array_equal(smoothed, moving_average(intensities, 5))
+
+    _, abun = stream_relative_abundance(batches(times, mz, intensities, 10), [57])
+    npt.assert_equal(abun.dtype, np.float32)
+    npt.assert_array_equal(abun, get_relative_abundance(mz, intensities, [57]))
+
+
+@pytest.mark.parametrize("batch_size", [1, 4, 10, 100])
+@pytest.mark.parametrize("statistic", ["sum", "mean", "max"])
+def test_stream_bin_by_temperature(run, batch_size, statistic):
+    times, mz, intensities = run
+    temps = 20 + 3 * times
+    edges = np.arange(20, 110, 5.0)
+    binned, counts = stream_bin_by_temperature(
+        batches(times, mz, intensities, batch_size), temps, edges, statistic
+    )
+    expected, expected_counts = bin_by_temperature(intensities, temps, edges, statistic)
+    npt.assert_allclose(binned, expected, equal_nan=True)
+    npt.assert_array_equal(counts, expected_counts)
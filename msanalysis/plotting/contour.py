@@ -16,6 +16,9 @@ def contourf(
 
     lb, ub = (mz_lower, mz_upper)
     indices = np.where((mz > lb) & (mz < ub))[0]
+    # Slice contiguous windows so memory-mapped intensities are only viewed, not copied
+    if indices.size > 0 and indices[-1] - indices[0] + 1 == indices.size:
+        indices = slice(indices[0], indices[-1] + 1)
     trimmed_mz = mz[indices]
     trimmed_intensities = intensities[:, indices]
 